@@ -84,7 +84,8 @@ def create_tables():
                         SELECT table_name 
                         FROM information_schema.tables 
                         WHERE table_schema = 'public' 
-                        AND table_name IN ('mismatch_contract')
+                        AND table_name IN ('mismatch_contract', 'po_consumption', 'po_consumption_line',
+                                           'po_consumption_invoice')
                     """))
                     existing_tables = [row[0] for row in result]
 
@@ -95,7 +96,7 @@ def create_tables():
             # For SQLite and other databases, use standard inspector
             existing_tables = inspector.get_table_names()
 
-        expected_tables = ["mismatch_contract"]
+        expected_tables = ["mismatch_contract", "po_consumption", "po_consumption_line", "po_consumption_invoice"]
 
         missing_tables = [table for table in expected_tables if table not in existing_tables]
 
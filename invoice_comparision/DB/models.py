@@ -4,7 +4,7 @@ from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 from sqlalchemy import (
     Column, Integer, String, Text, Date, DateTime, Boolean, CheckConstraint, TIMESTAMP, BigInteger,
-    func, UniqueConstraint, Index
+    func, UniqueConstraint, Index, Float
 )
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
@@ -24,6 +24,53 @@ class MismatchReport(Base):
     invoice_value = Column(Text)
 
 
+class PoConsumption(Base):
+    """One row per PO (normalized po_number and vendor); locked while an invoice against it is recorded."""
+    __tablename__ = "po_consumption"
+    __table_args__ = (UniqueConstraint("po_number", "vendor", name="uq_po_consumption_po_vendor"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    po_number = Column(String(100), nullable=False)
+    vendor = Column(String(255), nullable=False, default="")
+    invoice_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
+
+    lines = relationship("PoConsumptionLine", back_populates="consumption", cascade="all, delete-orphan")
+    invoices = relationship("PoConsumptionInvoice", back_populates="consumption", cascade="all, delete-orphan")
+
+
+class PoConsumptionLine(Base):
+    """Ordered and cumulative billed quantity/amount of one PO product (normalized description)."""
+    __tablename__ = "po_consumption_line"
+    __table_args__ = (UniqueConstraint("consumption_id", "product_key", name="uq_po_consumption_line_product"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    consumption_id = Column(Integer, ForeignKey("po_consumption.id", ondelete="CASCADE"), nullable=False)
+    product_key = Column(String(500), nullable=False)
+    product_description = Column(Text)
+    ordered_quantity = Column(Float, nullable=False, default=0.0)
+    ordered_amount = Column(Float, nullable=False, default=0.0)
+    billed_quantity = Column(Float, nullable=False, default=0.0)
+    billed_amount = Column(Float, nullable=False, default=0.0)
+
+    consumption = relationship("PoConsumption", back_populates="lines")
+
+
+class PoConsumptionInvoice(Base):
+    """What one invoice contributed to a PO's ledger, so re-validating it replaces rather than adds."""
+    __tablename__ = "po_consumption_invoice"
+    __table_args__ = (UniqueConstraint("consumption_id", "invoice_number", name="uq_po_consumption_invoice"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    consumption_id = Column(Integer, ForeignKey("po_consumption.id", ondelete="CASCADE"), nullable=False)
+    invoice_number = Column(String(100), nullable=False)
+    # JSON object product_key -> [quantity, amount]
+    lines = Column(Text, nullable=False)
+    recorded_at = Column(DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
+
+    consumption = relationship("PoConsumption", back_populates="invoices")
+
+
 # Engine and session will be created when needed
 engine = None
 SessionLocal = None
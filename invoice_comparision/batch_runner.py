@@ -0,0 +1,280 @@
+"""
+Bulk parsing through the OpenAI Batch API for non-urgent backlogs.
+
+Requests are built with the same message preparation and prepared tool schemas as the
+synchronous path and written to JSONL files, split so no file exceeds the Batch API limits
+(MAX_BATCH_REQUESTS lines, MAX_BATCH_BYTES); each file is uploaded and submitted as its own
+batch. Results are validated against the document_class models and go through
+DocumentParser.finish_document, so output files and activity logs look like any other parse.
+
+Job progress is kept in <job_dir>/state.json after every step, per batch; running the same
+command again resumes after a crash (no re-upload, no re-submission, already saved documents
+are skipped).
+
+Usage:
+    python batch_runner.py jobs/nightly storage/download/Invoice/*.pdf --doctype Invoice \
+        --output-folder storage/parsed [--base-url http://127.0.0.1:8089/v1 --poll-interval 2]
+"""
+import os
+import json
+import time
+import argparse
+from openai.types.chat import ChatCompletion
+import llm_client
+import response_schemas
+import region_schemas
+import tracing
+import document_class as document_class
+from parser import DocumentParser, get_response_model
+
+ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+# Batch API input file limits; bytes are counted in decimal MB to stay clear of the cap
+MAX_BATCH_REQUESTS = 50_000
+MAX_BATCH_BYTES = 200 * 1000 * 1000
+
+
+class BatchRunner:
+    def __init__(self, parser: DocumentParser, job_dir, poll_interval=60, completion_window="24h",
+                 max_requests=MAX_BATCH_REQUESTS, max_bytes=MAX_BATCH_BYTES):
+        """
+        :param parser: Supplies message preparation, the API client settings, save_output and logging.
+        :param job_dir: Directory holding the job's request files and resumable state.
+        :param poll_interval: Seconds between batch status checks.
+        :param max_requests: Most request lines per batch input file.
+        :param max_bytes: Largest batch input file in bytes.
+        """
+        self.parser = parser
+        self.job_dir = job_dir
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.state_path = os.path.join(job_dir, "state.json")
+        os.makedirs(job_dir, exist_ok=True)
+        self.state = self.load_state()
+
+    def load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        return {"stage": "new", "requests": {}, "batches": [], "done": []}
+
+    def requests_path(self, part):
+        return os.path.join(self.job_dir, f"requests-{part:03d}.jsonl")
+
+    def save_state(self):
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(temp_path, self.state_path)
+
+    @property
+    def client(self):
+        return llm_client.get_client(self.parser.api_key, self.parser.base_url)
+
+    def log_dict(self, input_file):
+        return {"user_id": self.parser.user, "input_filename": input_file}
+
+    def build(self, paths, doctype):
+        """
+        Prepare one batch line per document, starting a new batch input file whenever the next
+        line would pass max_requests or max_bytes; cached documents are finished right away.
+        """
+        model, _ = get_response_model(doctype)
+        requests, batches, f = {}, [], None
+        try:
+            for index, input_file in enumerate(paths):
+                log_dict = self.log_dict(input_file)
+                try:
+                    with tracing.span("batch_prepare", input_file=input_file, doctype=doctype):
+                        ext = self.parser.check_input(input_file, log_dict)
+                        _, cached = self.parser.lookup_cache(input_file, doctype)
+                        if cached is not None:
+                            self.parser.finish_document(log_dict, input_file, doctype, cached[0], from_cache=True)
+                            continue
+                        messages, extraction_path = self.parser.build_messages(input_file, ext)
+                except Exception as e:
+                    self.parser.log_failure(log_dict, input_file, e)
+                    continue
+                request_model, regime, columns = model, None, None
+                if self.parser.slim_schemas:
+                    request_model, regime, columns = region_schemas.select_model(
+                        model, region_schemas.message_text(messages))
+                custom_id = f"doc-{index:06d}"
+                body = response_schemas.prepare(request_model).request_kwargs(self.parser.llm_model, messages)
+                line = (json.dumps({"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": body}) + '\n'
+                        ).encode('utf-8')
+                if len(line) > self.max_bytes:
+                    self.parser.log_failure(log_dict, input_file,
+                                            f"batch request of {len(line)} bytes exceeds the {self.max_bytes} byte file limit")
+                    continue
+                batch = batches[-1] if batches else None
+                if batch is None or len(batch["requests"]) >= self.max_requests or batch["bytes"] + len(line) > self.max_bytes:
+                    if f is not None:
+                        f.close()
+                    batch = {"requests_path": os.path.basename(self.requests_path(len(batches))), "requests": [],
+                             "bytes": 0}
+                    batches.append(batch)
+                    f = open(os.path.join(self.job_dir, batch["requests_path"]), 'wb')
+                f.write(line)
+                batch["requests"].append(custom_id)
+                batch["bytes"] += len(line)
+                requests[custom_id] = {"input_file": input_file, "doctype": doctype, "extraction_path": extraction_path,
+                                       "tax_regime": regime, "columns": sorted(columns) if columns else None}
+        finally:
+            if f is not None:
+                f.close()
+        self.state.update(stage="built", doctype=doctype, requests=requests, batches=batches, done=[])
+        self.save_state()
+        print(f"Batch job {self.job_dir}: {len(requests)} request(s) prepared in {len(batches)} batch file(s)")
+
+    def submit(self):
+        """Upload and submit every batch file not submitted yet, recording each step in the job state."""
+        for part, batch in enumerate(self.state["batches"]):
+            if "input_file_id" not in batch:
+                with open(os.path.join(self.job_dir, batch["requests_path"]), 'rb') as f:
+                    uploaded, _ = llm_client.call_with_retry(self.client.files.create, file=f, purpose="batch")
+                batch["input_file_id"] = uploaded.id
+                self.save_state()
+            if "batch_id" not in batch:
+                created, _ = llm_client.call_with_retry(
+                    self.client.batches.create, input_file_id=batch["input_file_id"], endpoint=ENDPOINT,
+                    completion_window=self.completion_window,
+                    metadata={"job_dir": os.path.basename(self.job_dir), "part": str(part)})
+                batch["batch_id"] = created.id
+                self.save_state()
+                print(f"Batch job {self.job_dir}: part {part} submitted as {created.id}")
+        self.state["stage"] = "submitted"
+        self.save_state()
+
+    def wait(self):
+        """Poll until every batch reaches a terminal status. :return: The batch entries of the job state."""
+        while True:
+            for batch in self.state["batches"]:
+                if batch.get("batch_status") in TERMINAL_STATUSES:
+                    continue
+                retrieved, _ = llm_client.call_with_retry(self.client.batches.retrieve, batch["batch_id"])
+                counts = retrieved.request_counts
+                print(f"Batch {retrieved.id}: {retrieved.status} "
+                      f"({counts.completed if counts else 0} completed, {counts.failed if counts else 0} failed)")
+                if retrieved.status in TERMINAL_STATUSES:
+                    batch.update(batch_status=retrieved.status, output_file_id=retrieved.output_file_id,
+                                 error_file_id=retrieved.error_file_id)
+                    self.save_state()
+            if all(batch.get("batch_status") in TERMINAL_STATUSES for batch in self.state["batches"]):
+                self.state["stage"] = "finished"
+                self.save_state()
+                return self.state["batches"]
+            time.sleep(self.poll_interval)
+
+    def result_lines(self, file_id):
+        if not file_id:
+            return []
+        content, _ = llm_client.call_with_retry(self.client.files.content, file_id)
+        return [json.loads(line) for line in content.text.splitlines() if line.strip()]
+
+    def finish_result(self, entry, record):
+        input_file, doctype = entry["input_file"], entry["doctype"]
+        log_dict = self.log_dict(input_file)
+        response_data = record.get("response") or {}
+        if record.get("error") or response_data.get("status_code") != 200:
+            error = record.get("error") or response_data.get("body", {}).get("error")
+            self.parser.log_failure(log_dict, input_file, f"batch request failed: {error}")
+            return False
+        model, field = get_response_model(doctype)
+        request_model = region_schemas.slim_model(model, entry["columns"]) if entry["columns"] else model
+        try:
+            completion = ChatCompletion.model_validate(response_data["body"])
+            response = response_schemas.prepare(request_model).parse(completion)
+            if request_model is not model:
+                response = region_schemas.expand_response(response, model)
+            stats = {"extraction_path": f"batch/{entry['extraction_path']}"}
+            if entry["tax_regime"]:
+                stats.update(tax_regime=entry["tax_regime"],
+                             product_fields=len(entry["columns"] or document_class.Product.model_fields))
+            self.parser.finish_document(log_dict, input_file, doctype, response, stats=stats)
+            if self.parser.cache is not None:
+                cache_key, _ = self.parser.lookup_cache(input_file, doctype, bypass_cache=True)
+                self.parser.cache.put(cache_key, response, response.model_dump()[field], doctype, self.parser.llm_model)
+        except Exception as e:
+            self.parser.log_failure(log_dict, input_file, e)
+            return False
+        return True
+
+    def collect(self):
+        """Validate, save and log every result not handled yet. :return: (succeeded, failed)."""
+        done = set(self.state["done"])
+        succeeded = failed = 0
+        for batch in self.state["batches"]:
+            for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+                for record in self.result_lines(file_id):
+                    custom_id = record["custom_id"]
+                    if custom_id in done or custom_id not in self.state["requests"]:
+                        continue
+                    if self.finish_result(self.state["requests"][custom_id], record):
+                        succeeded += 1
+                    else:
+                        failed += 1
+                    done.add(custom_id)
+                    self.state["done"].append(custom_id)
+                    self.save_state()
+            # Requests with no result at all (batch expired, failed or was cancelled before reaching them)
+            for custom_id in batch["requests"]:
+                if custom_id not in done:
+                    entry = self.state["requests"][custom_id]
+                    self.parser.log_failure(self.log_dict(entry["input_file"]), entry["input_file"],
+                                            f"no batch result (batch {batch.get('batch_status')})")
+                    failed += 1
+                    done.add(custom_id)
+                    self.state["done"].append(custom_id)
+        self.state["stage"] = "collected"
+        self.save_state()
+        return succeeded, failed
+
+    def run(self, paths, doctype):
+        """
+        Build, submit, wait and collect, resuming from whatever stage the job directory records.
+
+        :return: dict with batch_ids, status (shared by every batch, else 'mixed'), requests,
+                 succeeded and failed.
+        """
+        if self.state["stage"] == "collected":
+            print(f"Batch job {self.job_dir} already collected")
+            return self.summary(0, 0)
+        if self.state["stage"] == "new":
+            self.build(paths, doctype)
+        if not self.state["requests"]:
+            self.state["stage"] = "collected"
+            self.save_state()
+            return self.summary(0, 0)
+        self.submit()
+        if self.state["stage"] != "finished":
+            self.wait()
+        return self.summary(*self.collect())
+
+    def summary(self, succeeded, failed):
+        statuses = {batch.get("batch_status") for batch in self.state["batches"]}
+        return {"batch_ids": [batch.get("batch_id") for batch in self.state["batches"]],
+                "status": statuses.pop() if len(statuses) == 1 else ("mixed" if statuses else None),
+                "requests": len(self.state["requests"]), "succeeded": succeeded, "failed": failed}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("job_dir")
+    arg_parser.add_argument("files", nargs="*", help="documents to parse (ignored when resuming a built job)")
+    arg_parser.add_argument("--doctype", default="Invoice", choices=["PO", "Invoice", "Contract"])
+    arg_parser.add_argument("--output-folder", default=os.path.join("storage", "parsed"))
+    arg_parser.add_argument("--base-url", help="OpenAI-compatible endpoint, e.g. the local stub_server")
+    arg_parser.add_argument("--poll-interval", type=float, default=60)
+    args = arg_parser.parse_args()
+
+    parser = DocumentParser(output_folder=args.output_folder, api_key=os.environ.get("OPENAI_API_KEY", "stub"),
+                            base_url=args.base_url, user="batch")
+    runner = BatchRunner(parser, args.job_dir, poll_interval=args.poll_interval)
+    print(json.dumps(runner.run(args.files, args.doctype), indent=2))
+
+
+if __name__ == "__main__":
+    main()
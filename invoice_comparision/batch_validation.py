@@ -0,0 +1,209 @@
+"""
+Validate a whole corpus of parsed invoices against their POs/contracts.
+
+Invoices are read in windows and grouped by the document they reference, so every PO or
+contract is loaded once per window and pre-indexed once per group (InvoicePOValidator.
+prepare_reference); groups run across a process pool and results stream back as they finish.
+Workers validate with deferred logs, which are written with ActivityLogger.insert_logs in
+batches of log_batch_size as results come in; the remainder is written when the run ends or
+the caller stops iterating.
+
+Usage:
+    python batch_validation.py storage/parsed storage/reference_index.sqlite [--store json --workers 8]
+"""
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, Tuple
+import document_store
+import comparison_plans
+from logger import ActivityLogger
+from reference_index import ReferenceIndex, normalize_reference, normalize_vendor
+from validator import InvoicePOValidator
+
+_worker_validator = None
+
+
+def _init_worker(user, use_ledger=False):
+    global _worker_validator
+    ledger = None
+    if use_ledger:
+        # Imported here so runs without the ledger need no SQLAlchemy database settings
+        from consumption_ledger import ConsumptionLedger
+        ledger = ConsumptionLedger()
+    _worker_validator = InvoicePOValidator(user=user, defer_logs=True, ledger=ledger)
+
+
+def _validate_group(doctype, reference_name, reference, invoices):
+    """
+    Validate invoices that all reference the same document. Runs in a worker process.
+
+    :return: (results, pending log entries, rule counters for this group)
+    """
+    validator = _worker_validator
+    prepared = None
+    if reference is not None:
+        try:
+            prepared = validator.prepare_reference(doctype, reference)
+        except (KeyError, TypeError, AttributeError):
+            prepared = None
+    reference_kwargs = {"PO": {"po_data": reference}, "Contract": {"contract_data": reference}}.get(doctype, {})
+    results = []
+    for invoice_id, invoice_data in invoices:
+        result = {"invoice": invoice_id, "compared_document_type": doctype, "compared_document_name": reference_name}
+        try:
+            is_mismatch, mismatches, vendor_name = validator.validate_invoice(
+                invoice_data, prepared=prepared, **reference_kwargs)
+            result.update(status="Success", is_mismatch=is_mismatch, mismatches=mismatches, vendor_name=vendor_name)
+        except Exception as e:
+            result.update(status="Error", error=str(e))
+        results.append(result)
+    pending_logs, validator.pending_logs = validator.pending_logs, []
+    rule_stats = validator.rule_stats()
+    for plan in validator.plans.values():
+        plan.reset()
+    return results, pending_logs, rule_stats
+
+
+def reference_of(invoice_data: Dict) -> Tuple[str, str]:
+    """The (doctype, number) validate_invoice would compare an invoice against, or (None, None)."""
+    contract_id = str(invoice_data.get("contract_number") or "").strip()
+    if contract_id and contract_id.upper() != "NULL":
+        return "Contract", contract_id
+    po_number = str(invoice_data.get("po_number") or "").strip()
+    if po_number and po_number.upper() != "NULL":
+        return "PO", po_number
+    return None, None
+
+
+def group_by_reference(invoices):
+    """:return: dict (doctype, normalized reference, normalized vendor) -> {number, vendor, invoices}."""
+    groups = {}
+    for invoice_id, invoice_data in invoices:
+        doctype, number = reference_of(invoice_data)
+        vendor = (invoice_data.get("shop_address") or {}).get("name")
+        key = (doctype, normalize_reference(number), normalize_vendor(vendor))
+        group = groups.setdefault(key, {"number": number, "vendor": vendor, "invoices": []})
+        group["invoices"].append((invoice_id, invoice_data))
+    return groups
+
+
+def _windows(iterable, size):
+    window = []
+    for item in iterable:
+        window.append(item)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def validate_many(invoices: Iterable[Tuple[str, Dict]], reference_source, workers=None, user="system",
+                  window=2000, chunk_size=200, logger: ActivityLogger = None, log_batch_size=500,
+                  write_logs=True, use_ledger=False) -> Iterator[Dict]:
+    """
+    Validate many invoices, yielding one result dict per invoice as groups complete.
+
+    :param invoices: Iterable of (invoice_id, invoice dict), e.g. DocumentStore.iter_documents("Invoice").
+    :param reference_source: Object with get_document(doctype, number, vendor) -> dict or None,
+                             such as a ReferenceIndex.
+    :param workers: Worker processes; None uses os.cpu_count(), 0 validates in this process.
+    :param window: Invoices grouped per round; bounds memory for very large corpora.
+    :param chunk_size: Maximum invoices per task, so one very common reference still spreads across workers.
+    :param logger: ActivityLogger for the batched log writes; created on demand.
+    :param log_batch_size: Log entries per insert_logs call; written while results are still streaming.
+    :param write_logs: False skips log writes entirely (dry runs).
+    :param use_ledger: Record PO invoices in the consumption ledger and report cumulative over-billing;
+                       workers share it through the database with per-PO row locks.
+    :return: Generator of dicts with invoice, compared_document_type, compared_document_name, status
+             and is_mismatch, mismatches, vendor_name (or error).
+    """
+    start = time.perf_counter()
+    pending_logs = []
+    logged = 0
+    rule_stats = {}
+    counts = {"invoices": 0, "references": 0, "unresolved": 0, "mismatch": 0, "error": 0}
+    executor = None
+    if workers != 0:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=(user, use_ledger))
+    else:
+        _init_worker(user, use_ledger)
+    try:
+        for batch in _windows(invoices, window):
+            tasks = []
+            for (doctype, _, _), group in group_by_reference(batch).items():
+                reference = None
+                if doctype is not None:
+                    reference = reference_source.get_document(doctype, group["number"], group["vendor"])
+                    counts["references"] += 1
+                    counts["unresolved"] += reference is None
+                for chunk in _windows(group["invoices"], chunk_size):
+                    tasks.append((doctype, group["number"], reference, chunk))
+            if executor is None:
+                outcomes = (_validate_group(*task) for task in tasks)
+            else:
+                outcomes = (future.result() for future in
+                            as_completed([executor.submit(_validate_group, *task) for task in tasks]))
+            for results, logs, stats in outcomes:
+                if write_logs:
+                    pending_logs.extend(logs)
+                    while len(pending_logs) >= log_batch_size:
+                        logger = logger or ActivityLogger(agent_name="invoice_mismatch")
+                        logger.insert_logs(pending_logs[:log_batch_size])
+                        del pending_logs[:log_batch_size]
+                        logged += log_batch_size
+                else:
+                    logged += len(logs)
+                comparison_plans.merge_stats(rule_stats, stats)
+                for result in results:
+                    counts["invoices"] += 1
+                    counts["mismatch"] += bool(result.get("is_mismatch"))
+                    counts["error"] += result["status"] == "Error"
+                    yield result
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if pending_logs:
+            logger = logger or ActivityLogger(agent_name="invoice_mismatch")
+            logger.insert_logs(pending_logs)
+            logged += len(pending_logs)
+
+    print(f"Validated {counts['invoices']} invoice(s) against {counts['references']} reference document(s) "
+          f"({counts['unresolved']} unresolved) in {time.perf_counter() - start:.1f}s: "
+          f"{counts['mismatch']} with mismatches, {counts['error']} errors, {logged} log entries")
+    for doctype, rules in rule_stats.items():
+        for name, counters in rules.items():
+            if counters["runs"]:
+                print(f"  {doctype}.{name}: {counters['hits']}/{counters['runs']} hit, {counters['mean_us']}us mean")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("parsed_dir")
+    arg_parser.add_argument("index_path")
+    arg_parser.add_argument("--store", default="json", choices=sorted(document_store.STORES))
+    arg_parser.add_argument("--workers", type=int, default=None)
+    arg_parser.add_argument("--results", help="write results as JSON lines to this file")
+    arg_parser.add_argument("--dry-run", action="store_true", help="do not write activity logs")
+    arg_parser.add_argument("--ledger", action="store_true", help="record invoices in the PO consumption ledger")
+    args = arg_parser.parse_args()
+
+    store = document_store.open_store(args.store, args.parsed_dir)
+    index = ReferenceIndex(args.index_path, store)
+    results_file = open(args.results, 'w') if args.results else None
+    try:
+        for result in validate_many(store.iter_documents("Invoice"), index, workers=args.workers,
+                                    write_logs=not args.dry_run, use_ledger=args.ledger):
+            if results_file is not None:
+                results_file.write(json.dumps(result, default=str) + '\n')
+    finally:
+        if results_file is not None:
+            results_file.close()
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
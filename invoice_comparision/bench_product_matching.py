@@ -0,0 +1,106 @@
+"""
+Benchmark of ProductMatcher on synthetic POs with OCR-style drift in the invoice descriptions
+(changed whitespace and punctuation, dropped and substituted characters).
+
+"indexed" is ProductMatcher.match; "all-pairs" scores every invoice/PO pair with the same
+similarity (only run up to --all-pairs-max lines, it is quadratic). Accuracy is the share of
+invoice lines paired with the PO line they were generated from.
+
+Usage:
+    python bench_product_matching.py --sizes 1000 2000 5000 10000 --noise 0.3
+"""
+import time
+import random
+import argparse
+from product_matching import ProductMatcher, normalize_description, trigrams
+
+NOUNS = ["BOLT", "NUT", "WASHER", "SCREW", "BEARING", "GASKET", "VALVE", "PIPE", "ELBOW", "FLANGE",
+         "CABLE", "SWITCH", "RELAY", "FUSE", "SENSOR", "MOTOR", "PUMP", "FILTER", "HOSE", "CLAMP"]
+MATERIALS = ["SS304", "SS316", "MS", "GI", "BRASS", "PVC", "HDPE", "CI", "ALU", "COPPER"]
+FINISHES = ["ZINC PLATED", "GALVANISED", "PAINTED", "POLISHED", "ANODISED", "RAW"]
+
+
+def make_products(count, rng):
+    products, seen = [], set()
+    while len(products) < count:
+        description = (f"{rng.choice(NOUNS)} {rng.choice(MATERIALS)} {rng.choice(['M', 'DN', 'SIZE '])}"
+                       f"{rng.randint(4, 400)} X {rng.randint(10, 900)}MM {rng.choice(FINISHES)}")
+        if description in seen:
+            continue
+        seen.add(description)
+        products.append({"PRODUCT_DESCRIPTION": description, "HSN": str(rng.choice([7318, 8481, 8544, 8536, 3917])),
+                         "UNIT_ITEM_PRICE": round(rng.uniform(1, 500), 2), "COUNT": rng.randint(1, 100)})
+    return products
+
+
+def drift(description, rng):
+    choice = rng.random()
+    if choice < 0.3:
+        return description.replace(' X ', 'x').replace(' ', '  ', 1).lower()
+    if choice < 0.6:
+        position = rng.randrange(len(description))
+        return description[:position] + description[position + 1:]
+    if choice < 0.8:
+        return description.replace('MM', ' mm.').replace(' ', ', ', 1)
+    position = rng.randrange(len(description))
+    return description[:position] + rng.choice("O0IL1S5") + description[position + 1:]
+
+
+def make_invoice(products, noise, rng):
+    items, truth = [], []
+    for index, product in enumerate(products):
+        if rng.random() < 0.05:
+            continue
+        item = dict(product)
+        if rng.random() < noise:
+            item["PRODUCT_DESCRIPTION"] = drift(product["PRODUCT_DESCRIPTION"], rng)
+        items.append(item)
+        truth.append(index)
+    order = list(range(len(items)))
+    rng.shuffle(order)
+    return [items[i] for i in order], [truth[i] for i in order]
+
+
+def all_pairs(products, items, min_score):
+    matcher = ProductMatcher(products, min_score=min_score)
+    result = []
+    for item in items:
+        grams = trigrams(normalize_description(item["PRODUCT_DESCRIPTION"]))
+        best = max(range(len(products)), key=lambda index: matcher.score(item, grams, index))
+        result.append((best, matcher.score(item, grams, best)))
+    return result
+
+
+def accuracy(result, truth):
+    return sum(index == expected for (index, _), expected in zip(result, truth)) / len(truth)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 5000, 10000])
+    arg_parser.add_argument("--noise", type=float, default=0.3, help="share of invoice lines with drifted text")
+    arg_parser.add_argument("--all-pairs-max", type=int, default=2000)
+    arg_parser.add_argument("--seed", type=int, default=7)
+    args = arg_parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'lines':>7} {'build ms':>9} {'match ms':>9} {'us/line':>8} {'accuracy':>9} {'all-pairs ms':>13}")
+    for size in args.sizes:
+        products = make_products(size, rng)
+        items, truth = make_invoice(products, args.noise, rng)
+        start = time.perf_counter()
+        matcher = ProductMatcher(products)
+        built = time.perf_counter()
+        result = matcher.match(items)
+        matched = time.perf_counter()
+        naive = "-"
+        if size <= args.all_pairs_max:
+            naive_start = time.perf_counter()
+            all_pairs(products, items, matcher.min_score)
+            naive = f"{(time.perf_counter() - naive_start) * 1000:.0f}"
+        print(f"{size:>7} {(built - start) * 1000:>9.0f} {(matched - built) * 1000:>9.0f} "
+              f"{(matched - built) / len(items) * 1e6:>8.0f} {accuracy(result, truth):>9.3f} {naive:>13}")
+
+
+if __name__ == "__main__":
+    main()
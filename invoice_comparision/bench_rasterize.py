@@ -0,0 +1,107 @@
+"""
+Benchmark the temp-dir rasterization path (extract_images + encode_images) against the
+in-memory streaming path (rasterizer.iter_encoded_pages), sequential and sharded across cores.
+
+Each variant runs in a fresh subprocess so peak RSS is measured independently.
+
+Usage:
+    python bench_rasterize.py storage/download/PO/*.pdf --repeat 3
+"""
+import os
+import sys
+import json
+import time
+import glob
+import base64
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+from pdf2image import convert_from_path
+import rasterizer
+
+
+def temp_dir_path(input_file):
+    # Mirrors DocumentParser.extract_images + encode_images without needing API/DB credentials
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_paths = []
+        for i, image in enumerate(convert_from_path(input_file)):
+            image_path = os.path.join(temp_dir, f'image_page_{i+1}.jpg')
+            image.save(image_path, 'JPEG')
+            image_paths.append(image_path)
+        encoded_images = []
+        for image_path in image_paths:
+            with open(image_path, "rb") as img_file:
+                encoded_images.append(base64.b64encode(img_file.read()).decode('utf-8'))
+    return encoded_images
+
+
+def in_memory_path(input_file):
+    return list(rasterizer.iter_encoded_pages(input_file))
+
+
+def parallel_path(input_file):
+    return list(rasterizer.iter_encoded_pages(input_file, max_workers=None))
+
+
+VARIANTS = {
+    "temp_dir": temp_dir_path,
+    "in_memory": in_memory_path,
+    "parallel": parallel_path,
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def run_worker(variant, input_file):
+    start = time.perf_counter()
+    encoded = VARIANTS[variant](input_file)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "wall_s": elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+        "pages": len(encoded),
+        "payload_bytes": sum(len(e) for e in encoded),
+    }))
+
+
+def run_variant(variant, input_file):
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", variant, input_file],
+        check=True, capture_output=True, text=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("pdfs", nargs="*", help="PDF files to rasterize (defaults to storage/download/**/*.pdf)")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--worker", choices=VARIANTS, help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.pdfs[0])
+        return
+
+    pdfs = args.pdfs or sorted(glob.glob(os.path.join("storage", "download", "**", "*.pdf"), recursive=True))
+    if not shutil.which("pdftoppm"):
+        sys.exit("poppler (pdftoppm) is required for this benchmark")
+
+    print(f"{'file':<40} {'variant':<10} {'pages':>5} {'wall_s':>8} {'peak_rss_mb':>12} {'payload_kb':>11}")
+    print("-" * 90)
+    for pdf in pdfs:
+        for variant in VARIANTS:
+            runs = [run_variant(variant, pdf) for _ in range(args.repeat)]
+            best = min(runs, key=lambda r: r["wall_s"])
+            print(f"{os.path.basename(pdf)[:40]:<40} {variant:<10} {best['pages']:>5} {best['wall_s']:>8.3f} "
+                  f"{max(r['peak_rss_mb'] for r in runs):>12.1f} {best['payload_bytes'] / 1024:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Microbenchmark of per-request response-model preparation.
+
+"instructor" runs instructor's handle_response_model, which rebuilds the function schema from
+the pydantic model on every call (the old generate_response path). "prepared" builds the request
+from response_schemas' cached PreparedModel. Static prompt tokens are the tool definition plus
+the instruction message sent ahead of every document; prefixes of 1024+ tokens are eligible for
+the provider's prompt cache. The "instructor" variant is skipped when instructor is not
+installed (it is no longer a dependency): pip install instructor to compare against it.
+
+Usage:
+    python bench_schema_prep.py --iterations 2000
+"""
+import json
+import time
+import argparse
+import document_class as document_class
+import response_schemas
+
+try:
+    from instructor import Mode
+    try:
+        from instructor.processing.response import handle_response_model
+    except ImportError:
+        from instructor.process_response import handle_response_model
+except ImportError:
+    handle_response_model = None
+
+DOCTYPES = {
+    'PO': document_class.PO,
+    'Invoice': document_class.Invoice,
+    'Contract': document_class.Contract,
+}
+OLD_INSTRUCTION = {"role": "user", "content": "Your goal is to extract structured information from the provided document."}
+CACHEABLE_PREFIX_TOKENS = 1024
+
+
+def count_tokens(text):
+    try:
+        import tiktoken
+        return len(tiktoken.get_encoding("o200k_base").encode(text))
+    except ImportError:
+        return len(text) // 4
+
+
+def instructor_prep(model):
+    _, kwargs = handle_response_model(model, mode=Mode.TOOLS, messages=[OLD_INSTRUCTION])
+    return kwargs
+
+
+def prepared_prep(model):
+    return response_schemas.prepare(model).request_kwargs("gpt-4o", [])
+
+
+def static_tokens(kwargs):
+    return count_tokens(json.dumps(kwargs["tools"])) + sum(count_tokens(m["content"]) for m in kwargs["messages"])
+
+
+def time_per_call(fn, model, iterations):
+    fn(model)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(model)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--iterations", type=int, default=2000)
+    args = arg_parser.parse_args()
+
+    print(f"{'doctype':<10} {'variant':<11} {'us/request':>11} {'static_tokens':>14} {'cacheable':>10}")
+    print("-" * 60)
+    for doctype, model in DOCTYPES.items():
+        variants = [("prepared", prepared_prep)]
+        if handle_response_model is not None:
+            variants.insert(0, ("instructor", instructor_prep))
+        for variant, fn in variants:
+            tokens = static_tokens(fn(model))
+            print(f"{doctype:<10} {variant:<11} {time_per_call(fn, model, args.iterations):>11.1f} "
+                  f"{tokens:>14} {'yes' if tokens >= CACHEABLE_PREFIX_TOKENS else 'no':>10}")
+
+
+if __name__ == "__main__":
+    main()
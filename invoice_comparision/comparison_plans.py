@@ -0,0 +1,266 @@
+"""
+Declarative comparison rules for an invoice against its reference document.
+
+PLANS lists, per reference doctype, the rules InvoicePOValidator applies: which fields to read
+from each document, how to compare them (a COMPARATORS kind), with what tolerance, under which
+mismatch category and severity. compile_plan() turns the rules into a flat list of closures
+with the field paths pre-split, once per validator; ComparisonPlan.run() executes them in order
+and keeps per-rule counters and timings.
+
+Adding a check is a new entry in PLANS (or a new comparator kind plus an entry), not a change
+to the validator. Severities: "blocking" stops the plan when the rule finds a mismatch,
+"error" and "warning" are reported and the plan continues.
+"""
+import time
+from product_matching import normalize_description
+from line_comparison import NUMERIC_FIELDS
+
+SEVERITIES = ("blocking", "error", "warning")
+
+PLANS = {
+    "PO": [
+        {"name": "products", "kind": "products", "reference_label": "PO_value", "severity": "error"},
+        {"name": "seller_address", "kind": "fields", "reference": "shop_address", "invoice": "shop_address",
+         "category": "seller_address", "reference_label": "PO_value", "severity": "error"},
+        {"name": "buyer_address", "kind": "fields", "reference": "billing_address", "invoice": "billing_address",
+         "category": "buyer_address", "reference_label": "PO_value", "severity": "error"},
+    ],
+    "Contract": [
+        {"name": "contract_number", "kind": "value", "reference": "contract_number", "invoice": "contract_number",
+         "normalize": "strip", "category": "Contract Number", "reference_label": "Contract", "as_list": True,
+         "severity": "blocking"},
+        {"name": "milestone", "kind": "milestone", "invoice": "milestone", "category": "Milestone",
+         "reference_label": "Contract", "severity": "error"},
+        {"name": "milestone_billing", "kind": "milestone_amount", "invoice": "total_bill.final_total",
+         "reference": "total_contract_value", "category": "Billing", "reference_label": "Contract",
+         "tolerance": 0.01, "severity": "error"},
+        {"name": "seller_address", "kind": "fields", "reference": "seller_address", "invoice": "shop_address",
+         "category": "seller_address", "reference_label": "Contract", "severity": "error"},
+        {"name": "buyer_address", "kind": "fields", "reference": "buyer_address", "invoice": "billing_address",
+         "category": "buyer_address", "reference_label": "Contract", "severity": "error"},
+    ],
+}
+
+
+def compile_path(path):
+    """'total_bill.final_total' -> function returning data['total_bill']['final_total'] or None."""
+    keys = tuple(path.split('.'))
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda data: data.get(key) if isinstance(data, dict) else None
+
+    def get(data):
+        for key in keys:
+            if not isinstance(data, dict):
+                return None
+            data = data.get(key)
+        return data
+    return get
+
+
+NORMALIZERS = {
+    "exact": lambda value: value,
+    "strip": lambda value: str(value if value is not None else "").strip(),
+    "casefold": lambda value: str(value if value is not None else "").strip().casefold(),
+}
+
+
+def product_field_diffs(invoice_products, matches, numeric_diffs, reference_label="PO_value"):
+    """
+    Field-level differences of matched product pairs.
+
+    :param matches: Matched reference product (or None) per invoice product.
+    :param numeric_diffs: Per invoice product, the numeric fields outside tolerance (or None).
+    :return: List of (invoice product description, {field: {reference_label: value, 'Invoice': value}}).
+    """
+    found = []
+    for inv_prod, ref_prod, differing in zip(invoice_products, matches, numeric_diffs):
+        if ref_prod is None:
+            continue
+        desc = inv_prod["PRODUCT_DESCRIPTION"]
+        field_diffs = {}
+        for key, value in inv_prod.items():
+            if key not in ref_prod:
+                continue
+            if key == "PRODUCT_DESCRIPTION":
+                differs = normalize_description(desc) != normalize_description(ref_prod[key])
+            elif key in NUMERIC_FIELDS:
+                differs = key in differing
+            else:
+                differs = value != ref_prod[key]
+            if differs:
+                field_diffs[key] = {"Invoice": value, reference_label: ref_prod[key]}
+        if field_diffs:
+            found.append((desc, field_diffs))
+    return found
+
+
+def fields_comparator(rule):
+    """Every key of two sub-dicts (addresses); one finding listing the keys that differ."""
+    get_reference, get_invoice = compile_path(rule["reference"]), compile_path(rule["invoice"])
+    category, label = rule["category"], rule["reference_label"]
+
+    def check(invoice, reference, context):
+        reference_value, invoice_value = get_reference(reference) or {}, get_invoice(invoice) or {}
+        detail = {key: {label: reference_value.get(key), 'Invoice': invoice_value.get(key)}
+                  for key in set(reference_value) | set(invoice_value)
+                  if reference_value.get(key) != invoice_value.get(key)}
+        return [(category, detail)] if detail else []
+    return check
+
+
+def value_comparator(rule):
+    """One scalar on each side, normalized, optionally within a numeric tolerance."""
+    get_reference, get_invoice = compile_path(rule["reference"]), compile_path(rule["invoice"])
+    normalize = NORMALIZERS[rule.get("normalize", "exact")]
+    tolerance = rule.get("tolerance")
+    category, label, as_list = rule["category"], rule["reference_label"], rule.get("as_list", False)
+
+    def check(invoice, reference, context):
+        reference_value, invoice_value = normalize(get_reference(reference)), normalize(get_invoice(invoice))
+        if tolerance is None:
+            same = reference_value == invoice_value
+        else:
+            try:
+                same = abs(float(reference_value) - float(invoice_value)) <= tolerance + 1e-9
+            except (TypeError, ValueError):
+                same = reference_value == invoice_value
+        if same:
+            return []
+        detail = {label: reference_value, "Invoice": invoice_value}
+        return [(category, [detail] if as_list else detail)]
+    return check
+
+
+def milestone_comparator(rule):
+    """The invoice's milestone must be in the contract payment schedule (context['milestones'])."""
+    get_invoice = compile_path(rule["invoice"])
+    category, label = rule["category"], rule["reference_label"]
+
+    def check(invoice, reference, context):
+        milestone = str(get_invoice(invoice) or "").strip().lower()
+        match = context["milestones"].get(milestone)
+        context["milestone"], context["milestone_match"] = milestone, match
+        if match is None:
+            return [(category, {label: None, "Invoice": milestone})]
+        return []
+    return check
+
+
+def milestone_amount_comparator(rule):
+    """Invoice total against the matched milestone's percentage of the contract value."""
+    get_invoice, get_reference = compile_path(rule["invoice"]), compile_path(rule["reference"])
+    category, label, tolerance = rule["category"], rule["reference_label"], rule.get("tolerance", 0.0)
+
+    def check(invoice, reference, context):
+        match = context.get("milestone_match")
+        if match is None:
+            return []
+        expected = round((float(match["percentage"]) / 100) * float(get_reference(reference)), 2)
+        invoice_total = round(float(get_invoice(invoice)), 2)
+        if abs(invoice_total - expected) <= tolerance + 1e-9:
+            return []
+        return [(category, {str(context["milestone"]): {label: expected, "Invoice": invoice_total}})]
+    return check
+
+
+def products_comparator(rule):
+    """Matched product rows (context['matches'], context['numeric_diffs']); one finding per product."""
+    label = rule["reference_label"]
+
+    def check(invoice, reference, context):
+        return product_field_diffs(invoice["product"], context["matches"], context["numeric_diffs"], label)
+    return check
+
+
+COMPARATORS = {
+    "fields": fields_comparator,
+    "value": value_comparator,
+    "milestone": milestone_comparator,
+    "milestone_amount": milestone_amount_comparator,
+    "products": products_comparator,
+}
+
+
+class CompiledRule:
+    __slots__ = ("name", "severity", "check", "runs", "hits", "findings", "seconds")
+
+    def __init__(self, name, severity, check):
+        self.name = name
+        self.severity = severity
+        self.check = check
+        self.runs = self.hits = self.findings = 0
+        self.seconds = 0.0
+
+
+class ComparisonPlan:
+    def __init__(self, doctype, rules):
+        self.doctype = doctype
+        self.rules = rules
+
+    def run(self, invoice, reference, context):
+        """
+        :param context: Shared per-comparison state: prepared reference tables, product matches.
+        :return: List of (rule, category, detail) in rule order; stops after a blocking finding.
+        """
+        findings = []
+        clock = time.perf_counter
+        for rule in self.rules:
+            start = clock()
+            found = rule.check(invoice, reference, context)
+            rule.seconds += clock() - start
+            rule.runs += 1
+            if not found:
+                continue
+            rule.hits += 1
+            rule.findings += len(found)
+            findings.extend((rule, category, detail) for category, detail in found)
+            if rule.severity == "blocking":
+                break
+        return findings
+
+    def reset(self):
+        for rule in self.rules:
+            rule.runs = rule.hits = rule.findings = 0
+            rule.seconds = 0.0
+
+    def stats(self):
+        """:return: dict rule name -> runs, hits, findings, total_ms, mean_us."""
+        return {rule.name: {"runs": rule.runs, "hits": rule.hits, "findings": rule.findings,
+                            "total_ms": round(rule.seconds * 1000, 3),
+                            "mean_us": round(rule.seconds / rule.runs * 1e6, 2) if rule.runs else 0.0}
+                for rule in self.rules}
+
+
+def merge_stats(total, stats):
+    """Add rule_stats() output (doctype -> rule -> counters) of another validator into total."""
+    for doctype, rules in stats.items():
+        for name, counters in rules.items():
+            merged = total.setdefault(doctype, {}).setdefault(name, {"runs": 0, "hits": 0, "findings": 0,
+                                                                    "total_ms": 0.0})
+            for key in ("runs", "hits", "findings", "total_ms"):
+                merged[key] += counters[key]
+            merged["mean_us"] = round(merged["total_ms"] * 1000 / merged["runs"], 2) if merged["runs"] else 0.0
+    return total
+
+
+def compile_plan(doctype, rules):
+    compiled = []
+    for rule in rules:
+        if rule["kind"] not in COMPARATORS:
+            raise ValueError(f"Rule {rule.get('name')!r}: unknown comparator kind {rule['kind']!r}")
+        severity = rule.get("severity", "error")
+        if severity not in SEVERITIES:
+            raise ValueError(f"Rule {rule.get('name')!r}: severity must be one of {', '.join(SEVERITIES)}")
+        compiled.append(CompiledRule(rule.get("name", rule["kind"]), severity, COMPARATORS[rule["kind"]](rule)))
+    return ComparisonPlan(doctype, compiled)
+
+
+def compile_plans(plans=None):
+    """:param plans: doctype -> rule list; defaults to PLANS. :return: doctype -> ComparisonPlan."""
+    return {doctype: compile_plan(doctype, rules) for doctype, rules in (plans or PLANS).items()}
+
+
+def as_mismatches(findings):
+    """Findings in the validator's mismatch structure: [{'Issue_category': c, c: detail}, ...]."""
+    return [{"Issue_category": category, category: detail} for _, category, detail in findings]
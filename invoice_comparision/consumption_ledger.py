@@ -0,0 +1,255 @@
+"""
+Cumulative consumption of purchase orders across partial and multi-invoice billing.
+
+For every PO (normalized po_number and vendor) the ledger keeps, per product, the ordered
+quantity/amount and what all recorded invoices have billed so far, plus each invoice's own
+contribution. Validating an invoice is then O(its lines): read the PO's ledger rows, add the
+invoice, compare with the order, write back - in one transaction holding a row lock on the PO,
+so workers validating invoices against the same PO are serialized and never lose an update.
+Re-validating an invoice replaces its earlier contribution instead of adding it twice.
+
+Row locks (SELECT ... FOR UPDATE) need PostgreSQL, the configured database; on SQLite each
+consume() starts with a write, so the database-wide write lock serializes writers instead.
+
+Usage (rebuild the ledger from already parsed invoices):
+    python consumption_ledger.py rebuild storage/parsed storage/reference_index.sqlite [--store json]
+"""
+import json
+import argparse
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from DB.models import PoConsumption, PoConsumptionLine, PoConsumptionInvoice, get_session_local
+import document_store
+from product_matching import ProductMatcher, normalize_description
+from reference_index import ReferenceIndex, normalize_reference, normalize_vendor
+
+QUANTITY_TOLERANCE = 0.0
+AMOUNT_TOLERANCE = 0.01
+# PO matchers kept while rebuilding; invoice history is not grouped by PO
+REBUILD_MATCHER_CACHE = 256
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def ordered_lines(po_data):
+    """:return: product_key -> [description, quantity, amount] of a PO; repeated lines are summed."""
+    ordered = {}
+    for product in po_data.get("product", []):
+        key = normalize_description(product.get("PRODUCT_DESCRIPTION"))
+        quantity = _number(product.get("COUNT"))
+        entry = ordered.setdefault(key, [product.get("PRODUCT_DESCRIPTION"), 0.0, 0.0])
+        entry[1] += quantity
+        entry[2] += quantity * _number(product.get("UNIT_ITEM_PRICE"))
+    return ordered
+
+
+def billed_lines(invoice_data, matches):
+    """
+    :param matches: Matched PO product (or None) per invoice product, as InvoicePOValidator.match_products.
+    :return: PO product_key -> [quantity, amount] billed by this invoice; unmatched lines are left out.
+    """
+    billed = {}
+    for product, po_product in zip(invoice_data.get("product", []), matches):
+        if po_product is None:
+            continue
+        key = normalize_description(po_product.get("PRODUCT_DESCRIPTION"))
+        quantity = _number(product.get("COUNT"))
+        entry = billed.setdefault(key, [0.0, 0.0])
+        entry[0] += quantity
+        entry[1] += quantity * _number(product.get("UNIT_ITEM_PRICE"))
+    return billed
+
+
+class ConsumptionLedger:
+    def __init__(self, session_factory=None, quantity_tolerance=QUANTITY_TOLERANCE,
+                 amount_tolerance=AMOUNT_TOLERANCE):
+        """
+        :param session_factory: SQLAlchemy sessionmaker; defaults to DB.models.get_session_local().
+        """
+        self.session_factory = session_factory or get_session_local()
+        self.quantity_tolerance = quantity_tolerance
+        self.amount_tolerance = amount_tolerance
+
+    def _lock_po(self, session, po_number, vendor):
+        """The PO's ledger header, created if needed, locked until the transaction ends."""
+        if session.get_bind().dialect.name == "sqlite":
+            # SQLite ignores FOR UPDATE and pysqlite only opens a transaction before a write: take
+            # the write lock now, before the ledger rows are read, and keep the savepoint below
+            # inside that transaction (on its own, releasing it would commit the header)
+            session.query(PoConsumption).filter_by(po_number=po_number, vendor=vendor).update(
+                {"invoice_count": PoConsumption.invoice_count}, synchronize_session=False)
+        query = session.query(PoConsumption).filter_by(po_number=po_number, vendor=vendor).with_for_update()
+        header = query.one_or_none()
+        if header is not None:
+            return header
+        try:
+            with session.begin_nested():
+                session.add(PoConsumption(po_number=po_number, vendor=vendor, invoice_count=0))
+        except IntegrityError:
+            # Another worker inserted it concurrently; the unique constraint waited for that insert to commit
+            pass
+        return query.one()
+
+    def consume(self, po_data, invoice_data, matches, record=True):
+        """
+        Add an invoice to its PO's ledger and report lines billed beyond the order.
+
+        :param matches: Matched PO product (or None) per invoice product.
+        :param record: False only checks; nothing is written.
+        :return: List of issues in validate_po's mismatch_data format ("Issue": "PO quantity exceeded").
+        """
+        po_number = normalize_reference(po_data.get("po_number"))
+        if po_number is None:
+            return []
+        vendor = normalize_vendor((po_data.get("shop_address") or {}).get("name"))
+        invoice_number = str(invoice_data.get("invoice_number") or "").strip()
+        ordered = ordered_lines(po_data)
+        billed = billed_lines(invoice_data, matches)
+        # Without an invoice number a re-validation could not be told apart from a new invoice
+        record = record and bool(invoice_number)
+
+        session = self.session_factory()
+        try:
+            header = self._lock_po(session, po_number, vendor)
+            lines = {line.product_key: line for line in
+                     session.query(PoConsumptionLine).filter_by(consumption_id=header.id)}
+            previous_record = (session.query(PoConsumptionInvoice)
+                               .filter_by(consumption_id=header.id, invoice_number=invoice_number)
+                               .one_or_none()) if invoice_number else None
+            previous = json.loads(previous_record.lines) if previous_record is not None else {}
+
+            issues = []
+            for key in ordered.keys() | billed.keys() | previous.keys():
+                line = lines.get(key)
+                if line is None:
+                    line = PoConsumptionLine(consumption_id=header.id, product_key=key, ordered_quantity=0.0,
+                                             ordered_amount=0.0, billed_quantity=0.0, billed_amount=0.0)
+                    lines[key] = line
+                    session.add(line)
+                if key in ordered:
+                    line.product_description, line.ordered_quantity, line.ordered_amount = ordered[key]
+                before_quantity = line.billed_quantity - previous.get(key, [0.0, 0.0])[0]
+                before_amount = line.billed_amount - previous.get(key, [0.0, 0.0])[1]
+                quantity, amount = billed.get(key, [0.0, 0.0])
+                line.billed_quantity, line.billed_amount = before_quantity + quantity, before_amount + amount
+                if not quantity:
+                    continue
+                over_quantity = line.billed_quantity > line.ordered_quantity + self.quantity_tolerance
+                over_amount = line.billed_amount > line.ordered_amount + self.amount_tolerance
+                if over_quantity or over_amount:
+                    issues.append({
+                        "Issue": "PO quantity exceeded" if over_quantity else "PO amount exceeded",
+                        "Item": line.product_description or key,
+                        "Quantity PO": line.ordered_quantity,
+                        "Quantity Billed Before": before_quantity,
+                        "Quantity Invoice": quantity,
+                        "Amount PO": round(line.ordered_amount, 2),
+                        "Amount Billed Before": round(before_amount, 2),
+                        "Amount Invoice": round(amount, 2),
+                    })
+
+            if not record:
+                session.rollback()
+                return issues
+            if previous_record is None:
+                session.add(PoConsumptionInvoice(consumption_id=header.id, invoice_number=invoice_number,
+                                                 lines=json.dumps(billed)))
+                header.invoice_count += 1
+            else:
+                previous_record.lines = json.dumps(billed)
+            header.updated_at = datetime.now()
+            session.commit()
+            return issues
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def consumption(self, po_number, vendor=None):
+        """:return: product_key -> {description, ordered_quantity, ordered_amount, billed_quantity, billed_amount}."""
+        session = self.session_factory()
+        try:
+            query = session.query(PoConsumptionLine).join(PoConsumption).filter(
+                PoConsumption.po_number == normalize_reference(po_number))
+            if vendor is not None:
+                query = query.filter(PoConsumption.vendor == normalize_vendor(vendor))
+            return {line.product_key: {"description": line.product_description,
+                                       "ordered_quantity": line.ordered_quantity,
+                                       "ordered_amount": line.ordered_amount,
+                                       "billed_quantity": line.billed_quantity,
+                                       "billed_amount": line.billed_amount} for line in query}
+        finally:
+            session.close()
+
+    def clear(self):
+        session = self.session_factory()
+        try:
+            for model in (PoConsumptionInvoice, PoConsumptionLine, PoConsumption):
+                session.query(model).delete()
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def rebuild(self, invoices, reference_source):
+        """
+        Recreate the ledger from invoice history.
+
+        :param invoices: Iterable of (invoice_id, invoice dict), e.g. DocumentStore.iter_documents("Invoice").
+        :param reference_source: Object with get_document(doctype, number, vendor), such as a ReferenceIndex.
+        :return: dict with recorded, skipped (no PO number or PO not found) and over_billed counts.
+        """
+        self.clear()
+        matchers = {}
+        counts = {"recorded": 0, "skipped": 0, "over_billed": 0}
+        for invoice_id, invoice_data in invoices:
+            po_number = str(invoice_data.get("po_number") or "").strip()
+            contract_id = str(invoice_data.get("contract_number") or "").strip()
+            vendor = (invoice_data.get("shop_address") or {}).get("name")
+            po_data = None
+            # Invoices billed against a contract are validated against it, not a PO
+            if (not contract_id or contract_id.upper() == "NULL") and po_number.upper() != "NULL":
+                po_data = reference_source.get_document("PO", po_number, vendor)
+            if po_data is None:
+                counts["skipped"] += 1
+                continue
+            key = (normalize_reference(po_data.get("po_number")),
+                   normalize_vendor((po_data.get("shop_address") or {}).get("name")))
+            if key not in matchers:
+                if len(matchers) >= REBUILD_MATCHER_CACHE:
+                    matchers.clear()
+                matchers[key] = ProductMatcher(po_data.get("product", []))
+            matches = [None if index is None else po_data["product"][index]
+                       for index, _ in matchers[key].match(invoice_data.get("product", []))]
+            if self.consume(po_data, invoice_data, matches):
+                counts["over_billed"] += 1
+            counts["recorded"] += 1
+        return counts
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("command", choices=["rebuild"])
+    arg_parser.add_argument("parsed_dir")
+    arg_parser.add_argument("index_path")
+    arg_parser.add_argument("--store", default="json", choices=sorted(document_store.STORES))
+    args = arg_parser.parse_args()
+
+    store = document_store.open_store(args.store, args.parsed_dir)
+    index = ReferenceIndex(args.index_path, store)
+    counts = ConsumptionLedger().rebuild(store.iter_documents("Invoice"), index)
+    index.close()
+    print(f"Ledger rebuilt: {counts['recorded']} invoice(s) recorded, {counts['skipped']} skipped, "
+          f"{counts['over_billed']} over-billing their PO")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from typing import List
-from pydantic import BaseModel, Field, conint
+from pydantic import BaseModel, Field, conint, create_model
 from datetime import date
 
 
@@ -95,6 +95,20 @@ class PO(BaseModel):
     total_bill: TotalBill = Field(description="details of the total amount, discounts, and taxes")
 
 
+def header_model(model, name):
+    """The header part of a document model: every field except the product rows, with the same definitions."""
+    fields = {field_name: (field.annotation, field) for field_name, field in model.model_fields.items()
+              if field_name != "product"}
+    return create_model(name, **fields)
+
+
+InvoiceHeader = header_model(Invoice, "InvoiceHeader")
+POHeader = header_model(PO, "POHeader")
+ProductPage = create_model("ProductPage", product=(
+    Invoice.model_fields["product"].annotation,
+    Field(description="the billed product rows printed on the provided pages only, in the order they appear")))
+
+
 class Contract(BaseModel):
     contract_number: str = Field(description="Unique identifier for the contract")
     seller_address: Shop_Address = Field(description="The address of the seller involved in the contract")
@@ -0,0 +1,294 @@
+import os
+import json
+import uuid
+import threading
+import contextlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def _require(module, name):
+    if module is None:
+        raise ImportError(f"{name} is required for this document store: pip install {name}")
+
+
+@contextlib.contextmanager
+def _atomic_file(path):
+    """
+    Binary file that replaces path when the block succeeds. It is written under a temp name
+    unique to this writer, so processes saving the same document never write into each other's file.
+    """
+    temp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, 'xb') as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class DocumentStore:
+    """
+    Storage for parsed documents under storage/parsed, addressed by doctype and document name
+    (the input file name without extension).
+
+    Subclasses implement put/get_bytes/names; load() validates straight from the stored bytes.
+    """
+    extension = ""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def put(self, doctype, name, data):
+        """
+        :param data: JSON-compatible dict (response.model_dump(mode="json")).
+        :return: (location, size) - where the document was stored and its encoded size in bytes.
+        """
+        raise NotImplementedError
+
+    def get_bytes(self, doctype, name):
+        """:return: The stored encoding of a document, or None if it is not stored."""
+        raise NotImplementedError
+
+    def names(self, doctype):
+        raise NotImplementedError
+
+    def decode(self, blob):
+        return json.loads(blob)
+
+    def get(self, doctype, name):
+        """:return: The document as a dict, or None."""
+        blob = self.get_bytes(doctype, name)
+        return None if blob is None else self.decode(blob)
+
+    def load(self, doctype, name, model):
+        """:return: The document validated into model, or None."""
+        blob = self.get_bytes(doctype, name)
+        if blob is None:
+            return None
+        return model.model_validate_json(blob)
+
+    def iter_documents(self, doctype):
+        """Yield (name, dict) for every stored document of a doctype."""
+        for name in self.names(doctype):
+            document = self.get(doctype, name)
+            if document is not None:
+                yield name, document
+
+    def export_json(self, doctype, name, path):
+        """Write one document as indented JSON for people to read."""
+        with open(path, 'w') as f:
+            json.dump(self.get(doctype, name), f, indent=2)
+        return path
+
+
+class FileStore(DocumentStore):
+    """One file per document in <root>/<doctype>/."""
+
+    def path(self, doctype, name):
+        return os.path.join(self.root, doctype, name + self.extension)
+
+    def encode(self, data):
+        raise NotImplementedError
+
+    def put(self, doctype, name, data):
+        path = self.path(doctype, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        blob = self.encode(data)
+        with _atomic_file(path) as f:
+            f.write(blob)
+        return path, len(blob)
+
+    def get_bytes(self, doctype, name):
+        try:
+            with open(self.path(doctype, name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def names(self, doctype):
+        directory = os.path.join(self.root, doctype)
+        if not os.path.isdir(directory):
+            return []
+        with os.scandir(directory) as entries:
+            return sorted(entry.name[:-len(self.extension)] for entry in entries
+                          if entry.is_file() and entry.name.endswith(self.extension))
+
+
+class JsonStore(FileStore):
+    """Indented JSON, the original storage/parsed layout; easiest for people to read and diff."""
+    extension = ".json"
+
+    def encode(self, data):
+        return json.dumps(data, indent=2).encode('utf-8')
+
+
+class OrjsonStore(FileStore):
+    """Compact JSON written and read with orjson; files stay valid .json."""
+    extension = ".json"
+
+    def __init__(self, root):
+        _require(orjson, "orjson")
+        super().__init__(root)
+
+    def encode(self, data):
+        return orjson.dumps(data)
+
+    def decode(self, blob):
+        return orjson.loads(blob)
+
+
+class MsgpackStore(FileStore):
+    """msgpack per document: the smallest files and the fastest decode to dicts."""
+    extension = ".msgpack"
+
+    def __init__(self, root):
+        _require(msgpack, "msgpack")
+        super().__init__(root)
+
+    def encode(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def decode(self, blob):
+        return msgpack.unpackb(blob, raw=False)
+
+    def load(self, doctype, name, model):
+        document = self.get(doctype, name)
+        return None if document is None else model.model_validate(document)
+
+
+class SegmentStore(DocumentStore):
+    """
+    Append-only segment file per doctype with an offset index.
+
+    <root>/<doctype>.seg holds compact JSON records back to back; <root>/<doctype>.idx has one
+    JSON line {name, offset, length} per write and is loaded into memory, later lines winning, so
+    a rewrite of a document is just another append. Scans read the segment sequentially instead of
+    opening one file per document. Index lines pointing past the end of the segment (a crash
+    between the two writes) are ignored. Writes are serialized per process; use one writer process.
+    """
+    extension = ".seg"
+
+    def __init__(self, root):
+        _require(orjson, "orjson")
+        super().__init__(root)
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def segment_path(self, doctype):
+        return os.path.join(self.root, doctype + ".seg")
+
+    def index_path(self, doctype):
+        return os.path.join(self.root, doctype + ".idx")
+
+    def _index(self, doctype):
+        index = self._indexes.get(doctype)
+        if index is not None:
+            return index
+        index = {}
+        segment_size = os.path.getsize(self.segment_path(doctype)) if os.path.exists(self.segment_path(doctype)) else 0
+        if os.path.exists(self.index_path(doctype)):
+            with open(self.index_path(doctype), 'rb') as f:
+                for line in f:
+                    try:
+                        entry = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        continue
+                    if entry["offset"] + entry["length"] <= segment_size:
+                        index[entry["name"]] = (entry["offset"], entry["length"])
+        self._indexes[doctype] = index
+        return index
+
+    def put(self, doctype, name, data):
+        blob = orjson.dumps(data)
+        with self._lock:
+            index = self._index(doctype)
+            with open(self.segment_path(doctype), 'ab') as segment:
+                offset = segment.tell()
+                segment.write(blob)
+            with open(self.index_path(doctype), 'ab') as index_file:
+                index_file.write(orjson.dumps({"name": name, "offset": offset, "length": len(blob)}) + b'\n')
+            index[name] = (offset, len(blob))
+        return f"{self.segment_path(doctype)}#{name}", len(blob)
+
+    def get_bytes(self, doctype, name):
+        with self._lock:
+            location = self._index(doctype).get(name)
+        if location is None:
+            return None
+        offset, length = location
+        with open(self.segment_path(doctype), 'rb') as segment:
+            segment.seek(offset)
+            return segment.read(length)
+
+    def decode(self, blob):
+        return orjson.loads(blob)
+
+    def names(self, doctype):
+        with self._lock:
+            return sorted(self._index(doctype))
+
+    def iter_documents(self, doctype):
+        with self._lock:
+            entries = sorted(self._index(doctype).items(), key=lambda item: item[1][0])
+        if not entries:
+            return
+        with open(self.segment_path(doctype), 'rb') as segment:
+            for name, (offset, length) in entries:
+                segment.seek(offset)
+                yield name, orjson.loads(segment.read(length))
+
+    def compact(self, doctype):
+        """Rewrite the segment with only the latest version of each document."""
+        with self._lock:
+            entries = sorted(self._index(doctype).items(), key=lambda item: item[1][0])
+            segment_path, index_path = self.segment_path(doctype), self.index_path(doctype)
+            new_index = {}
+            # The segment is moved into place first, then its index, both after the old segment is closed
+            with _atomic_file(index_path) as index_file, _atomic_file(segment_path) as new:
+                with open(segment_path, 'rb') as old:
+                    for name, (offset, length) in entries:
+                        old.seek(offset)
+                        new_offset = new.tell()
+                        new.write(old.read(length))
+                        index_file.write(orjson.dumps({"name": name, "offset": new_offset, "length": length}) + b'\n')
+                        new_index[name] = (new_offset, length)
+            self._indexes[doctype] = new_index
+
+
+STORES = {
+    "json": JsonStore,
+    "orjson": OrjsonStore,
+    "msgpack": MsgpackStore,
+    "segment": SegmentStore,
+}
+
+
+def open_store(kind, root):
+    """:param kind: 'json', 'orjson', 'msgpack' or 'segment'."""
+    if kind not in STORES:
+        raise ValueError(f"Unknown document store {kind!r}; use one of {', '.join(STORES)}")
+    return STORES[kind](root)
+
+
+def migrate(source, target, doctypes=("PO", "Invoice", "Contract")):
+    """Copy every document from one store to another, e.g. JsonStore -> SegmentStore. :return: Count copied."""
+    copied = 0
+    for doctype in doctypes:
+        for name, document in source.iter_documents(doctype):
+            target.put(doctype, name, document)
+            copied += 1
+    return copied
@@ -0,0 +1,232 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from PIL import Image
+import rasterizer
+import text_layer
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+# 16x16 difference hash: a 64-bit hash of a 9x8 thumbnail is too coarse to tell apart
+# different invoices printed on the same vendor template
+HASH_SIZE = 16
+HASH_BITS = HASH_SIZE * HASH_SIZE
+# The hash reads a 17x16 thumbnail: a 50 dpi render (or a 512px image) is already far finer
+HASH_DPI = 50
+HASH_MAX_DIMENSION = 512
+OCR_DPI = 200
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """
+    Difference hash of a page: robust to re-scans, re-exports, JPEG noise and small scale changes,
+    which all change the file bytes but not the page layout.
+    """
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def hash_document(input_file, dpi=HASH_DPI, max_dimension=HASH_MAX_DIMENSION):
+    """
+    Perceptual hashes of every page, rendered only as large as the 17x16 thumbnail needs.
+
+    :return: List of HASH_BITS-bit page hashes in page order.
+    """
+    hashes = []
+    for image in rasterizer.iter_page_images(input_file, dpi=dpi, grayscale=True, max_dimension=max_dimension):
+        try:
+            hashes.append(dhash(image))
+        finally:
+            image.close()
+    return hashes
+
+
+def content_digest(input_file):
+    """
+    Digest of a PDF's text layer with whitespace normalized, to confirm a hash match by content.
+
+    :return: Hex SHA-256, or None for images and PDFs without a text layer (scans).
+    """
+    if not input_file.lower().endswith('.pdf'):
+        return None
+    pages = [re.sub(r'\s+', ' ', text).strip() for text in text_layer.extract_page_texts(input_file)]
+    if not any(pages):
+        return None
+    return hashlib.sha256('\f'.join(pages).encode('utf-8')).hexdigest()
+
+
+def confirm_match(entry, digest):
+    """
+    :return: True if both documents have a text layer and it is the same, False if it differs,
+             None when either has no text layer (confirm_header can decide instead).
+    """
+    if digest is None or not entry.get("content_digest"):
+        return None
+    return entry["content_digest"] == digest
+
+
+def document_text(input_file, ocr_dpi=OCR_DPI):
+    """
+    :return: The PDF text layer, else Tesseract text of the pages, else None (no pytesseract).
+    """
+    if input_file.lower().endswith('.pdf'):
+        page_texts = text_layer.extract_page_texts(input_file)
+        if any(text.strip() for text in page_texts):
+            return '\n'.join(page_texts)
+    if pytesseract is None:
+        return None
+    pages = []
+    for image in rasterizer.iter_page_images(input_file, dpi=ocr_dpi, grayscale=True):
+        try:
+            pages.append(pytesseract.image_to_string(image))
+        finally:
+            image.close()
+    return '\n'.join(pages)
+
+
+def _compact(value):
+    """'INV/2024-0789' -> 'INV20240789'; OCR spacing and punctuation are not compared."""
+    return re.sub(r'[^0-9A-Z]', '', str(value).upper())
+
+
+def header_values(data, number_field):
+    """
+    Header fields of an earlier parse that a re-scan of the same document must show.
+
+    :return: dict with number, vendor and total (compacted), leaving out fields the parse lacks.
+    """
+    values = {
+        "number": data.get(number_field),
+        "vendor": (data.get("shop_address") or {}).get("name"),
+        "total": None,
+    }
+    total = (data.get("total_bill") or {}).get("final_total")
+    try:
+        # Printed as 10,000.00 or 10000.00: both compact to the same digits
+        values["total"] = f"{float(total):.2f}"
+    except (TypeError, ValueError):
+        pass
+    return {name: _compact(value) for name, value in values.items()
+            if value and str(value).upper() != "NULL" and _compact(value)}
+
+
+def confirm_header(data, number_field, text):
+    """
+    Confirm a hash match by the earlier parse's document number, vendor and final total
+    appearing in the new document's text, for scans that have no text layer to digest.
+
+    :return: True if every header value is found, False if neither the number nor the total is,
+             None when only some are found or there is no text (the match is unconfirmed).
+    """
+    values = header_values(data, number_field)
+    if not text or "number" not in values:
+        return None
+    compact = _compact(text)
+    found = {name for name, value in values.items() if value in compact}
+    if found == set(values):
+        return True
+    if not found & {"number", "total"}:
+        return False
+    return None
+
+
+class DuplicateIndex:
+    """
+    Near-duplicate index of parsed documents keyed by per-page perceptual hashes.
+
+    Hashes are split into bands; by the pigeonhole principle two hashes within max_distance bits
+    share at least one identical band when bands > max_distance, so candidates come from exact
+    band lookups and only those are checked with a full Hamming distance.
+
+    A hash match is only a candidate: documents on the same template can look alike at any
+    resolution, so callers confirm it with confirm_match (text layers) or confirm_header (scans)
+    before reusing an earlier parse.
+    """
+
+    def __init__(self, index_path, max_distance=12, bands=16):
+        """
+        :param index_path: JSON-lines file the index is persisted to and reloaded from.
+        :param max_distance: Maximum Hamming distance per page (of HASH_BITS) for a candidate duplicate.
+        :param bands: Number of equal bit bands used for candidate lookup; must exceed max_distance.
+        """
+        if bands <= max_distance or HASH_BITS % bands:
+            raise ValueError(f"bands must divide {HASH_BITS} and be greater than max_distance")
+        self.index_path = index_path
+        self.max_distance = max_distance
+        self.bands = bands
+        self.band_bits = HASH_BITS // bands
+        self.entries = []
+        self.buckets = {}
+        self._lock = threading.Lock()
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        # Entries hashed with a different hash size cannot be compared
+                        if all(len(h) == HASH_BITS // 4 for h in entry["page_hashes"]):
+                            self._index(entry)
+
+    def _band_keys(self, doctype, page_count, page_hash):
+        mask = (1 << self.band_bits) - 1
+        return [(doctype, page_count, band, (page_hash >> (band * self.band_bits)) & mask)
+                for band in range(self.bands)]
+
+    def _index(self, entry):
+        entry_id = len(self.entries)
+        self.entries.append(entry)
+        first_page = int(entry["page_hashes"][0], 16)
+        for key in self._band_keys(entry["doctype"], len(entry["page_hashes"]), first_page):
+            self.buckets.setdefault(key, []).append(entry_id)
+
+    def find(self, doctype, page_hashes):
+        """
+        :return: (entry, distance) for the closest indexed document of the same doctype and page
+                 count whose every page is within max_distance, or None.
+        """
+        if not page_hashes:
+            return None
+        best = None
+        with self._lock:
+            candidates = set()
+            for key in self._band_keys(doctype, len(page_hashes), page_hashes[0]):
+                candidates.update(self.buckets.get(key, ()))
+            for entry_id in candidates:
+                entry = self.entries[entry_id]
+                distance = max(hamming(int(h, 16), page_hash)
+                               for h, page_hash in zip(entry["page_hashes"], page_hashes))
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (entry, distance)
+        return best
+
+    def add(self, doctype, page_hashes, parsed_path, file_num, input_file, content_digest=None):
+        if not page_hashes:
+            return
+        entry = {
+            "doctype": doctype,
+            "page_hashes": [f"{page_hash:0{HASH_BITS // 4}x}" for page_hash in page_hashes],
+            "content_digest": content_digest,
+            "parsed_path": parsed_path,
+            "file_num": file_num,
+            "input_file": input_file,
+        }
+        with self._lock:
+            self._index(entry)
+            with open(self.index_path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
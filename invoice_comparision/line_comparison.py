@@ -0,0 +1,65 @@
+"""
+Columnar comparison of matched invoice/PO product rows.
+
+All numeric Product fields of all matched pairs are loaded into two float arrays and compared
+in one pass with per-field absolute and relative tolerances, so rounding noise (0.01 on a
+price, float artefacts in tax amounts) is not reported as a mismatch.
+"""
+import numpy as np
+import pandas as pd
+import document_class as document_class
+
+NUMERIC_FIELDS = [name for name, field in document_class.Product.model_fields.items()
+                  if field.annotation in (int, float)]
+# field -> (absolute tolerance, relative tolerance); a pair matches when
+# |invoice - po| <= absolute + relative * max(|invoice|, |po|)
+DEFAULT_TOLERANCE = (0.01, 0.0)
+DEFAULT_TOLERANCES = {
+    "COUNT": (0.0, 0.0),
+    "UNIT_ITEM_PRICE": (0.01, 0.0),
+    "DISCOUNT_RATE": (0.005, 0.0),
+    "CGST_RATE": (0.005, 0.0),
+    "SGST_RATE": (0.005, 0.0),
+    "GST_RATE": (0.005, 0.0),
+    "PRODUCT_TOTAL_PRICE": (0.01, 0.0005),
+    "TAXABLE_AMOUNT": (0.01, 0.0005),
+    "NET_AMOUNT": (0.01, 0.0005),
+    "GROSS_AMOUNT": (0.01, 0.0005),
+}
+
+
+class LineComparator:
+    def __init__(self, tolerances: dict = None):
+        """
+        :param tolerances: Overrides of DEFAULT_TOLERANCES, field -> (absolute, relative).
+        """
+        self.tolerances = {**DEFAULT_TOLERANCES, **(tolerances or {})}
+        self.absolute = np.array([self.tolerances.get(f, DEFAULT_TOLERANCE)[0] for f in NUMERIC_FIELDS])
+        self.relative = np.array([self.tolerances.get(f, DEFAULT_TOLERANCE)[1] for f in NUMERIC_FIELDS])
+
+    @staticmethod
+    def numeric_matrix(rows):
+        """rows x NUMERIC_FIELDS float array; missing or non-numeric values are NaN."""
+        frame = pd.DataFrame(rows, columns=NUMERIC_FIELDS)
+        return frame.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+
+    def numeric_mismatches(self, invoice_rows, po_rows):
+        """
+        :param invoice_rows: Invoice product dicts.
+        :param po_rows: The PO product dict matched to each of them.
+        :return: Per pair, the set of numeric fields that differ beyond tolerance.
+        """
+        if not invoice_rows:
+            return []
+        invoice_values, po_values = self.numeric_matrix(invoice_rows), self.numeric_matrix(po_rows)
+        allowed = self.absolute + self.relative * np.fmax(np.abs(invoice_values), np.abs(po_values))
+        # Small epsilon so that a difference of exactly the tolerance survives float error
+        outside = np.abs(invoice_values - po_values) > allowed + 1e-9
+        unparsed = np.isnan(invoice_values) | np.isnan(po_values)
+        mismatched = [set(np.asarray(NUMERIC_FIELDS)[row].tolist()) for row in outside & ~unparsed]
+        # Values that did not parse as numbers (or are absent) fall back to exact comparison
+        for pair, field_index in zip(*np.nonzero(unparsed)):
+            field = NUMERIC_FIELDS[field_index]
+            if invoice_rows[pair].get(field) != po_rows[pair].get(field):
+                mismatched[pair].add(field)
+        return mismatched
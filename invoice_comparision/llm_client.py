@@ -0,0 +1,204 @@
+import time
+import random
+import asyncio
+import weakref
+import threading
+import email.utils
+from datetime import timezone
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+POOL_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=120)
+REQUEST_TIMEOUT = httpx.Timeout(180.0, connect=10.0)
+
+_lock = threading.Lock()
+_clients = {}
+# event loop -> ({(api_key, base_url): client}, closer task); keyed on the loop object, so a new
+# loop never inherits clients of an old one that happened to share its id()
+_async_clients = weakref.WeakKeyDictionary()
+_response_hooks = []
+
+
+def add_response_hook(hook):
+    """
+    Register a callable that receives the headers of every API response on the shared clients,
+    e.g. RateLimitGovernor.observe_headers.
+    """
+    with _lock:
+        if hook not in _response_hooks:
+            _response_hooks.append(hook)
+
+
+def _dispatch_response(response):
+    for hook in list(_response_hooks):
+        hook(response.headers)
+
+
+async def _adispatch_response(response):
+    # Hooks may write shared state (RateLimitGovernor with a SQLite store), so keep them off the event loop
+    await asyncio.to_thread(_dispatch_response, response)
+
+
+def get_client(api_key, base_url=None):
+    """
+    Process-wide OpenAI client for an API key / base URL.
+
+    Structured responses are requested with precompiled tool schemas (response_schemas), so
+    the plain client is used rather than an instructor wrapper.
+
+    The underlying httpx pool is shared by every DocumentParser and thread, so keep-alive
+    connections and TLS sessions survive across documents. The SDK's own retries are disabled;
+    call_with_retry handles them so they can be counted.
+    """
+    key = (api_key, base_url)
+    with _lock:
+        if key not in _clients:
+            http_client = httpx.Client(limits=POOL_LIMITS, timeout=REQUEST_TIMEOUT,
+                                       event_hooks={"response": [_dispatch_response]})
+            _clients[key] = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+        return _clients[key]
+
+
+def get_async_client(api_key, base_url=None):
+    """
+    Async counterpart of get_client.
+
+    httpx async connections are bound to the event loop that opened them, so clients are
+    pooled per running loop. They are closed when asyncio.run() finishes the loop, or earlier
+    with aclose_async_clients().
+    """
+    loop = asyncio.get_running_loop()
+    key = (api_key, base_url)
+    with _lock:
+        if loop not in _async_clients:
+            # The loop only keeps weak references to tasks; the closer is held here
+            closer = loop.create_task(_close_at_shutdown(loop), name="llm-client-closer")
+            _async_clients[loop] = ({}, closer)
+        clients, _ = _async_clients[loop]
+        if key not in clients:
+            http_client = httpx.AsyncClient(limits=POOL_LIMITS, timeout=REQUEST_TIMEOUT,
+                                            event_hooks={"response": [_adispatch_response]})
+            clients[key] = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+        return clients[key]
+
+
+async def _close_at_shutdown(loop):
+    # asyncio.run() cancels the tasks still pending before it closes the loop, which lands here
+    try:
+        await loop.create_future()
+    finally:
+        await aclose_async_clients(loop)
+
+
+async def aclose_async_clients(loop=None):
+    """
+    Close the pooled async clients of an event loop (the running one by default).
+
+    Needed only for loops not driven by asyncio.run(); later get_async_client calls open new clients.
+    """
+    loop = loop or asyncio.get_running_loop()
+    with _lock:
+        clients, closer = _async_clients.pop(loop, ({}, None))
+    if closer is not None and closer is not asyncio.current_task():
+        closer.cancel()
+    for client in clients.values():
+        await client.close()
+
+
+def _api_error(error):
+    """Find the OpenAI SDK error behind an exception, looking through wrapping exceptions."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, openai.APIError):
+            return error
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def status_code(error):
+    """HTTP status behind a failed API call, or None for connection-level failures."""
+    api_error = _api_error(error)
+    return api_error.status_code if isinstance(api_error, openai.APIStatusError) else None
+
+
+def is_retryable(error):
+    api_error = _api_error(error)
+    if isinstance(api_error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(api_error, openai.APIStatusError) and api_error.status_code in RETRYABLE_STATUS
+
+
+def retry_after_seconds(error):
+    """Read Retry-After / retry-after-ms from a failed response, if the server sent one."""
+    api_error = _api_error(error)
+    response = getattr(api_error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get('retry-after-ms'):
+        try:
+            return float(headers['retry-after-ms']) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get('retry-after')
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        # An unreadable header must not hide the error being retried
+        return None
+    if parsed.tzinfo is None:
+        # HTTP dates are GMT; '-0000' parses as a naive datetime
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+def backoff_delay(attempt, error, base_delay=1.0, max_delay=60.0):
+    """Exponential backoff with full jitter, overridden by the server's Retry-After when present."""
+    retry_after = retry_after_seconds(error)
+    if retry_after is not None:
+        return min(retry_after, max_delay)
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def call_with_retry(fn, *args, max_retries=5, base_delay=1.0, max_delay=60.0, **kwargs):
+    """
+    Call fn, retrying transient API failures (429, 5xx, timeouts, dropped connections).
+
+    :return: (result, retries) where retries is the number of failed attempts before success.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs), attempt
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, e, base_delay, max_delay)
+            print(f"LLM call failed ({e.__class__.__name__}), retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+async def acall_with_retry(fn, *args, max_retries=5, base_delay=1.0, max_delay=60.0, **kwargs):
+    """Async counterpart of call_with_retry; fn must return an awaitable."""
+    attempt = 0
+    while True:
+        try:
+            return await fn(*args, **kwargs), attempt
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, e, base_delay, max_delay)
+            print(f"LLM call failed ({e.__class__.__name__}), retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -0,0 +1,72 @@
+"""
+Offline throughput test of the full DocumentParser path (prepare -> LLM -> save -> log) against
+the stub OpenAI server.
+
+Starts stub_server in-process unless --base-url points at one already running. Outputs go to a
+temporary folder; activity logs go wherever ActivityLogger is configured.
+
+Usage:
+    python load_test.py storage/download/Invoice/*.pdf --doctype Invoice --copies 20 --concurrency 16 \
+        --latency lognormal:1200,0.4 --rate-429 0.05
+"""
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+import stub_server
+from parser import DocumentParser
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+async def run(parser, paths, doctype, concurrency, timeout):
+    start = time.perf_counter()
+    latencies, statuses = [], {}
+    async for result in parser.process_batch(paths, doctype, concurrency=concurrency, timeout=timeout,
+                                             bypass_cache=True):
+        latencies.append(time.perf_counter() - start)
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+    return time.perf_counter() - start, latencies, statuses
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("files", nargs="+")
+    arg_parser.add_argument("--doctype", default="Invoice", choices=["PO", "Invoice", "Contract"])
+    arg_parser.add_argument("--copies", type=int, default=10, help="times each file is submitted")
+    arg_parser.add_argument("--concurrency", type=int, default=8)
+    arg_parser.add_argument("--timeout", type=float, default=300)
+    arg_parser.add_argument("--base-url", help="use an already running stub instead of starting one")
+    arg_parser.add_argument("--latency", default="lognormal:1200,0.4")
+    arg_parser.add_argument("--rate-429", type=float, default=0.0)
+    arg_parser.add_argument("--rate-500", type=float, default=0.0)
+    args = arg_parser.parse_args()
+
+    server = state = None
+    base_url = args.base_url
+    if base_url is None:
+        state = stub_server.StubState(latency=args.latency, rate_429=args.rate_429, rate_500=args.rate_500)
+        server = stub_server.serve(port=0, state=state)
+        base_url = f"http://127.0.0.1:{server.server_port}/v1"
+
+    paths = [path for path in args.files for _ in range(args.copies)]
+    with tempfile.TemporaryDirectory() as output_folder:
+        parser = DocumentParser(output_folder=output_folder, api_key="stub", base_url=base_url, user="load_test")
+        wall, latencies, statuses = asyncio.run(run(parser, paths, args.doctype, args.concurrency, args.timeout))
+
+    print(f"documents: {len(paths)}  statuses: {statuses}")
+    print(f"wall: {wall:.2f}s  throughput: {len(paths) / wall:.2f} docs/s")
+    print(f"completion time p50: {statistics.median(latencies):.2f}s  p95: {percentile(latencies, 0.95):.2f}s")
+    print(f"extraction paths: {parser.extraction_paths}")
+    if state is not None:
+        print(f"stub: {json.dumps(state.stats())}")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
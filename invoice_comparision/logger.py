@@ -49,13 +49,11 @@ class ActivityLogger:
                 schema = {column: dtype for column, dtype in rows}
         return schema
 
-    def insert_log(self, log_data: dict):
+    def check_log_data(self, log_data: dict):
         """
-        Insert a log entry into the agent-specific log table using a dictionary.
+        Validate a log entry against the agent-specific table schema.
 
-        :param log_data: A dictionary where keys are column names (excluding 'id'),
-                        and values are the corresponding data to insert.
-        :raises ValueError: If the dictionary contains unknown columns.
+        :raises ValueError: If the dictionary contains unknown columns or values of the wrong type.
         """
         schema = self.table_schema
         schema_keys = set(schema.keys()) - {'id'}
@@ -92,8 +90,9 @@ class ActivityLogger:
                     f"Invalid type for '{key}': expected {expected_py_type.__name__}, got {type(log_data[key]).__name__}"
                 )
 
-        # 4. Build insert query
-        insert_cols = list(input_keys)
+    def log_insert_query(self, log_data: dict):
+        """:return: (query, values) inserting log_data and returning the new row id."""
+        insert_cols = list(log_data.keys())
         values = [log_data[col] for col in insert_cols]
         placeholders = ', '.join(['%s'] * len(insert_cols))
         columns_str = ', '.join(f'"{col}"' for col in insert_cols)
@@ -103,6 +102,18 @@ class ActivityLogger:
             VALUES ({placeholders})
             RETURNING id;
         """)
+        return insert_query, values
+
+    def insert_log(self, log_data: dict):
+        """
+        Insert a log entry into the agent-specific log table using a dictionary.
+
+        :param log_data: A dictionary where keys are column names (excluding 'id'),
+                        and values are the corresponding data to insert.
+        :raises ValueError: If the dictionary contains unknown columns.
+        """
+        self.check_log_data(log_data)
+        insert_query, values = self.log_insert_query(log_data)
 
         print(insert_query)
 
@@ -114,6 +125,44 @@ class ActivityLogger:
         # current row ID
         return inserted[0]
 
+    def insert_logs(self, entries: List[dict]) -> List[int]:
+        """
+        Insert many log entries, with their mismatch items and fields, over one connection in one
+        transaction.
+
+        :param entries: dicts with 'log' (as for insert_log), 'doc_type' ('PO' or 'Contract') and
+                        'fields' (mismatch data as for insert_fields, or None).
+        :return: The inserted log ids in entry order.
+        """
+        for entry in entries:
+            self.check_log_data(entry["log"])
+        field_tables = {
+            "Contract": ("invoice_mismatch_contract_fields", "contract_value", "Contract"),
+            "PO": ("invoice_mismatch_po_fields", "po_value", "PO_value"),
+        }
+        item_query = "INSERT INTO invoice_mismatch_items (log_id, item_name) VALUES (%s, %s) RETURNING id;"
+        log_ids = []
+        with self._get_connection() as conn:
+            with conn.cursor() as cur:
+                for entry in entries:
+                    cur.execute(*self.log_insert_query(entry["log"]))
+                    log_id = cur.fetchone()[0]
+                    log_ids.append(log_id)
+                    if not entry.get("fields"):
+                        continue
+                    table, value_column, value_key = field_tables[entry["doc_type"]]
+                    field_query = (f"INSERT INTO {table} (item_id, field_name, {value_column}, invoice_value) "
+                                   f"VALUES (%s, %s, %s, %s);")
+                    for item in entry["fields"]["mismatches"]:
+                        category = item["Issue_category"]
+                        cur.execute(item_query, (log_id, category))
+                        item_id = cur.fetchone()[0]
+                        cur.executemany(field_query, [(item_id, key, sub_item[value_key], sub_item["Invoice"])
+                                                      for key, sub_item in item[category].items()])
+            conn.commit()
+        print(f"Inserted {len(log_ids)} log entries into {self.table_name}")
+        return log_ids
+
     def insert_items(self, log_id: int, category: str):
         item_table_name = "invoice_mismatch_items"
         item_column = "log_id, item_name"
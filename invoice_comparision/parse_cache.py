@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import hashlib
+import datetime
+import threading
+from typing import Optional, Tuple, Type
+from pydantic import BaseModel
+
+
+class ParseCache:
+    """
+    Content-addressed on-disk cache for parsed documents.
+
+    Entries are keyed by the SHA-256 of the input file bytes, the doctype, a hash of the
+    pydantic model schema and the LLM model name, so a change in any of them is a miss.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024,
+                 max_age_seconds: Optional[float] = 30 * 24 * 3600):
+        """
+        :param cache_dir: Directory holding one JSON file per cached parse.
+        :param max_bytes: Upper bound for the total size of the cache directory.
+        :param max_age_seconds: Entries older than this are treated as misses and evicted. None disables it.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._schema_hashes = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def file_digest(input_file: str) -> str:
+        digest = hashlib.sha256()
+        with open(input_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def schema_hash(self, model: Type[BaseModel]) -> str:
+        if model not in self._schema_hashes:
+            schema = json.dumps(model.model_json_schema(), sort_keys=True)
+            self._schema_hashes[model] = hashlib.sha256(schema.encode('utf-8')).hexdigest()
+        return self._schema_hashes[model]
+
+    def make_key(self, input_file: str, doctype: str, model: Type[BaseModel], llm_model: str) -> str:
+        parts = [self.file_digest(input_file), doctype, self.schema_hash(model), llm_model]
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _is_expired(self, mtime: float, now: float) -> bool:
+        return self.max_age_seconds is not None and now - mtime > self.max_age_seconds
+
+    def get(self, key: str, model: Type[BaseModel]) -> Optional[Tuple[BaseModel, str]]:
+        """
+        Look up a cached parse.
+
+        :return: (pydantic object, file_num) on a hit, None on a miss.
+        """
+        path = self._entry_path(key)
+        try:
+            stat = os.stat(path)
+            if self._is_expired(stat.st_mtime, time.time()):
+                os.remove(path)
+                raise FileNotFoundError(path)
+            with open(path, 'r') as f:
+                entry = json.load(f)
+            response = model.model_validate(entry["response"])
+        except (FileNotFoundError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # Touch the entry so size-based eviction drops the least recently used files first
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            # Evicted by another thread or process between the read and the touch
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return response, entry["file_num"]
+
+    def put(self, key: str, response: BaseModel, file_num: str, doctype: str, llm_model: str):
+        entry = {
+            "doctype": doctype,
+            "llm_model": llm_model,
+            "file_num": file_num,
+            "created": datetime.datetime.now().isoformat(),
+            # JSON mode renders dates the same way DocumentStore.put stores parsed output
+            "response": response.model_dump(mode="json"),
+        }
+        path = self._entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones until the cache fits in max_bytes."""
+        now = time.time()
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if self._is_expired(stat.st_mtime, now):
+                self._remove(path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                self._remove(os.path.join(self.cache_dir, name))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -1,32 +1,127 @@
 import os
+import time
+import asyncio
 import base64
 import json
 import shutil
-from pdf2image import convert_from_path
-from openai import OpenAI
-import instructor
 import datetime
-import tempfile
 import pandas as pd
-from docx import Document
 from logger import ActivityLogger
+from parse_cache import ParseCache
+from document_store import DocumentStore, JsonStore
+from reference_index import ReferenceIndex
+import rasterizer
+import text_layer
+import tabular_reader
+from duplicate_index import DuplicateIndex, hash_document, content_digest, confirm_match, confirm_header, document_text
+from template_extractor import TemplateExtractor
+import tracing
+from payload_optimizer import PayloadOptimizer
+import llm_client
+import response_schemas
+import region_schemas
+import reextraction
+from rate_governor import RateLimitGovernor, estimate_request_tokens
+from sharded_extraction import ShardedExtractor, SPLIT_MODELS
 import document_class as document_class  # Assuming this contains your Invoice model
 
 
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.pdf']
+TEXT_EXTENSIONS = ['.docx', '.xlsx', '.xls']
+TABULAR_EXTENSIONS = ['.docx', '.xlsx']
+
+DOCTYPE_MODELS = {
+    'PO': (document_class.PO, 'po_number'),
+    'Invoice': (document_class.Invoice, 'invoice_number'),
+    'Contract': (document_class.Contract, 'contract_number'),
+}
+
+
+def record_usage(span, completion):
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens,
+                 total_tokens=usage.total_tokens)
+        details = getattr(usage, "prompt_tokens_details", None)
+        if details is not None and details.cached_tokens is not None:
+            span.set(cached_prompt_tokens=details.cached_tokens)
+
+
+def count_pages(encoded_pages):
+    """Add each page and its encoded size to the current span (encode_pages) as it is produced."""
+    for encoded in encoded_pages:
+        span = tracing.current_span()
+        if span is not None:
+            span.add("pages", 1)
+            span.add("bytes", encoded["bytes"] if isinstance(encoded, dict) else len(encoded))
+        yield encoded
+
+
+def get_response_model(doctype):
+    if doctype not in DOCTYPE_MODELS:
+        raise ValueError("Unsupported document type. Use 'PO', 'Invoice', or 'Contract'.")
+    return DOCTYPE_MODELS[doctype]
+
+
 class DocumentParser:
-    def __init__(self, output_folder, api_key, user="system"):
+    def __init__(self, output_folder, api_key, user="system", llm_model='gpt-4o', cache: ParseCache = None,
+                 raster_dpi=200, raster_grayscale=False, raster_max_dimension=None, jpeg_quality=75,
+                 raster_workers=None, use_text_layer=True, payload_optimizer: PayloadOptimizer = None,
+                 max_retries=5, governor: RateLimitGovernor = None,
+                 shard_page_threshold=None, shard_group_size=4, shard_workers=4,
+                 duplicate_index: DuplicateIndex = None, trace_path=None, slim_schemas=True,
+                 local_extractor: TemplateExtractor = None, local_confidence=0.9, base_url=None,
+                 document_store: DocumentStore = None, reference_index: ReferenceIndex = None):
         self.user = user
         self.output_folder = output_folder
         self.api_key = api_key
+        self.llm_model = llm_model
+        # OpenAI-compatible endpoint override, e.g. stub_server.py for offline load tests
+        self.base_url = base_url
+        self.cache = cache
+        self.raster_dpi = raster_dpi
+        self.raster_grayscale = raster_grayscale
+        self.raster_max_dimension = raster_max_dimension
+        self.jpeg_quality = jpeg_quality
+        # Cap on parallel page-render workers; None scales to every available core
+        self.raster_workers = raster_workers
+        self.use_text_layer = use_text_layer
+        self.payload_optimizer = payload_optimizer
+        self.max_retries = max_retries
+        # Optional throughput governor; share one instance across parsers to pace the whole process
+        self.governor = governor
+        if governor is not None:
+            llm_client.add_response_hook(governor.observe_headers)
+        # PDF invoices/POs longer than shard_page_threshold pages are extracted in page groups; None disables it
+        self.shard_page_threshold = shard_page_threshold
+        self.sharded_extractor = ShardedExtractor(self, pages_per_group=shard_group_size, max_workers=shard_workers)
+        self.duplicate_index = duplicate_index
+        # Request only the product columns a document's text shows it has, expanded back to Product afterwards
+        self.slim_schemas = slim_schemas
+        # Per-stage spans go to this JSON-lines file; tracing.configure() also offers an OpenTelemetry exporter
+        if trace_path:
+            tracing.configure(trace_path)
+        # Schemas, tool definitions and system prefixes for every doctype are compiled once per process
+        response_schemas.prepare_all()
+        # First extraction tier for PDFs/images; results below local_confidence escalate to the LLM
+        self.local_extractor = local_extractor
+        self.local_confidence = local_confidence
+        self.local_attempts = 0
+        self.escalations = 0
+        self.extraction_paths = {"text": 0, "hybrid": 0, "vision": 0, "sharded": 0, "tabular": 0, "local": 0}
         self.activity_logger = ActivityLogger(agent_name="parser")
         if not os.path.exists(self.output_folder):
             os.makedirs(self.output_folder)
+        # Where parsed documents are written; indented JSON files under output_folder unless configured
+        self.document_store = document_store or JsonStore(self.output_folder)
+        # PO/contract lookup by reference number for the validator, updated on every save
+        self.reference_index = reference_index
 
     def extract_images(self,input_file,temp_dir):
         image_paths = []
         if input_file.lower().endswith('.pdf'):
 
-            images = convert_from_path(input_file)
+            images = rasterizer.iter_pdf_pages(input_file, max_workers=self.raster_workers)
 
             for i, image in enumerate(images):
                 image_path = os.path.join(temp_dir, f'image_page_{i+1}.jpg')
@@ -42,14 +137,19 @@ class DocumentParser:
         return image_paths
 
     def extract_text(self, input_file):
-        if input_file.lower().endswith('.docx'):
-            doc = Document(input_file)
-            return '\n'.join([p.text for p in doc.paragraphs])
-        elif input_file.lower().endswith(('.xlsx', '.xls')):
+        if input_file.lower().endswith(('.docx', '.xlsx')):
+            # Streams the workbook/document and keeps DOCX tables, which doc.paragraphs drops
+            return tabular_reader.document_text(input_file)
+        elif input_file.lower().endswith('.xls'):
             dfs = pd.read_excel(input_file, sheet_name=None)
             return '\n'.join([df.to_string(index=False) for df in dfs.values()])
         elif input_file.lower().endswith('.pdf'):
-            return None  # Image-based, handled separately
+            # Digitally generated PDFs carry a usable text layer; scanned ones are handled as images
+            page_texts = text_layer.extract_page_texts(input_file)
+            text_pages, vision_pages = text_layer.classify_pages(page_texts)
+            if not page_texts or vision_pages:
+                return None
+            return text_layer.format_pages(page_texts, text_pages)
         else:
             raise ValueError("Unsupported file format for text extraction.")
 
@@ -59,126 +159,683 @@ class DocumentParser:
             with open(image_path, "rb") as img_file:
                 encoded_image = base64.b64encode(img_file.read()).decode('utf-8')
                 encoded_images.append(encoded_image)
-        
+
         return encoded_images
 
-    def prepare_messages(self, encoded_images=None, text_input=None):
-        messages = [{
-            "role": "user",
-            "content": "Your goal is to extract structured information from the provided document."
-        }]
-
-        if text_input:
-            messages.append({
-                "role": "user",
-                "content": text_input
-            })
-        elif encoded_images:
-            for encoded_image in encoded_images:
-                messages.append({
-                    "role": "user",
-                    "content": [{
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/png;base64,{encoded_image}"
-                        }
-                    }]
-                })
+    def iter_encoded_pages(self, input_file, pages=None):
+        """
+        In-memory replacement for extract_images + encode_images.
+
+        Pages are rendered lazily; the work is timed in an "encode_pages" span as they are consumed.
+
+        :param pages: 1-based PDF pages to render; None renders the whole document.
+        :return: Iterable of base64 JPEG strings, or payload dicts when a payload optimizer is set.
+        """
+        quality = None if self.payload_optimizer is not None else self.jpeg_quality
+        if pages is not None:
+            encoded = rasterizer.iter_selected_pages(
+                input_file,
+                pages,
+                dpi=self.raster_dpi,
+                grayscale=self.raster_grayscale,
+                max_dimension=self.raster_max_dimension,
+                quality=quality,
+            )
+        elif quality is not None:
+            encoded = rasterizer.iter_encoded_pages(
+                input_file,
+                dpi=self.raster_dpi,
+                grayscale=self.raster_grayscale,
+                max_dimension=self.raster_max_dimension,
+                quality=quality,
+                max_workers=self.raster_workers,
+            )
         else:
+            encoded = rasterizer.iter_page_images(
+                input_file,
+                dpi=self.raster_dpi,
+                grayscale=self.raster_grayscale,
+                max_dimension=self.raster_max_dimension,
+                max_workers=self.raster_workers,
+            )
+
+        if self.payload_optimizer is not None:
+            if pages is not None:
+                page_count = len(pages)
+            elif input_file.lower().endswith('.pdf'):
+                page_count = rasterizer.pdf_page_count(input_file)
+            else:
+                page_count = 1
+            encoded = self.payload_optimizer.optimize(encoded, page_count)
+        return tracing.span_iter(count_pages(encoded), "encode_pages", input_file=input_file, pages_requested=pages)
+
+    def prepare_messages(self, encoded_images=None, text_input=None, image_mime_type="image/png"):
+        # The extraction instruction lives in the cached system prefix (response_schemas)
+        messages = []
+
+        if not text_input and encoded_images is None:
             raise ValueError("No input provided for message preparation.")
 
-        print(f"-------------------------messages for LLM")
-        print(messages)
-        print(f"=" * 50)
+        with tracing.span("prepare_messages") as span:
+            if text_input:
+                messages.append({
+                    "role": "user",
+                    "content": text_input
+                })
+                span.set(text_chars=len(text_input))
+            if encoded_images is not None:
+                # Streaming page sources render and encode lazily; that time is attributed separately
+                for encoded_image in tracing.timed_iter(encoded_images, "rasterize_encode_ms"):
+                    if isinstance(encoded_image, dict):
+                        # Page payload from PayloadOptimizer
+                        image_url = {
+                            "url": f"data:{encoded_image['mime_type']};base64,{encoded_image['data']}",
+                            "detail": encoded_image["detail"],
+                        }
+                        span.add("bytes", encoded_image["bytes"])
+                    else:
+                        image_url = {
+                            "url": f"data:{image_mime_type};base64,{encoded_image}"
+                        }
+                        span.add("bytes", len(encoded_image))
+                    span.add("pages", 1)
+                    messages.append({
+                        "role": "user",
+                        "content": [{
+                            "type": "image_url",
+                            "image_url": image_url
+                        }]
+                    })
         return messages
 
-    def generate_response(self, messages, doctype):
-        print("Generating response...")
-        if doctype == 'PO':
-            model = document_class.PO
-            field = 'po_number'
-        elif doctype == 'Invoice':
-            model = document_class.Invoice
-            field = 'invoice_number'
-        elif doctype == 'Contract':
-            model = document_class.Contract
-            field = 'contract_number'
-        else:
-            raise ValueError("Unsupported document type. Use 'PO', 'Invoice', or 'Contract'.")
+    def call_model(self, messages, response_model):
+        """
+        Run one structured-extraction request through the shared client, governor and retry policy.
+
+        :return: (response, retries)
+        """
+        with tracing.span("llm_call", model=self.llm_model, response_model=response_model.__name__) as span:
+            create = response_schemas.create
+            if self.governor is not None:
+                create = self.governor.wrap(create, estimate_request_tokens(messages))
+            (response, completion), retries = llm_client.call_with_retry(
+                create,
+                llm_client.get_client(self.api_key, self.base_url),
+                self.llm_model,
+                response_model,
+                messages,
+                max_retries=self.max_retries,
+            )
+            span.set(retries=retries)
+            record_usage(span, completion)
+        return response, retries
 
-        response = instructor.from_openai(OpenAI(api_key=self.api_key)).chat.completions.create(
-            model='gpt-4o',
-            response_model=model,
-            messages=messages
-        )
-        print("--------------------------------Response generated.")
-        print(response)
-        print(f"="*50)
+    def select_request_model(self, text, model, stats=None):
+        """
+        Slim variant of model for the document's tax regime and column set (see region_schemas),
+        or model itself when slim schemas are disabled or do not apply.
+        """
+        if not self.slim_schemas:
+            return model
+        request_model, regime, columns = region_schemas.select_model(model, text)
+        if stats is not None and regime is not None:
+            stats["tax_regime"] = regime
+            stats["product_fields"] = len(columns or document_class.Product.model_fields)
+        return request_model
+
+    def generate_response(self, messages, doctype, stats=None):
+        """
+        :param stats: Optional dict; receives the number of transient-error retries under 'retries'.
+        """
+        with tracing.span("generate_response", doctype=doctype):
+            model, field = get_response_model(doctype)
+            request_model = self.select_request_model(region_schemas.message_text(messages), model, stats)
+
+            start = time.perf_counter()
+            response, retries = self.call_model(messages, request_model)
+            if stats is not None:
+                stats["llm_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            if request_model is not model:
+                response = region_schemas.expand_response(response, model)
+            if stats is not None:
+                stats["retries"] = retries
 
         file_num = response.model_dump()[field]
         return response, file_num
 
+    @staticmethod
+    def document_name(input_file):
+        return os.path.splitext(os.path.basename(input_file))[0]
+
     def save_output(self, response, input_file, doctype):
-        def default_serializer(obj):
-            if isinstance(obj, (datetime.date, datetime.datetime)):
-                return obj.isoformat()
-            raise TypeError(f"Type {type(obj)} not serializable")
-        
-        target_dir = os.path.join(self.output_folder, doctype)
-        os.makedirs(target_dir, exist_ok=True)
-        output_filename = os.path.splitext(os.path.basename(input_file))[0] + ".json"
-        output_path = os.path.join(target_dir, output_filename)
-        with open(output_path, 'w') as file:
-            json.dump(response.model_dump(), file, indent=2, default=default_serializer)
+        with tracing.span("save_output", doctype=doctype) as span:
+            name = self.document_name(input_file)
+            output_filename = name + self.document_store.extension
+            # mode="json" serializes dates as ISO strings
+            data = response.model_dump(mode="json")
+            output_path, size = self.document_store.put(doctype, name, data)
+            span.set(bytes=size)
+            if self.reference_index is not None:
+                self.reference_index.add(doctype, name, data, output_path)
         print(f"Output saved to {output_path}")
         return output_filename,output_path
 
-    def process_document(self, input_file, doctype):
+    def load_output(self, input_file, doctype):
+        """:return: The stored parse of input_file validated into its doctype model, or None."""
+        model, _ = get_response_model(doctype)
+        return self.document_store.load(doctype, self.document_name(input_file), model)
+
+    def check_input(self, input_file, log_dict):
+        if not os.path.exists(input_file):
+            log_dict["status"] = "Error"
+            log_dict["event_dts"] = datetime.datetime.now()
+            log_dict["comments"] = f"File not found: {input_file}"
+            self.activity_logger.insert_log(log_dict)
+            raise FileNotFoundError(f"The file {input_file} does not exist.")
+
+        ext = os.path.splitext(input_file)[1].lower()
+        if ext not in IMAGE_EXTENSIONS + TEXT_EXTENSIONS:
+            log_dict["status"] = "Error"
+            log_dict["event_dts"] = datetime.datetime.now()
+            log_dict["comments"] = f"Unsupported file type: {ext}"
+            self.activity_logger.insert_log(log_dict)
+            raise ValueError("Unsupported file type for processing.")
+        return ext
+
+    def lookup_cache(self, input_file, doctype, bypass_cache=False):
+        """
+        Resolve the cache key for a document and look it up.
+
+        :return: (cache_key, cached) where cached is (response, file_num) on a hit, otherwise None.
+        """
+        if self.cache is None:
+            return None, None
+        model, _ = get_response_model(doctype)
+        cache_key = self.cache.make_key(input_file, doctype, model, self.llm_model)
+        cached = None if bypass_cache else self.cache.get(cache_key, model)
+        return cache_key, cached
+
+    def build_page_messages(self, input_file, pages, page_texts, context=None):
+        """
+        Messages for a subset of PDF pages: pages with a usable text layer as text, the rest as images.
+
+        :param pages: 1-based page numbers, in the order they should be presented.
+        :param page_texts: Per-page text layer from text_layer.extract_page_texts (may be empty).
+        :param context: Optional note placed before the page content, e.g. which pages these are.
+        :return: (messages, extraction_path) where extraction_path is 'text', 'hybrid' or 'vision'.
+        """
+        usable = set(text_layer.classify_pages(page_texts)[0])
+        text_pages = [page for page in pages if page in usable]
+        vision_pages = [page for page in pages if page not in usable]
+
+        parts = [context] if context else []
+        if text_pages:
+            parts.append(text_layer.format_pages(page_texts, text_pages))
+            if vision_pages:
+                parts.append(f"Pages {', '.join(map(str, vision_pages))} have no usable text layer and follow as images.")
+        encoded_images = self.iter_encoded_pages(input_file, pages=vision_pages) if vision_pages else None
+        messages = self.prepare_messages(encoded_images=encoded_images, text_input='\n\n'.join(parts) or None,
+                                         image_mime_type="image/jpeg")
+        if not vision_pages:
+            return messages, "text"
+        return messages, "hybrid" if text_pages else "vision"
+
+    def build_pdf_messages(self, input_file):
+        """
+        Route a PDF to the cheapest path that preserves its content.
+
+        Pages with a usable native text layer are sent as text; only the remaining pages are
+        rasterized for the vision model.
+
+        :return: (messages, extraction_path) where extraction_path is 'text', 'hybrid' or 'vision'.
+        """
+        page_texts = text_layer.extract_page_texts(input_file) if self.use_text_layer else []
+        text_pages, vision_pages = text_layer.classify_pages(page_texts)
+        if not text_pages:
+            encoded_images = self.iter_encoded_pages(input_file)
+            return self.prepare_messages(encoded_images=encoded_images, image_mime_type="image/jpeg"), "vision"
+        return self.build_page_messages(input_file, list(range(1, len(page_texts) + 1)), page_texts)
+
+    def lookup_duplicate(self, input_file, ext, doctype, stats):
+        """
+        Look up an image/PDF document in the perceptual-hash index before paying for an extraction.
+
+        A hash match is reused only once its content is confirmed: by identical text layers or,
+        when either document is a scan, by the earlier parse's document number, vendor and total
+        appearing in the new document's text (OCR for scans). A match that cannot be confirmed
+        is parsed fresh and flagged for review in stats["suspected_duplicate_of"]. The page
+        hashes and content digest are kept in stats so finish_document can index the document
+        after a fresh parse.
+
+        :return: (response, file_num) of the earlier parse on a confirmed match, otherwise None.
+        """
+        if self.duplicate_index is None or ext not in IMAGE_EXTENSIONS:
+            return None
+        stats["page_hashes"] = hash_document(input_file)
+        stats["content_digest"] = content_digest(input_file)
+        match = self.duplicate_index.find(doctype, stats["page_hashes"])
+        if match is None:
+            return None
+
+        entry, distance = match
+        _, field = get_response_model(doctype)
+        response = self.load_output(entry["input_file"], doctype)
+        if response is None:
+            return None
+        confirmed, confirmed_by = confirm_match(entry, stats["content_digest"]), "same text layer"
+        if confirmed is None:
+            with tracing.span("confirm_duplicate", input_file=input_file):
+                text = document_text(input_file)
+            confirmed = confirm_header(response.model_dump(), field, text)
+            confirmed_by = "document number, vendor and total found in its text"
+        if confirmed is False:
+            print(f"Page hashes of {input_file} match {entry['input_file']} (distance {distance}) "
+                  f"but the content differs; parsing as a new document")
+            return None
+        stats["duplicate_distance"] = distance
+        if confirmed is None:
+            stats["suspected_duplicate_of"] = entry
+            print(f"Possible duplicate: {input_file} matches {entry['input_file']} (page hash distance {distance}), "
+                  f"unconfirmed by content; parsing and flagging for review")
+            return None
+        stats["duplicate_of"] = entry
+        stats["duplicate_confirmed_by"] = confirmed_by
+        print(f"Duplicate: {input_file} matches {entry['input_file']} (page hash distance {distance}, {confirmed_by})")
+        return response, response.model_dump()[field]
+
+    def should_shard(self, input_file, ext, doctype):
+        if self.shard_page_threshold is None or ext != '.pdf' or doctype not in SPLIT_MODELS:
+            return False
+        return rasterizer.pdf_page_count(input_file) > self.shard_page_threshold
+
+    def extract_sharded(self, input_file, doctype, stats):
+        self.extraction_paths["sharded"] += 1
+        stats["extraction_path"] = "sharded"
+        print(f"Extraction path for {input_file}: sharded")
+        return self.sharded_extractor.extract(input_file, doctype, stats)
+
+    def extract_tabular(self, input_file, doctype, stats):
+        """
+        Read line items straight from DOCX/XLSX tables and ask the LLM only for the header.
+
+        :return: (response, file_num), or None when no line-item table was found.
+        """
+        extraction = tabular_reader.read_tabular(input_file)
+        if not extraction.products:
+            return None
+        model, header_model, field = SPLIT_MODELS[doctype]
+        text_input = ("The product line items of this document were already read from its tables. "
+                      "Extract the header fields and bill totals from the remaining content.\n\n"
+                      f"{extraction.metadata}")
+        messages = self.prepare_messages(text_input=text_input)
+        header, retries = self.call_model(messages, header_model)
+        header_data = header.model_dump()
+        response = model(**header_data, product=extraction.products)
+
+        self.extraction_paths["tabular"] += 1
+        stats["extraction_path"] = "tabular"
+        stats["retries"] = retries
+        print(f"Extraction path for {input_file}: tabular ({len(extraction.products)} line items read locally)")
+        return response, header_data[field]
+
+    def extract_local(self, input_file, doctype, stats):
+        """
+        Tier 1: template rules over the text layer or OCR text, without an LLM call.
+
+        :return: (response, file_num) when the candidate reaches local_confidence, otherwise None (escalate).
+        """
+        start = time.perf_counter()
+        with tracing.span("local_extract", doctype=doctype) as span:
+            attempt = self.local_extractor.extract(input_file, doctype)
+            span.set(vendor=attempt["vendor"], source=attempt["source"], confidence=attempt["confidence"])
+        stats["local_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        # Kept so the template can learn from the LLM's answer if this document escalates
+        stats["document_text"] = attempt["text"]
+        if attempt["response"] is None:
+            print(f"Tier 1 for {input_file}: no usable template ({stats['local_ms']} ms)")
+            return None
+        self.local_attempts += 1
+        stats["local_confidence"] = attempt["confidence"]
+        if attempt["confidence"] < self.local_confidence:
+            self.escalations += 1
+            stats["escalated"] = True
+            print(f"Tier 1 for {input_file}: {attempt['vendor']} template confidence {attempt['confidence']} "
+                  f"< {self.local_confidence}, escalating ({attempt['checks']})")
+            return None
+        _, field = get_response_model(doctype)
+        self.extraction_paths["local"] += 1
+        stats["extraction_path"] = "local"
+        print(f"Extraction path for {input_file}: local ({attempt['vendor']} template, "
+              f"confidence {attempt['confidence']}, {stats['local_ms']} ms)")
+        return attempt["response"], attempt["response"].model_dump()[field]
+
+    def extract_structured(self, input_file, ext, doctype, stats):
+        """
+        Extraction paths that replace the single whole-document request.
+
+        :return: (response, file_num), or None when the document should take the standard path.
+        """
+        if self.local_extractor is not None and ext in IMAGE_EXTENSIONS and doctype in SPLIT_MODELS:
+            result = self.extract_local(input_file, doctype, stats)
+            if result is not None:
+                return result
+        if self.should_shard(input_file, ext, doctype):
+            return self.extract_sharded(input_file, doctype, stats)
+        if ext in TABULAR_EXTENSIONS and doctype in SPLIT_MODELS:
+            return self.extract_tabular(input_file, doctype, stats)
+        return None
+
+    def build_messages(self, input_file, ext):
+        """:return: (messages, extraction_path) where extraction_path is 'text', 'hybrid' or 'vision'."""
+        if ext == '.pdf':
+            messages, extraction_path = self.build_pdf_messages(input_file)
+        elif ext in IMAGE_EXTENSIONS:
+            # Handle image-based documents
+            encoded_images = self.iter_encoded_pages(input_file)
+            messages, extraction_path = self.prepare_messages(encoded_images=encoded_images, image_mime_type="image/jpeg"), "vision"
+        else:
+            # Handle text-based documents
+            text_input = self.extract_text(input_file)
+            messages, extraction_path = self.prepare_messages(text_input=text_input), "text"
+        self.extraction_paths[extraction_path] += 1
+        print(f"Extraction path for {input_file}: {extraction_path}")
+        return messages, extraction_path
+
+    def finish_document(self, log_dict, input_file, doctype, response, from_cache=False, stats=None):
+        output_filename,output_path = self.save_output(response, input_file, doctype)
+        log_dict["status"] = "Success"
+        log_dict["output_filename"] = output_filename
+        log_dict["output_file_location"] = output_path
+        log_dict["event_dts"] = datetime.datetime.now()
+        stats = stats or {}
+        if from_cache:
+            log_dict["comments"] = f"Document {input_file} served from parse cache: {output_filename} stored at {output_path}"
+        elif "duplicate_of" in stats:
+            duplicate_of = stats["duplicate_of"]
+            log_dict["comments"] = (f"Duplicate: document {input_file} matches {duplicate_of['input_file']} "
+                                    f"(page hash distance {stats['duplicate_distance']}, "
+                                    f"{stats['duplicate_confirmed_by']}); "
+                                    f"reused {duplicate_of['parsed_path']}: "
+                                    f"{output_filename} stored at {output_path}")
+        else:
+            log_dict["comments"] = (f"Document {input_file} processed successfully via {stats.get('extraction_path')} path "
+                                    f"with {stats.get('retries', 0)} LLM retries: {output_filename} stored at {output_path}")
+            if "tax_regime" in stats:
+                log_dict["comments"] += (f" ({stats['tax_regime']} schema, "
+                                         f"{stats['product_fields']} product fields requested)")
+            if "local_confidence" in stats:
+                escalation_rate = self.escalations / self.local_attempts
+                log_dict["comments"] += (f" (tier 1 confidence {stats['local_confidence']} in {stats['local_ms']} ms"
+                                         f"{', escalated' if stats.get('escalated') else ''}; "
+                                         f"escalation rate {escalation_rate:.0%} of {self.local_attempts})")
+            if "llm_ms" in stats:
+                log_dict["comments"] += f" (LLM {stats['llm_ms']} ms)"
+            if "page_groups" in stats:
+                total_check = ("matches" if stats["products_total_ok"] else
+                               f"{stats['products_total']} does NOT match {stats['bill_total']}")
+                log_dict["comments"] += (f" ({stats['page_groups']} page groups, {stats['duplicates_removed']} boundary "
+                                         f"duplicates merged, {stats['repeats_kept']} identical boundary rows kept, "
+                                         f"product total {total_check} total_bill)")
+            if "suspected_duplicate_of" in stats:
+                suspect = stats["suspected_duplicate_of"]
+                _, field = get_response_model(doctype)
+                same_number = str(response.model_dump()[field]) == str(suspect["file_num"])
+                log_dict["comments"] += (f" (NEEDS REVIEW: page hashes match {suspect['input_file']} at distance "
+                                         f"{stats['duplicate_distance']} but the content could not be confirmed; "
+                                         f"document number {'matches' if same_number else 'differs'})")
+            if self.local_extractor is not None and stats.get("document_text") and stats.get("extraction_path") != "local":
+                self.local_extractor.learn(doctype, stats["document_text"], response.model_dump())
+            if stats.get("page_hashes") and self.duplicate_index is not None:
+                _, field = get_response_model(doctype)
+                self.duplicate_index.add(doctype, stats["page_hashes"], output_path, response.model_dump()[field],
+                                         input_file, stats.get("content_digest"))
+        root = tracing.current_span()
+        if root is not None:
+            root.set(extraction_path="cache" if from_cache else stats.get("extraction_path", "duplicate"),
+                     status="Success", needs_review="suspected_duplicate_of" in stats)
+            log_dict["comments"] += f" [trace {root.trace_id}]"
+        with tracing.span("ActivityLogger.insert_log"):
+            self.activity_logger.insert_log(log_dict)
+        return output_filename
+
+    def log_failure(self, log_dict, input_file, error):
+        log_dict["status"] = "Error"
+        log_dict["event_dts"] = datetime.datetime.now()
+        log_dict["comments"] = f"Error processing document {input_file}: {str(error)}"
+        with tracing.span("ActivityLogger.insert_log"):
+            self.activity_logger.insert_log(log_dict)
+
+    def process_document(self, input_file, doctype, bypass_cache=False):
         log_dict = {
                 "user_id": self.user,
                 "input_filename": input_file,
             }
         try:
-            if not os.path.exists(input_file):
-                log_dict["status"] = "Error"
-                log_dict["event_dts"] = datetime.datetime.now()
-                log_dict["comments"] = f"File not found: {input_file}"
-                self.activity_logger.insert_log(log_dict)
-                raise FileNotFoundError(f"The file {input_file} does not exist.")
-
-            ext = os.path.splitext(input_file)[1].lower()
-
-            if ext in ['.jpg', '.jpeg', '.png', '.pdf']:
-                # Handle image-based documents
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    image_paths = self.extract_images(input_file,temp_dir)
-                    encoded_images = self.encode_images(image_paths)
-                    messages = self.prepare_messages(encoded_images=encoded_images)
-            elif ext in ['.docx', '.xlsx', '.xls']:
-                # Handle text-based documents
-                text_input = self.extract_text(input_file)
-                messages = self.prepare_messages(text_input=text_input)
-            else:
-                log_dict["status"] = "Error"
-                log_dict["event_dts"] = datetime.datetime.now()
-                log_dict["comments"] = f"Unsupported file type: {ext}"
-                self.activity_logger.insert_log(log_dict)
-                raise ValueError("Unsupported file type for processing.")
-
-            response, file_num = self.generate_response(messages, doctype)
-            output_filename,output_path = self.save_output(response, input_file, doctype)
+            with tracing.span("process_document", input_file=input_file, doctype=doctype):
+                ext = self.check_input(input_file, log_dict)
+
+                cache_key, cached = self.lookup_cache(input_file, doctype, bypass_cache)
+                if cached is not None:
+                    response, file_num = cached
+                    return self.finish_document(log_dict, input_file, doctype, response, from_cache=True), file_num
+
+                stats = {}
+                duplicate = self.lookup_duplicate(input_file, ext, doctype, stats)
+                if duplicate is not None:
+                    response, file_num = duplicate
+                    return self.finish_document(log_dict, input_file, doctype, response, stats=stats), file_num
+
+                result = self.extract_structured(input_file, ext, doctype, stats)
+                if result is None:
+                    messages, stats["extraction_path"] = self.build_messages(input_file, ext)
+                    result = self.generate_response(messages, doctype, stats)
+                response, file_num = result
+                if cache_key is not None:
+                    self.cache.put(cache_key, response, file_num, doctype, self.llm_model)
+                output_filename = self.finish_document(log_dict, input_file, doctype, response, stats=stats)
+                return output_filename, file_num
+        except Exception as e:
+            self.log_failure(log_dict, input_file, e)
+
+    def reextract_fields(self, input_file, doctype, paths=None, mismatches=None):
+        """
+        Re-read only some fields of an already parsed document and patch its stored output.
+
+        The pages printing the fields are located through the text layer and sent with a response
+        model holding just those fields, instead of re-running the whole document.
+
+        :param paths: Field paths such as 'billing_address.postal_code' or 'product[2].UNIT_ITEM_PRICE'.
+        :param mismatches: Validator output to derive the paths from when paths is not given.
+        :return: {path: (old_value, new_value)} for the fields that changed, or None if it failed (logged).
+        """
+        log_dict = {
+                "user_id": self.user,
+                "input_filename": input_file,
+            }
+        try:
+            with tracing.span("reextract_fields", input_file=input_file, doctype=doctype) as span:
+                ext = self.check_input(input_file, log_dict)
+                model, _ = get_response_model(doctype)
+                data = self.document_store.get(doctype, self.document_name(input_file))
+                if data is None:
+                    raise FileNotFoundError(f"No stored parse of {input_file} to re-extract")
+                if paths is None:
+                    paths = reextraction.paths_from_mismatches(mismatches or [], data, doctype)
+                if not paths:
+                    print(f"No re-extractable fields for {input_file}")
+                    return {}
+
+                correction = reextraction.correction_model(model, paths)
+                context = ("An earlier extraction of this document recorded the values below, which failed "
+                           "validation. Re-read only these fields from the document.\n"
+                           + reextraction.describe_paths(data, paths))
+                if ext == '.pdf':
+                    page_texts = text_layer.extract_page_texts(input_file) if self.use_text_layer else []
+                    pages = reextraction.locate_pages(page_texts, data, paths, rasterizer.pdf_page_count(input_file))
+                    messages, _ = self.build_page_messages(input_file, pages, page_texts, context)
+                elif ext in IMAGE_EXTENSIONS:
+                    pages = [1]
+                    messages = self.prepare_messages(encoded_images=self.iter_encoded_pages(input_file),
+                                                     text_input=context, image_mime_type="image/jpeg")
+                else:
+                    pages = []
+                    messages = self.prepare_messages(text_input=f"{context}\n\n{self.extract_text(input_file)}")
+                answer, retries = self.call_model(messages, correction)
+                answer = answer.model_dump()
+
+                changes = {}
+                for path in paths:
+                    old_value = reextraction.get_value(data, path)
+                    new_value = answer[reextraction.field_name(path)]
+                    if new_value != old_value:
+                        reextraction.set_value(data, path, new_value)
+                        changes[path] = (old_value, new_value)
+                response = model.model_validate(data)
+                output_filename = self.document_name(input_file) + self.document_store.extension
+                output_path = None
+                if changes:
+                    output_filename, output_path = self.save_output(response, input_file, doctype)
+                    cache_key, _ = self.lookup_cache(input_file, doctype, bypass_cache=True)
+                    if cache_key is not None:
+                        _, field = get_response_model(doctype)
+                        self.cache.put(cache_key, response, data[field], doctype, self.llm_model)
+                span.set(fields=len(paths), pages=len(pages), changed=len(changes))
+
             log_dict["status"] = "Success"
             log_dict["output_filename"] = output_filename
-            log_dict["output_file_location"] = output_path
+            if output_path is not None:
+                log_dict["output_file_location"] = output_path
             log_dict["event_dts"] = datetime.datetime.now()
-            log_dict["comments"] = f"Document {input_file} processed successfully: {output_filename} stored at {output_path}"
+            log_dict["comments"] = (f"Re-extracted {len(paths)} field(s) of {input_file} from page(s) {pages} "
+                                    f"with {retries} LLM retries; {len(changes)} changed: {changes}")
             self.activity_logger.insert_log(log_dict)
+            return changes
+        except Exception as e:
+            self.log_failure(log_dict, input_file, e)
+
+    async def agenerate_response(self, messages, doctype, stats=None):
+        """Async counterpart of generate_response, with the same spans."""
+        with tracing.span("generate_response", doctype=doctype):
+            model, field = get_response_model(doctype)
+            request_model = self.select_request_model(region_schemas.message_text(messages), model, stats)
+
+            start = time.perf_counter()
+            with tracing.span("llm_call", model=self.llm_model, response_model=request_model.__name__) as span:
+                create = response_schemas.acreate
+                if self.governor is not None:
+                    create = self.governor.awrap(create, estimate_request_tokens(messages))
+                (response, completion), retries = await llm_client.acall_with_retry(
+                    create,
+                    llm_client.get_async_client(self.api_key, self.base_url),
+                    self.llm_model,
+                    request_model,
+                    messages,
+                    max_retries=self.max_retries,
+                )
+                span.set(retries=retries)
+                record_usage(span, completion)
+            if stats is not None:
+                stats["llm_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            if request_model is not model:
+                response = region_schemas.expand_response(response, model)
+            if stats is not None:
+                stats["retries"] = retries
+
+        file_num = response.model_dump()[field]
+        return response, file_num
+
+    async def _aprocess(self, input_file, doctype, log_dict, bypass_cache=False):
+        # Blocking steps (rasterization, file IO, DB log writes) run in worker threads so the
+        # event loop keeps other documents' LLM calls in flight.
+        with tracing.span("process_document", input_file=input_file, doctype=doctype):
+            ext = await asyncio.to_thread(self.check_input, input_file, log_dict)
+
+            cache_key, cached = await asyncio.to_thread(self.lookup_cache, input_file, doctype, bypass_cache)
+            if cached is not None:
+                response, file_num = cached
+                output_filename = await asyncio.to_thread(
+                    self.finish_document, log_dict, input_file, doctype, response, True)
+                return output_filename, file_num
+
+            stats = {}
+            duplicate = await asyncio.to_thread(self.lookup_duplicate, input_file, ext, doctype, stats)
+            if duplicate is not None:
+                response, file_num = duplicate
+                output_filename = await asyncio.to_thread(
+                    self.finish_document, log_dict, input_file, doctype, response, False, stats)
+                return output_filename, file_num
+
+            result = await asyncio.to_thread(self.extract_structured, input_file, ext, doctype, stats)
+            if result is None:
+                messages, stats["extraction_path"] = await asyncio.to_thread(self.build_messages, input_file, ext)
+                result = await self.agenerate_response(messages, doctype, stats)
+            response, file_num = result
+            if cache_key is not None:
+                await asyncio.to_thread(self.cache.put, cache_key, response, file_num, doctype, self.llm_model)
+            output_filename = await asyncio.to_thread(
+                self.finish_document, log_dict, input_file, doctype, response, False, stats)
             return output_filename, file_num
+
+    async def aprocess_document(self, input_file, doctype, bypass_cache=False, timeout=None):
+        """
+        Async counterpart of process_document.
+
+        :param timeout: Seconds allowed for the whole document (preparation, LLM call, save). None waits forever.
+        :return: (output_filename, file_num), or None if processing failed (the failure is logged).
+        """
+        log_dict = {
+                "user_id": self.user,
+                "input_filename": input_file,
+            }
+        try:
+            return await asyncio.wait_for(self._aprocess(input_file, doctype, log_dict, bypass_cache), timeout)
+        except asyncio.TimeoutError:
+            await asyncio.to_thread(self.log_failure, log_dict, input_file, f"timed out after {timeout}s")
         except Exception as e:
-            log_dict["status"] = "Error"
-            log_dict["event_dts"] = datetime.datetime.now()
-            log_dict["comments"] = f"Error processing document {input_file}: {str(e)}"
-            self.activity_logger.insert_log(log_dict)
+            await asyncio.to_thread(self.log_failure, log_dict, input_file, e)
+
+    async def process_batch(self, paths, doctype, concurrency=8, timeout=300, bypass_cache=False):
+        """
+        Parse many documents concurrently, yielding results as they complete.
+
+        :param paths: Iterable of input file paths.
+        :param doctype: 'PO', 'Invoice' or 'Contract', applied to every path.
+        :param concurrency: Maximum number of documents in flight at once.
+        :param timeout: Per-document timeout in seconds.
+        :return: Async generator of dicts with input_file, status, output_filename, file_num and error.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(input_file):
+            async with semaphore:
+                log_dict = {
+                    "user_id": self.user,
+                    "input_filename": input_file,
+                }
+                result = {"input_file": input_file, "status": "Success", "output_filename": None,
+                          "file_num": None, "error": None}
+                try:
+                    output_filename, file_num = await asyncio.wait_for(
+                        self._aprocess(input_file, doctype, log_dict, bypass_cache), timeout)
+                    result["output_filename"] = output_filename
+                    result["file_num"] = file_num
+                except asyncio.TimeoutError:
+                    result["status"] = "Error"
+                    result["error"] = f"timed out after {timeout}s"
+                except Exception as e:
+                    result["status"] = "Error"
+                    result["error"] = str(e)
+                if result["error"] is not None:
+                    await asyncio.to_thread(self.log_failure, log_dict, input_file, result["error"])
+                return result
+
+        tasks = [asyncio.ensure_future(run(path)) for path in paths]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
 
 
 # Example usage
@@ -0,0 +1,213 @@
+import io
+import math
+import base64
+import threading
+from PIL import Image, ImageOps
+import tracing
+
+# OpenAI vision pricing model: 'low' detail is a flat 85 tokens; 'high' detail fits the image
+# inside 2048x2048, scales the short side down to 768 and charges 170 tokens per 512px tile.
+LOW_DETAIL_TOKENS = 85
+LOW_DETAIL_DIMENSION = 512
+HIGH_DETAIL_BASE_TOKENS = 85
+HIGH_DETAIL_TILE_TOKENS = 170
+HIGH_DETAIL_MAX_DIMENSION = 2048
+HIGH_DETAIL_SHORT_SIDE = 768
+TILE_SIZE = 512
+# Short side below which small print on an invoice/PO page stops being legible to the model;
+# between this and HIGH_DETAIL_SHORT_SIDE a page can be scaled down to save tiles
+MIN_TEXT_SHORT_SIDE = 576
+
+
+def high_detail_size(width, height):
+    """Size the provider actually analyses for a 'high' detail image; anything larger is wasted bytes."""
+    scale = min(1.0, HIGH_DETAIL_MAX_DIMENSION / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, HIGH_DETAIL_SHORT_SIDE / min(width, height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def estimate_image_tokens(width, height, detail='high'):
+    if detail == 'low':
+        return LOW_DETAIL_TOKENS
+    width, height = high_detail_size(width, height)
+    tiles = math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+    return HIGH_DETAIL_BASE_TOKENS + HIGH_DETAIL_TILE_TOKENS * tiles
+
+
+def content_bbox(image, threshold=245):
+    """Bounding box of the non-blank pixels, or None when the page is blank."""
+    gray = image if image.mode == 'L' else image.convert('L')
+    mask = ImageOps.invert(gray).point(lambda p: 255 if p > 255 - threshold else 0)
+    return mask.getbbox()
+
+
+def crop_blank_margins(image, threshold=245, padding=16, bbox=None):
+    """Trim near-white borders, keeping a small padding so edge text is not clipped."""
+    bbox = bbox or content_bbox(image, threshold)
+    if bbox is None:
+        return image
+    left, top, right, bottom = bbox
+    bbox = (max(0, left - padding), max(0, top - padding),
+            min(image.width, right + padding), min(image.height, bottom + padding))
+    return image.crop(bbox)
+
+
+class PayloadOptimizer:
+    """
+    Picks resolution, JPEG quality, margin cropping and vision detail per page so a request
+    stays inside a byte and token budget.
+
+    Pages with any content are always sent at 'high' detail: 'low' detail caps a page at 512px,
+    where line items can no longer be read. Only pages with no ink at all go out as 'low'. The
+    token and byte budgets are met by downscaling and lowering JPEG quality, but a page with
+    content is never scaled below min_text_short_side; pages that still do not fit are sent at
+    that floor and counted as over_budget in stats().
+
+    Output items are dicts with data (base64), mime_type, detail, bytes, tokens, width and
+    height, and can be passed straight to DocumentParser.prepare_messages as encoded_images.
+    """
+
+    def __init__(self, max_request_bytes=4 * 1024 * 1024, max_request_tokens=8000,
+                 qualities=(85, 75, 65, 50), scale_steps=(1.0, 0.85, 0.7, 0.55),
+                 crop_margins=True, blank_threshold=245, min_text_short_side=MIN_TEXT_SHORT_SIDE):
+        """
+        :param max_request_bytes: Budget for the base64 image payload of one request.
+        :param max_request_tokens: Budget for the estimated image tokens of one request.
+        :param qualities: JPEG qualities tried from best to worst.
+        :param scale_steps: Downscale factors tried when no quality fits the byte budget.
+        :param crop_margins: Trim blank page margins before sizing.
+        :param blank_threshold: Grey level above which a pixel counts as blank margin.
+        :param min_text_short_side: Smallest short side a page with content is scaled to for either budget.
+        """
+        self.max_request_bytes = max_request_bytes
+        self.max_request_tokens = max_request_tokens
+        self.qualities = qualities
+        self.scale_steps = scale_steps
+        self.crop_margins = crop_margins
+        self.blank_threshold = blank_threshold
+        self.min_text_short_side = min_text_short_side
+        self._lock = threading.Lock()
+        self.totals = {"pages": 0, "bytes": 0, "tokens": 0, "blank_pages": 0, "over_budget": 0}
+
+    @staticmethod
+    def _encode(image, quality):
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=quality, optimize=True)
+        return base64.b64encode(buffer.getbuffer()).decode('utf-8')
+
+    def _fit_bytes(self, image, byte_budget, min_short_side=0):
+        """
+        Encode at the best quality/scale that fits byte_budget, never scaling the short side
+        below min_short_side.
+
+        :return: (encoded, (width, height), fits_budget); the smallest attempt when nothing fits.
+        """
+        floor = min(1.0, min_short_side / min(image.size))
+        encoded = None
+        for scale in self.scale_steps:
+            scale = max(scale, floor)
+            scaled = image
+            if scale < 1.0:
+                scaled = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+                                      Image.LANCZOS)
+            for quality in self.qualities:
+                encoded = self._encode(scaled, quality)
+                if len(encoded) <= byte_budget:
+                    return encoded, scaled.size, True
+            if scale == floor:
+                break
+        return encoded, scaled.size, False
+
+    def _text_target(self, width, height, token_budget):
+        """
+        High-detail size for a page with content: the provider's own analysis size, scaled down
+        in tile steps while over token_budget but not below min_text_short_side.
+
+        :return: ((width, height), fits_budget)
+        """
+        width, height = high_detail_size(width, height)
+        floor = min(1.0, self.min_text_short_side / min(width, height))
+        for scale in (1.0, 0.75, 0.5, 0.375, 0.25):
+            scale = max(scale, floor)
+            target = (max(1, int(width * scale)), max(1, int(height * scale)))
+            if estimate_image_tokens(*target, 'high') <= token_budget:
+                return target, True
+            if scale == floor:
+                break
+        return target, False
+
+    def optimize_page(self, image, byte_budget, token_budget):
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        bbox = content_bbox(image, self.blank_threshold)
+        fits, min_short_side = True, 0
+        if bbox is None:
+            # Nothing printed on the page, so nothing is lost at low detail
+            detail = 'low'
+            scale = min(1.0, LOW_DETAIL_DIMENSION / max(image.size))
+            target = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+        else:
+            detail = 'high'
+            if self.crop_margins:
+                image = crop_blank_margins(image, self.blank_threshold, bbox=bbox)
+            target, fits = self._text_target(image.width, image.height, token_budget)
+            min_short_side = self.min_text_short_side
+        if target != image.size:
+            image = image.resize(target, Image.LANCZOS)
+
+        encoded, size, fits_bytes = self._fit_bytes(image, byte_budget, min_short_side)
+        return {
+            "data": encoded,
+            "mime_type": "image/jpeg",
+            "detail": detail,
+            "bytes": len(encoded),
+            "tokens": estimate_image_tokens(size[0], size[1], detail),
+            "width": size[0],
+            "height": size[1],
+            "over_budget": not (fits and fits_bytes),
+        }
+
+    def _record(self, payload):
+        with self._lock:
+            self.totals["pages"] += 1
+            self.totals["bytes"] += payload["bytes"]
+            self.totals["tokens"] += payload["tokens"]
+            self.totals["blank_pages"] += payload["detail"] == 'low'
+            self.totals["over_budget"] += payload["over_budget"]
+
+    def stats(self) -> dict:
+        """Totals over every page optimized so far, including requests whose pages were not all consumed."""
+        with self._lock:
+            return dict(self.totals)
+
+    def optimize(self, images, page_count):
+        """
+        Optimize a stream of page images for one request.
+
+        Budgets are split over the pages still to come, so pages that compress well leave more
+        room for the rest. Every page is added to stats() and to the current tracing span
+        (image_pages, image_bytes, image_tokens) as it is produced.
+
+        :param images: Iterable of PIL images in page order.
+        :param page_count: Number of images the iterable will produce.
+        :return: Generator of page payload dicts.
+        """
+        bytes_left = self.max_request_bytes
+        tokens_left = self.max_request_tokens
+        for index, image in enumerate(images):
+            pages_left = max(1, page_count - index)
+            try:
+                payload = self.optimize_page(image, max(0, bytes_left) // pages_left, max(0, tokens_left) // pages_left)
+            finally:
+                image.close()
+            bytes_left -= payload["bytes"]
+            tokens_left -= payload["tokens"]
+            self._record(payload)
+            span = tracing.current_span()
+            if span is not None:
+                span.add("image_pages", 1)
+                span.add("image_bytes", payload["bytes"])
+                span.add("image_tokens", payload["tokens"])
+                span.add("over_budget_pages", int(payload["over_budget"]))
+            yield payload
@@ -0,0 +1,257 @@
+"""
+Pairing of invoice line items with PO line items when descriptions drift (OCR whitespace,
+punctuation, dropped or swapped characters).
+
+Descriptions are normalized and split into character trigrams of their space-free form. An
+inverted trigram index over the PO lines (with very common trigrams dropped) yields a handful of
+candidates per invoice line, so matching stays near-linear in the number of lines instead of
+comparing every pair. Candidates are scored by trigram Dice similarity adjusted by HSN and
+unit-price agreement, and each connected group of candidate pairs is solved as an assignment
+problem so every PO line is used at most once. The one exception is an invoice row repeating a
+PO line's exact description after that line is taken: it is paired with the line as a repeat
+(see repeat_groups), and the validator checks the repeated rows' summed quantity against the PO.
+"""
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+try:
+    import numpy as np
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+HSN_AGREE_BONUS = 0.1
+HSN_DISAGREE_PENALTY = 0.15
+PRICE_AGREE_BONUS = 0.05
+PRICE_TOLERANCE = 0.02
+NO_EDGE_COST = 2.0
+
+
+def normalize_description(text):
+    """'Bolt,  M8 x 40mm ' -> 'BOLT M8 X 40MM'"""
+    text = unicodedata.normalize('NFKC', str(text or '')).upper()
+    return ' '.join(re.sub(r'[^0-9A-Z]+', ' ', text).split())
+
+
+def trigrams(normalized):
+    compact = normalized.replace(' ', '')
+    if not compact:
+        return frozenset()
+    padded = f"#{compact}#"
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def normalize_hsn(value):
+    digits = re.sub(r'\D', '', str(value or ''))
+    return digits or None
+
+
+def hungarian(cost):
+    """
+    Minimum-cost assignment of rows to distinct columns (rows <= columns), O(rows^2 * columns).
+
+    :return: Column index assigned to each row.
+    """
+    n, m = len(cost), len(cost[0])
+    inf = float('inf')
+    u, v, p, way = [0.0] * (n + 1), [0.0] * (m + 1), [0] * (m + 1), [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0], j0 = i, 0
+        minv, used = [inf] * (m + 1), [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0, delta, j1 = p[j0], inf, 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    current = cost[i0 - 1][j - 1] - u[i0] - v[j]
+                    if current < minv[j]:
+                        minv[j], way[j] = current, j0
+                    if minv[j] < delta:
+                        delta, j1 = minv[j], j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    assignment = [None] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            assignment[p[j] - 1] = j - 1
+    return assignment
+
+
+def repeat_groups(matches):
+    """
+    Invoice rows billing the same PO line.
+
+    :param matches: Per invoice item, its matched PO line (index or product dict) or None.
+    :return: List of item position lists, one per PO line matched by more than one item.
+    """
+    positions = defaultdict(list)
+    for position, match in enumerate(matches):
+        if match is not None:
+            positions[match if isinstance(match, int) else id(match)].append(position)
+    return [group for group in positions.values() if len(group) > 1]
+
+
+class ProductMatcher:
+    """
+    Index of a PO's product lines that pairs invoice product lines with them.
+
+    Build once per PO (InvoicePOValidator.prepare_reference does) and call match() per invoice.
+    """
+
+    def __init__(self, products, min_score=0.6, max_candidates=10, common_gram_share=0.02,
+                 exact_solve_limit=80):
+        """
+        :param products: PO product dicts (document_class.Product fields).
+        :param min_score: Lowest adjusted similarity accepted as a match.
+        :param max_candidates: Candidates scored per invoice line, by shared trigram count.
+        :param common_gram_share: Trigrams found in more than this share of lines (and in at least
+                                  50 lines) are left out of the index; they select nothing.
+        :param exact_solve_limit: Largest group of competing lines solved exactly, with or without
+                                  scipy; bigger groups are assigned greedily by score.
+        """
+        self.products = products
+        self.min_score = min_score
+        self.max_candidates = max_candidates
+        self.exact_solve_limit = exact_solve_limit
+        self.normalized = [normalize_description(p["PRODUCT_DESCRIPTION"]) for p in products]
+        self.grams = [trigrams(text) for text in self.normalized]
+        self.exact = defaultdict(list)
+        postings = defaultdict(list)
+        for index, (text, grams) in enumerate(zip(self.normalized, self.grams)):
+            self.exact[text].append(index)
+            for gram in grams:
+                postings[gram].append(index)
+        limit = max(50, int(common_gram_share * len(products)))
+        self.postings = {gram: ids for gram, ids in postings.items() if len(ids) <= limit}
+
+    def score(self, item, item_grams, index):
+        """Trigram Dice similarity of the descriptions, adjusted by HSN and unit-price agreement."""
+        po_grams = self.grams[index]
+        if not item_grams or not po_grams:
+            return 0.0
+        score = 2 * len(item_grams & po_grams) / (len(item_grams) + len(po_grams))
+        product = self.products[index]
+        item_hsn, po_hsn = normalize_hsn(item.get("HSN")), normalize_hsn(product.get("HSN"))
+        if item_hsn and po_hsn:
+            score += HSN_AGREE_BONUS if item_hsn == po_hsn else -HSN_DISAGREE_PENALTY
+        try:
+            item_price, po_price = float(item.get("UNIT_ITEM_PRICE")), float(product.get("UNIT_ITEM_PRICE"))
+            if po_price and abs(item_price - po_price) <= PRICE_TOLERANCE * abs(po_price):
+                score += PRICE_AGREE_BONUS
+        except (TypeError, ValueError):
+            pass
+        return score
+
+    def candidates(self, item_grams, available):
+        counts = Counter()
+        for gram in item_grams:
+            counts.update(self.postings.get(gram, ()))
+        return [index for index, _ in counts.most_common(self.max_candidates * 2) if index in available][
+               :self.max_candidates]
+
+    def match(self, items):
+        """
+        :param items: Invoice product dicts.
+        :return: List with, per invoice item, (po_index, score) or (None, 0.0) when nothing matches.
+        """
+        result = [(None, 0.0)] * len(items)
+        available = set(range(len(self.products)))
+        normalized = [normalize_description(item.get("PRODUCT_DESCRIPTION")) for item in items]
+
+        # Identical normalized descriptions pair up first, in order
+        pending = []
+        for i, text in enumerate(normalized):
+            index = next((index for index in self.exact.get(text, ()) if index in available), None)
+            if index is None:
+                pending.append(i)
+            else:
+                available.discard(index)
+                result[i] = (index, 1.0)
+
+        edges = {}
+        for i in pending:
+            item_grams = trigrams(normalized[i])
+            for index in self.candidates(item_grams, available):
+                score = self.score(items[i], item_grams, index)
+                if score >= self.min_score:
+                    edges[(i, index)] = score
+        for component in self._components(edges):
+            for i, index in self._assign(component, edges):
+                result[i] = (index, edges[(i, index)])
+
+        # An invoice may bill one PO line in several rows; exact repeats share the PO line, and
+        # repeat_groups() reports them so their quantities are checked together, not row by row
+        for i, text in enumerate(normalized):
+            if result[i][0] is None and self.exact.get(text):
+                result[i] = (self.exact[text][0], 1.0)
+        return result
+
+    @staticmethod
+    def _components(edges):
+        parent = {}
+
+        def find(node):
+            while parent.setdefault(node, node) != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        for i, index in edges:
+            parent[find(('item', i))] = find(('po', index))
+        components = defaultdict(list)
+        for edge in edges:
+            components[find(('item', edge[0]))].append(edge)
+        return components.values()
+
+    def _assign(self, component, edges):
+        rows = sorted({i for i, _ in component})
+        columns = sorted({index for _, index in component})
+        if len(rows) == 1 or len(columns) == 1:
+            return [max(component, key=edges.get)]
+        if max(len(rows), len(columns)) > self.exact_solve_limit:
+            return self._greedy(component, edges)
+        transpose = len(rows) > len(columns)
+        if transpose:
+            rows, columns = columns, rows
+        row_position = {row: position for position, row in enumerate(rows)}
+        column_position = {column: position for position, column in enumerate(columns)}
+        if linear_sum_assignment is not None:
+            cost = np.full((len(rows), len(columns)), NO_EDGE_COST)
+        else:
+            cost = [[NO_EDGE_COST] * len(columns) for _ in rows]
+        for i, index in component:
+            r, c = (index, i) if transpose else (i, index)
+            cost[row_position[r]][column_position[c]] = 1.0 - edges[(i, index)]
+        if linear_sum_assignment is not None:
+            row_ids, column_ids = linear_sum_assignment(cost)
+            pairs = zip(row_ids, column_ids)
+        else:
+            pairs = enumerate(hungarian(cost))
+        assigned = []
+        for r, c in pairs:
+            if c is None or cost[r][c] >= NO_EDGE_COST:
+                continue
+            assigned.append((columns[c], rows[r]) if transpose else (rows[r], columns[c]))
+        return assigned
+
+    @staticmethod
+    def _greedy(component, edges):
+        used_items, used_products, assigned = set(), set(), []
+        for i, index in sorted(component, key=edges.get, reverse=True):
+            if i not in used_items and index not in used_products:
+                used_items.add(i)
+                used_products.add(index)
+                assigned.append((i, index))
+        return assigned
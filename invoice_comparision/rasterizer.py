@@ -0,0 +1,154 @@
+import io
+import os
+import base64
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL import Image
+
+
+def pdf_page_count(input_file):
+    return pdfinfo_from_path(input_file)["Pages"]
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def resolve_workers(max_workers, page_count, pages_per_chunk):
+    """
+    Number of render workers for a document: all available cores, capped by max_workers
+    and by the number of page chunks.
+    """
+    chunks = -(-page_count // pages_per_chunk)
+    workers = available_cores()
+    if max_workers is not None:
+        workers = min(workers, max_workers)
+    return max(1, min(workers, chunks))
+
+
+def fit_image(image, grayscale=False, max_dimension=None):
+    """
+    Apply the grayscale / max-dimension knobs to a rendered page.
+
+    :param max_dimension: Longest side in pixels after downscaling. None keeps the rendered size.
+    """
+    if grayscale and image.mode != 'L':
+        image = image.convert('L')
+    elif not grayscale and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    if max_dimension and max(image.size) > max_dimension:
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    return image
+
+
+def render_page_range(input_file, first_page, last_page, dpi=200, grayscale=False, max_dimension=None,
+                      quality=None):
+    """
+    Render an inclusive page range with its own poppler process.
+
+    :param quality: When set, pages are also JPEG/base64 encoded inside the worker.
+    :return: List of PIL images, or base64 strings when quality is set, in page order.
+    """
+    images = convert_from_path(input_file, dpi=dpi, grayscale=grayscale,
+                               first_page=first_page, last_page=last_page)
+    pages = [fit_image(image, grayscale, max_dimension) for image in images]
+    if quality is None:
+        return pages
+    encoded = []
+    for image in pages:
+        encoded.append(encode_image(image, quality))
+        image.close()
+    return encoded
+
+
+def iter_pdf_pages(input_file, dpi=200, grayscale=False, max_dimension=None, quality=None,
+                   max_workers=1, pages_per_chunk=4):
+    """
+    Render a PDF in page-range shards across worker threads and yield pages in order.
+
+    Each shard runs its own pdftoppm process, so shards render on separate cores. At most
+    one shard per worker is in flight, which bounds memory to workers * pages_per_chunk pages.
+    """
+    page_count = pdf_page_count(input_file)
+    workers = resolve_workers(max_workers, page_count, pages_per_chunk)
+    if workers == 1:
+        for page in range(1, page_count + 1):
+            yield from render_page_range(input_file, page, page, dpi, grayscale, max_dimension, quality)
+        return
+
+    ranges = deque(
+        (first, min(first + pages_per_chunk - 1, page_count))
+        for first in range(1, page_count + 1, pages_per_chunk)
+    )
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rasterize") as executor:
+        in_flight = deque()
+        try:
+            while ranges or in_flight:
+                while ranges and len(in_flight) < workers:
+                    first, last = ranges.popleft()
+                    in_flight.append(executor.submit(
+                        render_page_range, input_file, first, last, dpi, grayscale, max_dimension, quality))
+                yield from in_flight.popleft().result()
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+
+def iter_selected_pages(input_file, pages, dpi=200, grayscale=False, max_dimension=None, quality=75):
+    """
+    Render only the given 1-based PDF pages, in the order given.
+
+    :param quality: JPEG quality for encoding; None yields the PIL images instead.
+    :return: Generator of base64-encoded JPEG strings (or PIL images).
+    """
+    for page in pages:
+        yield from render_page_range(input_file, page, page, dpi, grayscale, max_dimension, quality)
+
+
+def iter_page_images(input_file, dpi=200, grayscale=False, max_dimension=None, max_workers=1):
+    """
+    Render a document page by page.
+
+    :param input_file: PDF or image (.jpg, .jpeg, .png) path.
+    :param max_workers: Cap on parallel render workers for PDFs. None uses every available core.
+    :return: Generator of PIL images in page order.
+    """
+    lower = input_file.lower()
+    if lower.endswith('.pdf'):
+        yield from iter_pdf_pages(input_file, dpi, grayscale, max_dimension, max_workers=max_workers)
+    elif lower.endswith(('.jpg', '.jpeg', '.png')):
+        with Image.open(input_file) as image:
+            image.load()
+            yield fit_image(image, grayscale, max_dimension)
+    else:
+        raise ValueError("Unsupported file format. Please provide a PDF or image file.")
+
+
+def encode_image(image, quality=75):
+    """Compress a page to JPEG in memory and return it base64-encoded."""
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality, optimize=True)
+    return base64.b64encode(buffer.getbuffer()).decode('utf-8')
+
+
+def iter_encoded_pages(input_file, dpi=200, grayscale=False, max_dimension=None, quality=75, max_workers=1):
+    """
+    Stream page -> JPEG bytes -> base64 without touching the disk.
+
+    With max_workers == 1 only the current page is held in memory; with more workers, page
+    shards are rendered and encoded in parallel and reassembled in page order.
+
+    :return: Generator of base64-encoded JPEG strings in page order.
+    """
+    if input_file.lower().endswith('.pdf'):
+        yield from iter_pdf_pages(input_file, dpi, grayscale, max_dimension, quality=quality,
+                                  max_workers=max_workers)
+        return
+    for image in iter_page_images(input_file, dpi, grayscale, max_dimension):
+        try:
+            yield encode_image(image, quality)
+        finally:
+            image.close()
@@ -0,0 +1,304 @@
+import io
+import time
+import base64
+import sqlite3
+import asyncio
+import threading
+from contextlib import contextmanager
+from PIL import Image
+from payload_optimizer import estimate_image_tokens, LOW_DETAIL_TOKENS
+import llm_client
+
+CHARS_PER_TOKEN = 4
+# Base64 characters decoded to find an image's dimensions; JPEG/PNG headers sit well inside this
+HEADER_CHARS = 16 * 1024
+
+
+def _image_tokens(image_url):
+    detail = image_url.get("detail", "high")
+    if detail == "low":
+        return LOW_DETAIL_TOKENS
+    url = image_url.get("url", "")
+    try:
+        # Only the start of the payload is decoded; PIL reads the size from the header alone
+        prefix = url.split(',', 1)[1][:HEADER_CHARS]
+        data = base64.b64decode(prefix[:len(prefix) - len(prefix) % 4])
+        with Image.open(io.BytesIO(data)) as image:
+            return estimate_image_tokens(image.width, image.height, detail)
+    except Exception:
+        # Unknown size: assume a full-page scan at the provider's high-detail cap (2 x 3 tiles)
+        return estimate_image_tokens(1536, 2048, detail)
+
+
+def estimate_request_tokens(messages, max_output_tokens=4096):
+    """Rough token cost of a chat request: text at ~4 chars/token, images by vision tile count, plus output."""
+    tokens = max_output_tokens
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += len(content) // CHARS_PER_TOKEN + 4
+            continue
+        for part in content or []:
+            if part.get("type") == "image_url":
+                tokens += _image_tokens(part["image_url"])
+            elif part.get("type") == "text":
+                tokens += len(part.get("text", "")) // CHARS_PER_TOKEN
+    return tokens
+
+
+class LocalBucketStore:
+    """Token buckets shared by every thread in the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, name, amount, capacity, refill_per_second):
+        """
+        Take amount from a bucket if available.
+
+        :return: 0 when taken, otherwise the seconds to wait before the bucket can cover amount.
+        """
+        now = time.time()
+        with self._lock:
+            level, updated = self._buckets.get(name, (capacity, now))
+            level = min(capacity, level + (now - updated) * refill_per_second)
+            if level >= amount or level >= capacity:
+                self._buckets[name] = (level - amount, now)
+                return 0.0
+            self._buckets[name] = (level, now)
+            return (amount - level) / refill_per_second
+
+    def observe(self, name, remaining, capacity):
+        """Clamp a bucket to what the provider says is left, so every client converges on the server's view."""
+        now = time.time()
+        with self._lock:
+            level, _ = self._buckets.get(name, (capacity, now))
+            self._buckets[name] = (min(level, remaining, capacity), now)
+
+
+class SQLiteBucketStore:
+    """
+    Token buckets shared across processes through a local SQLite file.
+
+    Each update runs in a BEGIN IMMEDIATE transaction, which takes the database write lock, so
+    concurrent workers never double-spend the same budget.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_buckets (
+                    name TEXT PRIMARY KEY,
+                    level REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _load(self, conn, name, capacity, now):
+        row = conn.execute("SELECT level, updated FROM rate_buckets WHERE name = ?", (name,)).fetchone()
+        return row if row else (capacity, now)
+
+    def _store(self, conn, name, level, now):
+        conn.execute("INSERT OR REPLACE INTO rate_buckets (name, level, updated) VALUES (?, ?, ?)",
+                     (name, level, now))
+
+    def take(self, name, amount, capacity, refill_per_second):
+        now = time.time()
+        with self._transaction() as conn:
+            level, updated = self._load(conn, name, capacity, now)
+            level = min(capacity, level + (now - updated) * refill_per_second)
+            if level >= amount or level >= capacity:
+                self._store(conn, name, level - amount, now)
+                return 0.0
+            self._store(conn, name, level, now)
+            return (amount - level) / refill_per_second
+
+    def observe(self, name, remaining, capacity):
+        now = time.time()
+        with self._transaction() as conn:
+            level, _ = self._load(conn, name, capacity, now)
+            self._store(conn, name, min(level, remaining, capacity), now)
+
+
+class RateLimitGovernor:
+    """
+    Keeps OpenAI traffic just under the account's TPM/RPM limits.
+
+    Requests draw their estimated tokens from a token bucket and one unit from a request bucket,
+    both refilled at target_utilization of the limit and re-synced from the x-ratelimit-* response
+    headers. Concurrency is adjusted AIMD-style: +1/limit per success, halved on a 429 - at most
+    once per round trip, since requests already in flight when the limit was cut still carry the
+    old rate and their 429s report the same overload.
+    """
+
+    def __init__(self, tokens_per_minute=30000, requests_per_minute=500, max_concurrency=16,
+                 min_concurrency=1, target_utilization=0.9, state_path=None):
+        """
+        :param tokens_per_minute: Initial TPM limit; replaced by x-ratelimit-limit-tokens once observed.
+        :param requests_per_minute: Initial RPM limit; replaced by x-ratelimit-limit-requests once observed.
+        :param max_concurrency: Upper bound for in-flight requests.
+        :param min_concurrency: Floor the AIMD decrease never goes below.
+        :param target_utilization: Fraction of the limit to aim for, leaving headroom for estimation error.
+        :param state_path: SQLite file to share bucket state across processes. None shares within the process only.
+        """
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.target_utilization = target_utilization
+        self.store = SQLiteBucketStore(state_path) if state_path else LocalBucketStore()
+        self.concurrency_limit = float(min(max_concurrency, max(min_concurrency, 4)))
+        self.in_flight = 0
+        self.rate_limited = 0
+        self.decreases = 0
+        # time.monotonic() of the last halving; 429s of requests started before it are not counted again
+        self._last_decrease = float('-inf')
+        self._lock = threading.Lock()
+
+    def _reserve_slot(self):
+        with self._lock:
+            if self.in_flight >= int(self.concurrency_limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def _take_budget(self, tokens):
+        """
+        Draw one request and the estimated tokens from the buckets. Runs outside self._lock:
+        with SQLiteBucketStore it waits for the database write lock.
+
+        :return: 0 when taken, otherwise seconds to wait before retrying.
+        """
+        with self._lock:
+            tpm = self.tokens_per_minute * self.target_utilization
+            rpm = self.requests_per_minute * self.target_utilization
+        wait = self.store.take("requests", 1, rpm, rpm / 60)
+        if wait:
+            return wait
+        wait = self.store.take("tokens", tokens, tpm, tpm / 60)
+        if wait:
+            # Give the request unit back so a blocked large request does not starve the RPM budget
+            self.store.take("requests", -1, rpm, rpm / 60)
+        return wait
+
+    def _give_back_slot(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def acquire(self, tokens):
+        """:return: time.monotonic() at which the request was admitted, to pass to release()."""
+        while True:
+            wait = 0.05
+            if self._reserve_slot():
+                wait = self._take_budget(tokens)
+                if not wait:
+                    return time.monotonic()
+                self._give_back_slot()
+            time.sleep(min(wait, 5.0))
+
+    async def aacquire(self, tokens):
+        """Async counterpart of acquire; bucket updates run in a worker thread, off the event loop."""
+        while True:
+            wait = 0.05
+            if self._reserve_slot():
+                wait = await asyncio.to_thread(self._take_budget, tokens)
+                if not wait:
+                    return time.monotonic()
+                self._give_back_slot()
+            await asyncio.sleep(min(wait, 5.0))
+
+    def release(self, rate_limited=False, started=None):
+        """
+        :param started: acquire()'s return value; a 429 halves the limit only if the request was
+                        admitted after the previous halving. None always counts.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if rate_limited:
+                self.rate_limited += 1
+                if started is None or started >= self._last_decrease:
+                    self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+                    self._last_decrease = time.monotonic()
+                    self.decreases += 1
+            else:
+                self.concurrency_limit = min(self.max_concurrency,
+                                             self.concurrency_limit + 1 / self.concurrency_limit)
+
+    def observe_headers(self, headers):
+        """Sync limits and remaining budget from x-ratelimit-* response headers."""
+        for name, suffix in (("tokens", "tokens"), ("requests", "requests")):
+            limit = headers.get(f"x-ratelimit-limit-{suffix}")
+            remaining = headers.get(f"x-ratelimit-remaining-{suffix}")
+            if limit:
+                with self._lock:
+                    if name == "tokens":
+                        self.tokens_per_minute = float(limit)
+                    else:
+                        self.requests_per_minute = float(limit)
+            if remaining is not None:
+                per_minute = self.tokens_per_minute if name == "tokens" else self.requests_per_minute
+                capacity = per_minute * self.target_utilization
+                # Keep the same headroom against the server's remaining count as against the limit
+                headroom = per_minute - capacity
+                self.store.observe(name, max(0.0, float(remaining) - headroom), capacity)
+
+    def wrap(self, fn, tokens):
+        """Wrap a blocking API call so each attempt (including retries) is governed."""
+        def governed(*args, **kwargs):
+            started = self.acquire(tokens)
+            rate_limited = False
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                rate_limited = llm_client.status_code(e) == 429
+                raise
+            finally:
+                self.release(rate_limited, started)
+        return governed
+
+    def awrap(self, fn, tokens):
+        """Async counterpart of wrap; fn must return an awaitable."""
+        async def governed(*args, **kwargs):
+            started = await self.aacquire(tokens)
+            rate_limited = False
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                rate_limited = llm_client.status_code(e) == 429
+                raise
+            finally:
+                self.release(rate_limited, started)
+        return governed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "concurrency_limit": self.concurrency_limit,
+                "in_flight": self.in_flight,
+                "rate_limited": self.rate_limited,
+                "decreases": self.decreases,
+                "tokens_per_minute": self.tokens_per_minute,
+                "requests_per_minute": self.requests_per_minute,
+            }
+
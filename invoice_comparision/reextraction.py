@@ -0,0 +1,156 @@
+import re
+import typing
+from product_matching import normalize_description
+from pydantic import BaseModel, Field, create_model
+
+PATH_TOKEN_RE = re.compile(r'(\w+)|\[(\d+)\]')
+# Validator address categories -> address field of each document type
+ADDRESS_FIELDS = {
+    'Invoice': {"seller_address": "shop_address", "buyer_address": "billing_address"},
+    'PO': {"seller_address": "shop_address", "buyer_address": "billing_address"},
+    'Contract': {"seller_address": "seller_address", "buyer_address": "buyer_address"},
+}
+SCALAR_CATEGORIES = {
+    'Invoice': {"Billing": "total_bill.final_total", "Milestone": "milestone", "Contract Number": "contract_number"},
+    'PO': {},
+    'Contract': {"Contract Number": "contract_number"},
+}
+
+
+def parse_path(path):
+    """'product[2].UNIT_ITEM_PRICE' -> ['product', 2, 'UNIT_ITEM_PRICE']"""
+    return [int(index) if index else name for name, index in PATH_TOKEN_RE.findall(path)]
+
+
+def get_value(data, path):
+    for token in parse_path(path):
+        data = data[token]
+    return data
+
+
+def set_value(data, path, value):
+    tokens = parse_path(path)
+    for token in tokens[:-1]:
+        data = data[token]
+    data[tokens[-1]] = value
+
+
+def has_path(data, path):
+    try:
+        get_value(data, path)
+        return True
+    except (KeyError, IndexError, TypeError):
+        return False
+
+
+def leaf_field(model, path):
+    """The pydantic FieldInfo a path points at, following nested models and list items."""
+    field = None
+    for token in parse_path(path):
+        if isinstance(token, int):
+            continue
+        field = model.model_fields[token]
+        annotation = field.annotation
+        if typing.get_origin(annotation) in (list, typing.List):
+            annotation = typing.get_args(annotation)[0]
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            model = annotation
+    return field
+
+
+def product_index(data, description):
+    for index, product in enumerate(data.get("product", [])):
+        if normalize_description(product["PRODUCT_DESCRIPTION"]) == normalize_description(description):
+            return index
+    return None
+
+
+def paths_from_mismatches(mismatches, data, doctype):
+    """
+    Translate validator output into field paths of one of the compared documents.
+
+    :param mismatches: validate_po/validate_contract mismatch data (a list of issues or a dict with
+                       'mismatches'), or MismatchProduct_details output.
+    :param data: The stored document (dict) the paths should address.
+    :param doctype: Its document type, 'Invoice', 'PO' or 'Contract'.
+    :return: List of paths such as 'billing_address.postal_code' or 'product[2].UNIT_ITEM_PRICE'.
+    """
+    items = mismatches.get("mismatches", []) if isinstance(mismatches, dict) else mismatches
+    paths = []
+    for item in items:
+        if "Issue_category" in item:
+            category = item["Issue_category"]
+            detail = item.get(category) or {}
+            if category in ADDRESS_FIELDS[doctype]:
+                paths.extend(f"{ADDRESS_FIELDS[doctype][category]}.{key}" for key in detail)
+            elif category in SCALAR_CATEGORIES[doctype]:
+                paths.append(SCALAR_CATEGORIES[doctype][category])
+            elif isinstance(detail, dict):
+                index = product_index(data, category)
+                if index is not None:
+                    paths.extend(f"product[{index}].{name}" for name in detail)
+        elif item.get("Issue") == "Mismatch in quantity or rate":
+            index = product_index(data, item["Item"])
+            if index is None:
+                continue
+            if item["Quantity PO"] != item["Quantity Invoice"]:
+                paths.append(f"product[{index}].COUNT")
+            if item["Rate PO"] != item["Rate Invoice"]:
+                paths.append(f"product[{index}].UNIT_ITEM_PRICE")
+    unique = []
+    for path in paths:
+        if path not in unique and has_path(data, path):
+            unique.append(path)
+    return unique
+
+
+def field_name(path):
+    return re.sub(r'\W+', '_', path.replace('[', '_').replace(']', '')).strip('_')
+
+
+def correction_model(model, paths):
+    """A tiny response model with one field per path, typed and described like the original field."""
+    fields = {}
+    for path in paths:
+        leaf = leaf_field(model, path)
+        fields[field_name(path)] = (leaf.annotation, Field(description=f"{path}: {leaf.description}"))
+    return create_model(f"{model.__name__}Correction", **fields)
+
+
+def anchors_for(data, path):
+    """Text that identifies where on the document a field is printed."""
+    tokens = parse_path(path)
+    if tokens[0] == "product" and len(tokens) > 1:
+        return [data["product"][tokens[1]]["PRODUCT_DESCRIPTION"]]
+    if isinstance(get_value(data, tokens[0]), dict):
+        section = get_value(data, tokens[0])
+        return [str(section.get("name", "")), str(get_value(data, path))]
+    return [str(get_value(data, path))]
+
+
+def locate_pages(page_texts, data, paths, page_count):
+    """
+    1-based pages that print the fields, found by searching the text layer for row descriptions,
+    address names and current values. Falls back to page 1 for header fields and every page for rows.
+    """
+    normalized = [' '.join(text.split()).lower() for text in page_texts]
+    pages = set()
+    for path in paths:
+        found = set()
+        for anchor in anchors_for(data, path):
+            anchor = ' '.join(anchor.split()).lower()
+            if len(anchor) >= 3:
+                found.update(number for number, text in enumerate(normalized, start=1) if anchor in text)
+        if not found:
+            found = set(range(1, page_count + 1)) if path.startswith("product") else {1}
+        pages |= found
+    return sorted(pages)
+
+
+def describe_paths(data, paths):
+    lines = []
+    for path in paths:
+        tokens = parse_path(path)
+        where = f" (product row '{data['product'][tokens[1]]['PRODUCT_DESCRIPTION']}')" if tokens[0] == "product" else ""
+        lines.append(f"- {field_name(path)}{where}: currently recorded as {get_value(data, path)!r}")
+    return '\n'.join(lines)
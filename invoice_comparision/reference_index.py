@@ -0,0 +1,172 @@
+"""
+Persistent lookup of PO and contract documents by their reference number and vendor, so an
+invoice can be matched to its counterpart without scanning storage/parsed.
+
+Usage (rebuild from an existing store):
+    python reference_index.py storage/parsed storage/reference_index.sqlite [--store json]
+"""
+import re
+import time
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict
+import document_store
+
+# Reference number field and vendor name field of each indexed document type
+REFERENCE_FIELDS = {
+    "PO": ("po_number", "shop_address"),
+    "Contract": ("contract_number", "seller_address"),
+}
+VENDOR_SUFFIXES = {"inc", "incorporated", "llc", "ltd", "limited", "pvt", "private", "corp", "corporation",
+                   "co", "company", "plc", "gmbh", "llp"}
+NULL_REFERENCES = {"", "NULL", "NONE", "NA", "N/A"}
+
+
+def normalize_reference(value):
+    """'po-0042 ' and 'PO 0042' -> 'PO0042'; empty or NULL-like values -> None."""
+    value = str(value or "").strip().upper()
+    if value in NULL_REFERENCES:
+        return None
+    return re.sub(r'[^0-9A-Z]', '', value) or None
+
+
+def normalize_vendor(name):
+    """'Acme Supplies Pvt. Ltd.' -> 'acme supplies'"""
+    words = re.findall(r'[0-9a-z]+', str(name or "").lower())
+    while words and words[-1] in VENDOR_SUFFIXES:
+        words.pop()
+    return ' '.join(words)
+
+
+class ReferenceIndex:
+    """
+    sqlite index of (doctype, normalized reference, normalized vendor) -> stored document name,
+    kept current by DocumentParser.save_output, with an in-memory LRU of recently used documents.
+    """
+
+    def __init__(self, index_path, store: document_store.DocumentStore, cache_size=256):
+        """
+        :param index_path: sqlite database file; created on first use.
+        :param store: The document store the indexed documents live in.
+        :param cache_size: Number of reference documents kept decoded in memory.
+        """
+        self.index_path = index_path
+        self.store = store
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(index_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS reference ("
+            " doctype TEXT NOT NULL, reference TEXT NOT NULL, vendor TEXT NOT NULL,"
+            " name TEXT NOT NULL, location TEXT, updated REAL,"
+            " PRIMARY KEY (doctype, reference, vendor))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS reference_name ON reference (doctype, name)")
+        self.connection.commit()
+
+    def add(self, doctype, name, data, location=None):
+        """
+        Index a saved document; documents of types without a reference number are ignored.
+
+        :param name: Document name in the store (input file name without extension).
+        :param data: The saved document as a dict.
+        :return: True if the document was indexed, False if it has no usable reference number.
+        """
+        if doctype not in REFERENCE_FIELDS:
+            return False
+        number_field, vendor_field = REFERENCE_FIELDS[doctype]
+        reference = normalize_reference(data.get(number_field))
+        vendor = normalize_vendor((data.get(vendor_field) or {}).get("name"))
+        with self._lock:
+            # A re-save may have corrected the number, so drop whatever the document was indexed under
+            self.connection.execute("DELETE FROM reference WHERE doctype = ? AND name = ?", (doctype, name))
+            if reference is not None:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO reference (doctype, reference, vendor, name, location, updated) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", (doctype, reference, vendor, name, location, time.time()))
+            self.connection.commit()
+            self.cache.pop((doctype, name), None)
+        return reference is not None
+
+    def resolve(self, doctype, number, vendor=None):
+        """
+        :return: Name of the stored document with this reference number and the given vendor. Without
+                 a vendor, or when the only document has no vendor recorded, the number alone decides if
+                 it is unique. None when nothing matches, including a document of a different vendor.
+        """
+        reference = normalize_reference(number)
+        if reference is None:
+            return None
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT vendor, name FROM reference WHERE doctype = ? AND reference = ?",
+                (doctype, reference)).fetchall()
+        if not rows:
+            return None
+        vendor = normalize_vendor(vendor)
+        for row_vendor, name in rows:
+            if vendor and row_vendor == vendor:
+                return name
+        if len(rows) == 1 and not (vendor and rows[0][0]):
+            return rows[0][1]
+        return None
+
+    def get_document(self, doctype, number, vendor=None):
+        """:return: The referenced document as a dict, or None."""
+        name = self.resolve(doctype, number, vendor)
+        if name is None:
+            return None
+        key = (doctype, name)
+        with self._lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key]
+            self.misses += 1
+        document = self.store.get(doctype, name)
+        if document is not None:
+            with self._lock:
+                self.cache[key] = document
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return document
+
+    def rebuild(self):
+        """Re-index every PO and contract in the store. :return: Number of documents indexed."""
+        with self._lock:
+            self.connection.execute("DELETE FROM reference")
+            self.connection.commit()
+            self.cache.clear()
+        indexed = 0
+        for doctype in REFERENCE_FIELDS:
+            for name, data in self.store.iter_documents(doctype):
+                indexed += self.add(doctype, name, data)
+        return indexed
+
+    def stats(self):
+        with self._lock:
+            count = self.connection.execute("SELECT COUNT(*) FROM reference").fetchone()[0]
+        return {"indexed": count, "cached": len(self.cache), "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("parsed_dir")
+    arg_parser.add_argument("index_path")
+    arg_parser.add_argument("--store", default="json", choices=sorted(document_store.STORES))
+    args = arg_parser.parse_args()
+
+    index = ReferenceIndex(args.index_path, document_store.open_store(args.store, args.parsed_dir))
+    print(f"Indexed {index.rebuild()} reference document(s) into {args.index_path}")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
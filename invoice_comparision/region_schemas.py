@@ -0,0 +1,133 @@
+import re
+import threading
+from typing import List
+from pydantic import Field, create_model
+import document_class as document_class
+
+# Optional Product columns and the header text that shows a document actually has them
+OPTIONAL_COLUMNS = {
+    "HSN": re.compile(r'\b(HSN|SAC)\b', re.IGNORECASE),
+    "MRP": re.compile(r'\bMRP\b', re.IGNORECASE),
+    "GROSS_AMOUNT": re.compile(r'\bgross\b', re.IGNORECASE),
+    "DISCOUNT_RATE": re.compile(r'\bdisc(ount)?\b', re.IGNORECASE),
+    "CGST_RATE": re.compile(r'\bCGST\b', re.IGNORECASE),
+    "CGST_AMOUNT": re.compile(r'\bCGST\b', re.IGNORECASE),
+    "SGST_RATE": re.compile(r'\bSGST\b', re.IGNORECASE),
+    "SGST_AMOUNT": re.compile(r'\bSGST\b', re.IGNORECASE),
+    "GST_RATE": re.compile(r'\b(IGST|GST)\b', re.IGNORECASE),
+    "GST_AMOUNT": re.compile(r'\b(IGST|GST)\b', re.IGNORECASE),
+    "TAXABLE_AMOUNT": re.compile(r'\btaxable\b', re.IGNORECASE),
+    "NET_AMOUNT": re.compile(r'\bnet\b', re.IGNORECASE),
+}
+GST_COLUMNS = {"HSN", "CGST_RATE", "CGST_AMOUNT", "SGST_RATE", "SGST_AMOUNT", "GST_RATE", "GST_AMOUNT"}
+
+GST_MARKERS = re.compile(r'\b(GSTIN|CGST|SGST|IGST|HSN)\b|₹|\bRs\.?\s*\d|\bINR\b', re.IGNORECASE)
+US_MARKERS = re.compile(r'\$\s?\d|\bUSD\b|\bsales tax\b|\b[A-Z]{2}\s+\d{5}(-\d{4})?\b')
+
+# Documents whose line items can be requested with a slim product model
+PRODUCT_CONTAINERS = (document_class.Invoice, document_class.PO, document_class.ProductPage)
+
+_lock = threading.Lock()
+_variants = {}
+
+
+def detect_regime(text):
+    """
+    Cheap rule-based tax regime detection on a document's text.
+
+    :return: 'IN_GST', 'US' or None when there is no text or no clear signal.
+    """
+    if not text or not text.strip():
+        return None
+    if GST_MARKERS.search(text):
+        return 'IN_GST'
+    if US_MARKERS.search(text):
+        return 'US'
+    return None
+
+
+def detect_columns(text, regime):
+    """:return: The Product fields to request for a document of this regime."""
+    columns = {name for name in document_class.Product.model_fields if name not in OPTIONAL_COLUMNS}
+    columns.update(name for name, marker in OPTIONAL_COLUMNS.items() if marker.search(text))
+    if regime == 'US':
+        # US sales tax is charged on the bill, not per line
+        columns -= GST_COLUMNS
+    return columns
+
+
+def message_text(messages):
+    """Concatenate the text parts of chat messages (document text for the text and hybrid paths)."""
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(part.get("text", "") for part in content or [] if part.get("type") == "text")
+    return '\n'.join(parts)
+
+
+def _build_variant(full_model, columns):
+    product_fields = document_class.Product.model_fields
+    slim_product = create_model(
+        "Product", **{name: (field.annotation, field) for name, field in product_fields.items() if name in columns})
+    fields = {name: (field.annotation, field) for name, field in full_model.model_fields.items()}
+    fields["product"] = (List[slim_product], Field(description=full_model.model_fields["product"].description))
+    return create_model(full_model.__name__, **fields)
+
+
+def slim_model(full_model, columns):
+    """The cached variant of full_model whose product rows carry only the given columns."""
+    key = (full_model, frozenset(columns))
+    variant = _variants.get(key)
+    if variant is None:
+        with _lock:
+            variant = _variants.get(key)
+            if variant is None:
+                variant = _variants[key] = _build_variant(full_model, columns)
+    return variant
+
+
+def select_model(full_model, text):
+    """
+    Pick the response model for a document from its text.
+
+    :return: (request_model, regime, columns); request_model is full_model itself when no slimmer
+             schema applies (unknown regime, e.g. scanned documents, or every column present).
+    """
+    regime = detect_regime(text)
+    if regime is None or full_model not in PRODUCT_CONTAINERS:
+        return full_model, regime, None
+    columns = detect_columns(text, regime)
+    if len(columns) == len(document_class.Product.model_fields):
+        return full_model, regime, None
+    return slim_model(full_model, columns), regime, columns
+
+
+def expand_product(values):
+    """
+    Expand a slim product row to the canonical Product shape.
+
+    Columns the document does not have are filled the way the full schema asks for them
+    (0, or 'Null' for HSN); the amount columns are derived from the line total.
+    """
+    product = {name: 0.0 for name in document_class.Product.model_fields}
+    product["HSN"] = "Null"
+    product.update(values)
+    total = product["PRODUCT_TOTAL_PRICE"]
+    if "GROSS_AMOUNT" not in values:
+        product["GROSS_AMOUNT"] = total
+    if "TAXABLE_AMOUNT" not in values:
+        product["TAXABLE_AMOUNT"] = round(total * (1 - product["DISCOUNT_RATE"] / 100), 2)
+    if "NET_AMOUNT" not in values:
+        taxes = product["CGST_AMOUNT"] + product["SGST_AMOUNT"] + product["GST_AMOUNT"]
+        product["NET_AMOUNT"] = round(product["TAXABLE_AMOUNT"] + taxes, 2)
+    return product
+
+
+def expand_response(response, full_model):
+    """Rebuild a slim-model response as an instance of the canonical full_model."""
+    data = response.model_dump()
+    data["product"] = [expand_product(row) for row in data["product"]]
+    return full_model(**data)
@@ -0,0 +1,149 @@
+import json
+import hashlib
+import threading
+import tracing
+import document_class as document_class
+
+SYSTEM_PROMPT = ("Your goal is to extract structured information from the provided document. "
+                 "Call the {name} function exactly once with every field filled from the document.")
+
+# Follow-up requests after a tool call fails validation, as instructor's max_retries re-ask did
+MAX_REASKS = 1
+
+_lock = threading.Lock()
+_prepared = {}
+
+
+class PreparedModel:
+    """
+    Everything static about a structured-extraction request for one response model, built once.
+
+    instructor re-derives the function schema from the pydantic model (all Field descriptions
+    included) on every call; here the JSON schema, tool definition and system prompt are compiled
+    once and the request is sent with the plain OpenAI client. The tool definition and system
+    message are identical on every request for the model and come before any document content,
+    so the provider can serve them from its prompt cache.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.name = model.__name__
+        self.json_schema = model.model_json_schema()
+        self.schema_hash = hashlib.sha256(
+            json.dumps(self.json_schema, sort_keys=True).encode('utf-8')).hexdigest()
+        self.tool = {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": (model.__doc__ or f"Correctly extracted `{self.name}` with all the required parameters "
+                                                  f"with correct types").strip(),
+                "parameters": self.json_schema,
+            },
+        }
+        self.tool_choice = {"type": "function", "function": {"name": self.name}}
+        self.system_message = {"role": "system", "content": SYSTEM_PROMPT.format(name=self.name)}
+        # Routes requests sharing this prefix to the same cache shard
+        self.prompt_cache_key = f"{self.name}-{self.schema_hash[:16]}"
+
+    def request_kwargs(self, llm_model, messages):
+        """Keyword arguments for chat.completions.create with the static prefix first."""
+        return {
+            "model": llm_model,
+            "messages": [self.system_message] + list(messages),
+            "tools": [self.tool],
+            "tool_choice": self.tool_choice,
+            "prompt_cache_key": self.prompt_cache_key,
+        }
+
+    def parse(self, completion):
+        """Validate the tool call arguments of a completion into the response model."""
+        tool_calls = completion.choices[0].message.tool_calls
+        if not tool_calls:
+            raise ValueError(f"Model returned no {self.name} function call "
+                             f"(finish_reason={completion.choices[0].finish_reason})")
+        return self.model.model_validate_json(tool_calls[0].function.arguments)
+
+    def reask_messages(self, completion, error):
+        """
+        Follow-up messages telling the model why its answer was rejected: its own tool call, then
+        the validation error as the tool result.
+        """
+        message = completion.choices[0].message
+        if not message.tool_calls:
+            return [{"role": "user", "content": f"You must call the {self.name} function. {error}"}]
+        tool_call = message.tool_calls[0]
+        return [
+            {"role": "assistant", "content": message.content, "tool_calls": [{
+                "id": tool_call.id, "type": "function",
+                "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments},
+            }]},
+            {"role": "tool", "tool_call_id": tool_call.id,
+             "content": f"Validation error:\n{error}\nCall the {self.name} function again with the errors fixed."},
+        ]
+
+
+def prepare(model):
+    """:return: The cached PreparedModel for a pydantic response model."""
+    prepared = _prepared.get(model)
+    if prepared is None:
+        with _lock:
+            prepared = _prepared.get(model)
+            if prepared is None:
+                prepared = _prepared[model] = PreparedModel(model)
+    return prepared
+
+
+def prepare_all():
+    """Compile every response model the parser can request; called once at parser start-up."""
+    for model in (document_class.PO, document_class.Invoice, document_class.Contract,
+                  document_class.InvoiceHeader, document_class.POHeader, document_class.ProductPage):
+        prepare(model)
+
+
+def _reasked(error, attempt, max_reasks):
+    if attempt >= max_reasks:
+        return False
+    span = tracing.current_span()
+    if span is not None:
+        span.add("reasks", 1)
+    print(f"Response failed validation ({error.__class__.__name__}), re-ask {attempt + 1}/{max_reasks}")
+    return True
+
+
+def create(client, llm_model, response_model, messages, max_reasks=MAX_REASKS):
+    """
+    Structured extraction through a plain OpenAI client.
+
+    A tool call that does not validate against response_model is sent back with the error, up
+    to max_reasks times, before the ValidationError is raised.
+
+    :return: (response, completion) where completion is the last request's.
+    """
+    prepared = prepare(response_model)
+    messages = list(messages)
+    attempt = 0
+    while True:
+        completion = client.chat.completions.create(**prepared.request_kwargs(llm_model, messages))
+        try:
+            return prepared.parse(completion), completion
+        except ValueError as e:
+            if not _reasked(e, attempt, max_reasks):
+                raise
+            messages += prepared.reask_messages(completion, e)
+            attempt += 1
+
+
+async def acreate(client, llm_model, response_model, messages, max_reasks=MAX_REASKS):
+    """Async counterpart of create; client is an AsyncOpenAI client."""
+    prepared = prepare(response_model)
+    messages = list(messages)
+    attempt = 0
+    while True:
+        completion = await client.chat.completions.create(**prepared.request_kwargs(llm_model, messages))
+        try:
+            return prepared.parse(completion), completion
+        except ValueError as e:
+            if not _reasked(e, attempt, max_reasks):
+                raise
+            messages += prepared.reask_messages(completion, e)
+            attempt += 1
@@ -0,0 +1,181 @@
+import re
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import document_class as document_class
+import rasterizer
+import text_layer
+import region_schemas
+
+# Doctypes whose product rows can be extracted separately from the header: (full model, header model, id field)
+SPLIT_MODELS = {
+    'Invoice': (document_class.Invoice, document_class.InvoiceHeader, 'invoice_number'),
+    'PO': (document_class.PO, document_class.POHeader, 'po_number'),
+}
+
+NUMERIC_FIELDS = [name for name, field in document_class.Product.model_fields.items()
+                  if field.annotation in (int, float)]
+
+
+def normalize_description(description):
+    return re.sub(r'[^a-z0-9]+', ' ', description.lower()).strip()
+
+
+def boundary_relation(previous, current):
+    """
+    How the first row of a page group relates to the last row of the previous group.
+
+    A row cut by a page break is extracted from both sides, with the description cut short or
+    some numbers missing on one side. Numbers must agree wherever both sides have them.
+
+    :return: 'split' when there is such evidence of a cut row, 'identical' when both rows are
+             complete and equal (a genuinely repeated line looks the same), None for different rows.
+    """
+    prev_desc = normalize_description(previous["PRODUCT_DESCRIPTION"])
+    curr_desc = normalize_description(current["PRODUCT_DESCRIPTION"])
+    if not prev_desc or not curr_desc:
+        return None
+    truncated = prev_desc != curr_desc and (prev_desc.startswith(curr_desc) or curr_desc.startswith(prev_desc))
+    if prev_desc != curr_desc and not truncated:
+        return None
+    one_sided = False
+    for name in NUMERIC_FIELDS:
+        if previous[name] and current[name]:
+            if abs(previous[name] - current[name]) > 0.005:
+                return None
+        elif previous[name] or current[name]:
+            one_sided = True
+    return "split" if truncated or one_sided else "identical"
+
+
+def merge_rows(previous, current):
+    """Combine both halves of a split row, keeping the longer description and any non-zero numbers."""
+    merged = dict(previous)
+    if len(current["PRODUCT_DESCRIPTION"]) > len(previous["PRODUCT_DESCRIPTION"]):
+        merged["PRODUCT_DESCRIPTION"] = current["PRODUCT_DESCRIPTION"]
+    for name in NUMERIC_FIELDS:
+        if not merged[name]:
+            merged[name] = current[name]
+    if merged["HSN"] in ("", "Null", "same as above"):
+        merged["HSN"] = current["HSN"]
+    return merged
+
+
+def merge_product_groups(groups, total_bill=None):
+    """
+    Concatenate per-group product rows in page order, merging rows split at group boundaries.
+
+    Identical complete rows on both sides of a boundary are kept as separate lines, unless
+    total_bill is given and only the variant with them collapsed reconciles with it.
+
+    :return: (products, duplicates_removed, identical rows kept as repeats)
+    """
+    products = []
+    removed = 0
+    repeats = []
+    for rows in groups:
+        rows = list(rows)
+        if products and rows:
+            relation = boundary_relation(products[-1], rows[0])
+            if relation == "split":
+                products[-1] = merge_rows(products[-1], rows[0])
+                rows = rows[1:]
+                removed += 1
+            elif relation == "identical":
+                repeats.append(len(products))
+        products.extend(rows)
+    if repeats and total_bill is not None:
+        repeats = set(repeats)
+        collapsed = [row for index, row in enumerate(products) if index not in repeats]
+        if check_products_total(collapsed, total_bill)[0] and not check_products_total(products, total_bill)[0]:
+            return collapsed, removed + len(repeats), 0
+    return products, removed, len(repeats)
+
+
+def check_products_total(products, total_bill, rel_tolerance=0.005, abs_tolerance=1.0):
+    """
+    Compare the sum of line totals with TotalBill.total.
+
+    :return: (ok, products_total)
+    """
+    products_total = round(sum(p["PRODUCT_TOTAL_PRICE"] for p in products), 2)
+    bill_total = total_bill["total"]
+    tolerance = max(abs_tolerance, abs(bill_total) * rel_tolerance)
+    return abs(products_total - bill_total) <= tolerance, products_total
+
+
+class ShardedExtractor:
+    """
+    Extracts long invoices/POs in page groups instead of one request.
+
+    Header and total_bill fields come from the first and last pages; product rows are extracted
+    per page group in parallel and merged in page order.
+    """
+
+    def __init__(self, parser, pages_per_group=4, max_workers=4):
+        """
+        :param parser: DocumentParser used for message building and governed/retried LLM calls.
+        :param pages_per_group: Pages sent in each product-extraction request.
+        :param max_workers: Page-group requests in flight at once.
+        """
+        self.parser = parser
+        self.pages_per_group = pages_per_group
+        self.max_workers = max_workers
+
+    def _extract_header(self, input_file, header_model, page_count, page_texts):
+        pages = [1] if page_count == 1 else [1, page_count]
+        context = (f"These are the first and last pages of a {page_count}-page document. "
+                   f"Extract the document header fields and the bill totals.")
+        messages, _ = self.parser.build_page_messages(input_file, pages, page_texts, context)
+        return self.parser.call_model(messages, header_model)
+
+    def _extract_group(self, input_file, pages, page_count, page_texts, page_model):
+        context = (f"These are pages {pages[0]}-{pages[-1]} of a {page_count}-page document. "
+                   f"Extract only the product rows printed on these pages, in order. "
+                   f"Include a row cut off at the top or bottom of these pages as far as it is visible.")
+        messages, _ = self.parser.build_page_messages(input_file, pages, page_texts, context)
+        page, retries = self.parser.call_model(messages, page_model)
+        rows = page.model_dump()["product"]
+        if page_model is not document_class.ProductPage:
+            rows = [region_schemas.expand_product(row) for row in rows]
+        return rows, retries
+
+    def extract(self, input_file, doctype, stats=None):
+        """
+        :param stats: Optional dict; receives retries, page_groups, duplicates_removed, repeats_kept and the
+                      total check (products_total_ok, products_total, bill_total).
+        :return: (response, file_num) like DocumentParser.generate_response.
+        """
+        model, header_model, field = SPLIT_MODELS[doctype]
+        page_count = rasterizer.pdf_page_count(input_file)
+        page_texts = text_layer.extract_page_texts(input_file) if self.parser.use_text_layer else []
+        groups = [list(range(first, min(first + self.pages_per_group, page_count + 1)))
+                  for first in range(1, page_count + 1, self.pages_per_group)]
+        page_model = self.parser.select_request_model('\n'.join(page_texts), document_class.ProductPage, stats)
+        print(f"Sharded extraction of {input_file}: {page_count} pages in {len(groups)} group(s)")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers + 1, thread_name_prefix="shard") as executor:
+            # Each request runs in a copy of the caller's context so its spans nest under the document's trace
+            header_future = executor.submit(contextvars.copy_context().run, self._extract_header,
+                                            input_file, header_model, page_count, page_texts)
+            group_futures = [executor.submit(contextvars.copy_context().run, self._extract_group,
+                                             input_file, pages, page_count, page_texts, page_model)
+                             for pages in groups]
+            header, retries = header_future.result()
+            group_results = [future.result() for future in group_futures]
+
+        retries += sum(group_retries for _, group_retries in group_results)
+        header_data = header.model_dump()
+        products, removed, repeats = merge_product_groups([rows for rows, _ in group_results],
+                                                          header_data["total_bill"])
+        total_ok, products_total = check_products_total(products, header_data["total_bill"])
+
+        response = model(**header_data, product=products)
+        if stats is not None:
+            stats["retries"] = retries
+            stats["page_groups"] = len(groups)
+            stats["duplicates_removed"] = removed
+            stats["repeats_kept"] = repeats
+            stats["products_total_ok"] = total_ok
+            stats["products_total"] = products_total
+            stats["bill_total"] = header_data["total_bill"]["total"]
+        return response, header_data[field]
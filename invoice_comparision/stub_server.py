@@ -0,0 +1,409 @@
+"""
+Offline OpenAI-compatible stub of the chat-completions endpoint for load testing DocumentParser.
+
+Responses are tool calls built from fixture JSON files (parsed outputs such as
+'Sample_Invoice (1).json'), projected onto whatever schema the request's tool declares, so full,
+header-only, page-group and slim product models all get a valid answer. Latency, 429/500 errors
+and token usage are simulated; counters are served on GET /stats. The Files and Batches endpoints
+used by batch_runner.py are emulated as well: uploaded JSONL batches are answered line by line in
+a background thread after --batch-seconds.
+
+Usage:
+    python stub_server.py --port 8089 --latency lognormal:1200,0.4 --rate-429 0.05 --rate-500 0.01
+    DocumentParser(..., base_url="http://127.0.0.1:8089/v1")
+"""
+import os
+import re
+import math
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FIXTURES = {
+    "Invoice": os.path.join(HERE, "Sample_Invoice (1).json"),
+    "PO": os.path.join(HERE, "Sample_Purchase_Order.json"),
+    "Contract": os.path.join(HERE, "US_Sample_Contract.json"),
+}
+# Tool names without a fixture of their own answer from the document they are a part of
+FIXTURE_ALIASES = {"InvoiceHeader": "Invoice", "POHeader": "PO", "ProductPage": "Invoice"}
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 765
+CACHEABLE_PREFIX_TOKENS = 1024
+
+
+def parse_latency(spec):
+    """
+    :param spec: 'fixed:MS', 'uniform:LOW_MS,HIGH_MS' or 'lognormal:MEDIAN_MS,SIGMA'.
+    :return: Function of a random.Random returning one latency sample in seconds.
+    """
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',')] if args else []
+    if kind == 'fixed':
+        return lambda rng: values[0] / 1000
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1]) / 1000
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def default_for(schema):
+    kind = schema.get("type")
+    if kind == "string":
+        return "NULL"
+    if kind in ("number", "integer"):
+        return 0
+    if kind == "array":
+        return []
+    return None
+
+
+def project(value, schema, defs):
+    """Reshape fixture data to a JSON schema: keep declared properties, fill missing ones with defaults."""
+    if "$ref" in schema:
+        schema = defs[schema["$ref"].split('/')[-1]]
+    if "allOf" in schema and len(schema["allOf"]) == 1:
+        return project(value, schema["allOf"][0], defs)
+    if "properties" in schema:
+        value = value if isinstance(value, dict) else {}
+        result = {}
+        for name, prop in schema["properties"].items():
+            result[name] = project(value[name], prop, defs) if name in value else project_default(prop, defs)
+        return result
+    if schema.get("type") == "array" and "items" in schema:
+        return [project(item, schema["items"], defs) for item in (value or [])]
+    return value
+
+
+def project_default(schema, defs):
+    if "$ref" in schema or "properties" in schema:
+        return project({}, schema, defs)
+    return default_for(schema)
+
+
+def estimate_prompt_tokens(messages, tools):
+    tokens = len(json.dumps(tools)) // CHARS_PER_TOKEN if tools else 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += len(content) // CHARS_PER_TOKEN + 4
+            continue
+        for part in content or []:
+            if part.get("type") == "image_url":
+                tokens += IMAGE_TOKENS
+            elif part.get("type") == "text":
+                tokens += len(part.get("text", "")) // CHARS_PER_TOKEN
+    return tokens
+
+
+class StubState:
+    """Configuration and counters shared by all request handler threads."""
+
+    def __init__(self, fixtures=None, latency='fixed:0', rate_429=0.0, rate_500=0.0, tokens_per_minute=2_000_000,
+                 seed=None, batch_seconds=2.0):
+        self.fixtures = {}
+        for name, path in {**DEFAULT_FIXTURES, **(fixtures or {})}.items():
+            with open(path, 'r') as f:
+                self.fixtures[name] = json.load(f)
+        self.latency = parse_latency(latency)
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.tokens_per_minute = tokens_per_minute
+        self.seed = seed
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.cache_keys = set()
+        self.batch_seconds = batch_seconds
+        self.files = {}
+        self.batches = {}
+        self.counters = {"requests": 0, "ok": 0, "injected_429": 0, "injected_500": 0, "prompt_tokens": 0,
+                         "cached_tokens": 0, "completion_tokens": 0}
+
+    def count(self, **amounts):
+        with self.lock:
+            for key, amount in amounts.items():
+                self.counters[key] += amount
+
+    def request_random(self):
+        """
+        A random generator of its own for the next request.
+
+        Handler threads never share a generator. With a seed, the n-th request draws the same
+        latency and injected failure on every run, whatever the thread interleaving.
+        """
+        with self.lock:
+            self.sequence += 1
+            sequence = self.sequence
+        return random.Random(f"{self.seed}:{sequence}") if self.seed is not None else random.Random()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def fixture_for(self, tool_name):
+        name = FIXTURE_ALIASES.get(tool_name, tool_name)
+        if name not in self.fixtures:
+            raise KeyError(f"No fixture for tool {tool_name}")
+        return self.fixtures[name]
+
+    def add_file(self, filename, content, purpose):
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        with self.lock:
+            self.files[file_id] = {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                                   "filename": filename, "purpose": purpose, "status": "processed", "content": content}
+        return self.file_object(file_id)
+
+    def file_object(self, file_id):
+        return {key: value for key, value in self.files[file_id].items() if key != "content"}
+
+    def create_batch(self, body):
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        lines = [json.loads(line) for line in self.files[body["input_file_id"]]["content"].decode('utf-8').splitlines()
+                 if line.strip()]
+        batch = {"id": batch_id, "object": "batch", "endpoint": body["endpoint"], "errors": None,
+                 "input_file_id": body["input_file_id"], "completion_window": body["completion_window"],
+                 "status": "validating", "output_file_id": None, "error_file_id": None,
+                 "created_at": int(time.time()), "in_progress_at": None, "completed_at": None,
+                 "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+                 "metadata": body.get("metadata")}
+        with self.lock:
+            self.batches[batch_id] = batch
+        threading.Thread(target=self.run_batch, args=(batch, lines), daemon=True, name=f"stub-{batch_id}").start()
+        return dict(batch)
+
+    def run_batch(self, batch, lines):
+        batch["status"] = "in_progress"
+        batch["in_progress_at"] = int(time.time())
+        time.sleep(self.batch_seconds)
+        outputs, errors = [], []
+        for line in lines:
+            record = {"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": line["custom_id"]}
+            # Batch lines are not retried by the provider: injected failures end up in the error file
+            if self.request_random().random() < self.rate_500:
+                self.count(injected_500=1)
+                record.update(response=None, error={"code": "server_error", "message": "Internal server error (stub)"})
+                errors.append(record)
+                batch["request_counts"]["failed"] += 1
+                continue
+            try:
+                completion = self.completion(line["body"])
+            except (KeyError, ValueError) as e:
+                record.update(response=None, error={"code": "invalid_request", "message": str(e)})
+                errors.append(record)
+                batch["request_counts"]["failed"] += 1
+                continue
+            record.update(response={"status_code": 200, "request_id": uuid.uuid4().hex, "body": completion},
+                          error=None)
+            outputs.append(record)
+            batch["request_counts"]["completed"] += 1
+        if outputs:
+            batch["output_file_id"] = self.add_file(f"{batch['id']}_output.jsonl", self.jsonl(outputs),
+                                                    "batch_output")["id"]
+        if errors:
+            batch["error_file_id"] = self.add_file(f"{batch['id']}_error.jsonl", self.jsonl(errors),
+                                                   "batch_output")["id"]
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+    @staticmethod
+    def jsonl(records):
+        return ''.join(json.dumps(record) + '\n' for record in records).encode('utf-8')
+
+    def completion(self, body):
+        """Build a chat.completion for a request body."""
+        messages = body.get("messages", [])
+        tools = body.get("tools") or []
+        prompt_tokens = estimate_prompt_tokens(messages, tools)
+
+        cached_tokens = 0
+        cache_key = body.get("prompt_cache_key")
+        if cache_key and tools:
+            # Provider-side prefix caching: the tool definition and system prompt repeat per cache key
+            prefix_tokens = estimate_prompt_tokens([m for m in messages if m.get("role") == "system"], tools)
+            with self.lock:
+                if cache_key in self.cache_keys and prefix_tokens >= CACHEABLE_PREFIX_TOKENS:
+                    cached_tokens = prefix_tokens
+                self.cache_keys.add(cache_key)
+
+        message = {"role": "assistant", "content": None}
+        if tools:
+            function = tools[0]["function"]
+            parameters = function["parameters"]
+            arguments = json.dumps(project(self.fixture_for(function["name"]), parameters, parameters.get("$defs", {})))
+            message["tool_calls"] = [{"id": f"call_{uuid.uuid4().hex[:24]}", "type": "function",
+                                      "function": {"name": function["name"], "arguments": arguments}}]
+            finish_reason = "tool_calls"
+            completion_tokens = len(arguments) // CHARS_PER_TOKEN
+        else:
+            message["content"] = json.dumps(self.fixtures["Invoice"])
+            finish_reason = "stop"
+            completion_tokens = len(message["content"]) // CHARS_PER_TOKEN
+
+        self.count(ok=1, prompt_tokens=prompt_tokens, cached_tokens=cached_tokens, completion_tokens=completion_tokens)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: StubState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_not_found(self):
+        self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def read_raw(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length)
+
+    def read_body(self):
+        return json.loads(self.read_raw() or b'{}')
+
+    def do_GET(self):
+        path = self.path.split('?')[0].rstrip('/')
+        state = self.state
+        file_match = re.search(r'/files/([\w-]+)(/content)?$', path)
+        batch_match = re.search(r'/batches/([\w-]+)$', path)
+        if path.endswith('/stats'):
+            self.send_json(200, state.stats())
+        elif file_match and file_match.group(1) in state.files:
+            if file_match.group(2):
+                content = state.files[file_match.group(1)]["content"]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/jsonl")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+            else:
+                self.send_json(200, state.file_object(file_match.group(1)))
+        elif batch_match and batch_match.group(1) in state.batches:
+            self.send_json(200, state.batches[batch_match.group(1)])
+        else:
+            self.send_not_found()
+
+    def upload_file(self):
+        # multipart/form-data with a 'file' part and a 'purpose' field
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8') + self.read_raw())
+        fields, filename, content = {}, "upload.jsonl", b''
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "file":
+                filename = part.get_filename() or filename
+                content = part.get_payload(decode=True)
+            else:
+                fields[name] = part.get_content().strip()
+        self.send_json(200, self.state.add_file(filename, content, fields.get("purpose", "batch")))
+
+    def do_POST(self):
+        path = self.path.split('?')[0].rstrip('/')
+        if path.endswith('/files'):
+            self.upload_file()
+            return
+        if path.endswith('/batches'):
+            self.send_json(200, self.state.create_batch(self.read_body()))
+            return
+        if not path.endswith('/chat/completions'):
+            self.send_not_found()
+            return
+        body = self.read_body()
+        state = self.state
+        state.count(requests=1)
+        rng = state.request_random()
+        time.sleep(state.latency(rng))
+
+        roll = rng.random()
+        if roll < state.rate_429:
+            state.count(injected_429=1)
+            self.send_json(429, {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_error"}},
+                           {"retry-after-ms": str(rng.randint(200, 2000)),
+                            "x-ratelimit-remaining-tokens": "0"})
+            return
+        if roll < state.rate_429 + state.rate_500:
+            state.count(injected_500=1)
+            self.send_json(500, {"error": {"message": "Internal server error (stub)", "type": "server_error"}})
+            return
+        try:
+            completion = state.completion(body)
+        except (KeyError, ValueError) as e:
+            self.send_json(400, {"error": {"message": str(e), "type": "invalid_request_error"}})
+            return
+        self.send_json(200, completion, {
+            "x-ratelimit-limit-tokens": str(state.tokens_per_minute),
+            "x-ratelimit-remaining-tokens": str(state.tokens_per_minute - completion["usage"]["total_tokens"]),
+            "x-ratelimit-reset-tokens": "60s",
+        })
+
+
+def serve(host="127.0.0.1", port=8089, state=None, handler=StubHandler):
+    """
+    Start the stub in a background thread.
+
+    :return: The running ThreadingHTTPServer; call shutdown() to stop it.
+    """
+    handler = type("BoundStubHandler", (handler,), {"state": state or StubState()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="stub-server").start()
+    print(f"Stub OpenAI server listening on http://{host}:{server.server_port}/v1")
+    return server
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8089)
+    arg_parser.add_argument("--latency", default="lognormal:1200,0.4",
+                            help="fixed:MS, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA (milliseconds)")
+    arg_parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests answered with 429")
+    arg_parser.add_argument("--rate-500", type=float, default=0.0, help="fraction of requests answered with 500")
+    arg_parser.add_argument("--fixture", action="append", default=[], metavar="NAME=PATH",
+                            help="fixture for a response model, e.g. Invoice=US_Sample_Invoice.json")
+    arg_parser.add_argument("--seed", type=int)
+    arg_parser.add_argument("--batch-seconds", type=float, default=2.0, help="time a submitted batch stays in progress")
+    args = arg_parser.parse_args()
+
+    fixtures = dict(item.split('=', 1) for item in args.fixture)
+    state = StubState(fixtures, args.latency, args.rate_429, args.rate_500, seed=args.seed,
+                      batch_seconds=args.batch_seconds)
+    server = serve(args.host, args.port, state)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(json.dumps(state.stats(), indent=2))
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
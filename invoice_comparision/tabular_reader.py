@@ -0,0 +1,188 @@
+import re
+import datetime
+from openpyxl import load_workbook
+from docx import Document
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+import document_class as document_class
+
+# Header spellings seen on vendor spreadsheets, matched after normalize_header
+COLUMN_SYNONYMS = {
+    "PRODUCT_DESCRIPTION": ["description", "item description", "item", "items", "product", "product name",
+                            "particulars", "service", "description of goods", "item name", "details"],
+    "HSN": ["hsn", "hsn code", "hsn sac", "sac", "hsn sac code"],
+    "MRP": ["mrp"],
+    "GROSS_AMOUNT": ["gross", "gross amount", "gross amt"],
+    "DISCOUNT_RATE": ["discount", "discount rate", "disc", "disc %", "discount %"],
+    "CGST_RATE": ["cgst rate", "cgst %"],
+    "CGST_AMOUNT": ["cgst", "cgst amount", "cgst amt"],
+    "SGST_RATE": ["sgst rate", "sgst %"],
+    "SGST_AMOUNT": ["sgst", "sgst amount", "sgst amt"],
+    "COUNT": ["qty", "quantity", "count", "units", "no of units", "nos"],
+    "GST_RATE": ["gst rate", "gst %", "tax rate", "tax %"],
+    "GST_AMOUNT": ["gst", "gst amount", "tax", "tax amount"],
+    "UNIT_ITEM_PRICE": ["rate", "unit price", "price", "unit cost", "price per unit", "rate per unit", "unit rate"],
+    "PRODUCT_TOTAL_PRICE": ["amount", "total", "line total", "total price", "total amount", "value"],
+    "TAXABLE_AMOUNT": ["taxable value", "taxable amount", "taxable amt"],
+    "NET_AMOUNT": ["net amount", "net", "net amt", "net total"],
+}
+HEADER_LOOKUP = {synonym: field for field, synonyms in COLUMN_SYNONYMS.items() for synonym in synonyms}
+PRICE_FIELDS = {"COUNT", "UNIT_ITEM_PRICE", "PRODUCT_TOTAL_PRICE"}
+TOTAL_ROW_RE = re.compile(r'^(sub\s*)?total|grand total|amount due|balance due', re.IGNORECASE)
+NUMBER_RE = re.compile(r'-?\d[\d,]*(?:\.\d+)?')
+
+
+def normalize_header(value):
+    text = re.sub(r'[^a-z0-9%]+', ' ', str(value).lower()).strip()
+    return re.sub(r'\s*%', ' %', text).replace('  ', ' ')
+
+
+def cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value).strip()
+
+
+def parse_number(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = NUMBER_RE.search(cell_text(value))
+    return float(match.group().replace(',', '')) if match else 0.0
+
+
+def map_header(cells):
+    """
+    Map a row of header cells to Product fields.
+
+    :return: {column_index: field_name} if the row looks like a line-item header, otherwise None.
+    """
+    mapping = {}
+    for index, value in enumerate(cells):
+        field = HEADER_LOOKUP.get(normalize_header(value)) if value is not None else None
+        if field and field not in mapping.values():
+            mapping[index] = field
+    fields = set(mapping.values())
+    if "PRODUCT_DESCRIPTION" in fields and len(fields & PRICE_FIELDS) >= 2:
+        return mapping
+    return None
+
+
+def row_to_product(cells, mapping):
+    """Build a canonical Product dict from a line-item row, deriving the amounts the sheet leaves out."""
+    product = {name: 0.0 for name in document_class.Product.model_fields}
+    product["HSN"] = "Null"
+    product["PRODUCT_DESCRIPTION"] = ""
+    for index, field in mapping.items():
+        value = cells[index] if index < len(cells) else None
+        if field in ("PRODUCT_DESCRIPTION", "HSN"):
+            product[field] = cell_text(value) or product[field]
+        else:
+            product[field] = parse_number(value)
+
+    product["COUNT"] = int(round(product["COUNT"]))
+    if not product["PRODUCT_TOTAL_PRICE"]:
+        product["PRODUCT_TOTAL_PRICE"] = round(product["COUNT"] * product["UNIT_ITEM_PRICE"], 2)
+    if not product["UNIT_ITEM_PRICE"] and product["COUNT"]:
+        product["UNIT_ITEM_PRICE"] = round(product["PRODUCT_TOTAL_PRICE"] / product["COUNT"], 2)
+    if not product["GROSS_AMOUNT"]:
+        product["GROSS_AMOUNT"] = product["PRODUCT_TOTAL_PRICE"]
+    if not product["TAXABLE_AMOUNT"]:
+        product["TAXABLE_AMOUNT"] = product["PRODUCT_TOTAL_PRICE"]
+    if not product["NET_AMOUNT"]:
+        taxes = product["CGST_AMOUNT"] + product["SGST_AMOUNT"] + product["GST_AMOUNT"]
+        product["NET_AMOUNT"] = round(product["TAXABLE_AMOUNT"] + taxes, 2)
+    return product
+
+
+def is_line_item_end(cells, mapping):
+    values = [cell_text(value) for value in cells]
+    if not any(values):
+        return True
+    description_index = next(index for index, field in mapping.items() if field == "PRODUCT_DESCRIPTION")
+    first_text = next((value for value in values if value), '')
+    return bool(TOTAL_ROW_RE.match(first_text)) or not (
+        description_index < len(values) and values[description_index])
+
+
+class TabularExtraction:
+    """Accumulates line items and the non-tabular text (header metadata) of one document."""
+
+    def __init__(self, detect_line_items=True):
+        self.detect_line_items = detect_line_items
+        self.products = []
+        self.metadata_lines = []
+
+    def feed_table(self, rows):
+        """
+        Consume one table's rows (iterables of cell values). Line-item rows become products,
+        everything else is kept as metadata text.
+        """
+        mapping = None
+        for cells in rows:
+            cells = list(cells)
+            if mapping is not None:
+                if is_line_item_end(cells, mapping):
+                    mapping = None
+                else:
+                    self.products.append(row_to_product(cells, mapping))
+                    continue
+            mapping = map_header(cells) if self.detect_line_items else None
+            if mapping is None:
+                self.add_text(' | '.join(text for text in map(cell_text, cells) if text))
+
+    def add_text(self, text):
+        if text:
+            self.metadata_lines.append(text)
+
+    @property
+    def metadata(self):
+        return '\n'.join(self.metadata_lines)
+
+
+def _table_rows(table):
+    for row in table.rows:
+        yield [cell.text for cell in row.cells]
+
+
+def read_docx(input_file, detect_line_items=True):
+    """Walk a DOCX body in order, keeping paragraphs and tables (python-docx's .paragraphs skips tables)."""
+    doc = Document(input_file)
+    extraction = TabularExtraction(detect_line_items)
+    for child in doc.element.body.iterchildren():
+        if child.tag.endswith('}tbl'):
+            extraction.feed_table(_table_rows(Table(child, doc)))
+        elif child.tag.endswith('}p'):
+            extraction.add_text(Paragraph(child, doc).text.strip())
+    return extraction
+
+
+def read_xlsx(input_file, detect_line_items=True):
+    """Stream every sheet with openpyxl's read-only mode so large workbooks are never fully loaded."""
+    workbook = load_workbook(input_file, read_only=True, data_only=True)
+    extraction = TabularExtraction(detect_line_items)
+    try:
+        for sheet in workbook.worksheets:
+            extraction.add_text(f"Sheet: {sheet.title}")
+            extraction.feed_table(sheet.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+    return extraction
+
+
+def read_tabular(input_file, detect_line_items=True):
+    """
+    :return: TabularExtraction with products (canonical Product dicts) and metadata text.
+    """
+    lower = input_file.lower()
+    if lower.endswith('.docx'):
+        return read_docx(input_file, detect_line_items)
+    if lower.endswith('.xlsx'):
+        return read_xlsx(input_file, detect_line_items)
+    raise ValueError("Unsupported file format for tabular ingestion.")
+
+
+def document_text(input_file):
+    """Plain-text rendering of a DOCX/XLSX with its tables kept as ' | '-separated rows."""
+    return read_tabular(input_file, detect_line_items=False).metadata
@@ -0,0 +1,334 @@
+import os
+import re
+import json
+import glob
+import threading
+import document_class as document_class
+import rasterizer
+import text_layer
+import region_schemas
+from sharded_extraction import SPLIT_MODELS, check_products_total
+
+try:
+    import pytesseract
+except ImportError:  # OCR tier is optional; text-layer PDFs still work without it
+    pytesseract = None
+
+TOTAL_ROW_RE = re.compile(r'^(sub\s*)?total|grand total|amount due|balance due', re.IGNORECASE)
+CELL_SPLIT_RE = re.compile(r'\s{2,}|\t')
+NUMBER_CELL_RE = re.compile(r'^[$₹€£]?\s*-?[\d,]+(?:\.\d+)?\s*%?$')
+# Product columns in the order ambiguous numbers are attributed to them when learning a row layout
+COLUMN_PRIORITY = ["HSN", "COUNT", "UNIT_ITEM_PRICE", "PRODUCT_TOTAL_PRICE", "MRP", "DISCOUNT_RATE",
+                   "CGST_RATE", "CGST_AMOUNT", "SGST_RATE", "SGST_AMOUNT", "GST_RATE", "GST_AMOUNT",
+                   "GROSS_AMOUNT", "TAXABLE_AMOUNT", "NET_AMOUNT"]
+TOTAL_FIELDS = list(document_class.TotalBill.model_fields)
+
+
+def normalize(text):
+    return re.sub(r'[^a-z0-9]+', ' ', str(text).lower()).strip()
+
+
+def parse_number(text):
+    return float(re.sub(r'[^\d.\-]', '', text) or 0)
+
+
+def is_number_cell(cell):
+    return bool(NUMBER_CELL_RE.match(cell.strip()))
+
+
+def split_cells(line):
+    return [cell.strip() for cell in CELL_SPLIT_RE.split(line.strip()) if cell.strip()]
+
+
+def find_label(lines, value):
+    """The label printed before value on its line, e.g. 'Invoice No' for 'Invoice No: INV/2024/0123'."""
+    needle = str(value).lower()
+    for line in lines:
+        index = line.lower().find(needle)
+        if index <= 0:
+            continue
+        prefix = split_cells(line[:index].rstrip(' :#.-\t'))
+        if prefix and re.search(r'[A-Za-z]', prefix[-1]):
+            return prefix[-1]
+    return None
+
+
+def find_number_label(lines, value, exclude=()):
+    """The leading text of the line printing the amount value, e.g. 'Grand Total'."""
+    for line in lines:
+        cells = split_cells(line)
+        if len(cells) < 2 or not re.search(r'[A-Za-z]', cells[0]) or cells[0].rstrip(' :#.-') in exclude:
+            continue
+        if any(is_number_cell(cell) and abs(parse_number(cell) - value) < 0.005 for cell in cells[1:]):
+            return cells[0].rstrip(' :#.-')
+    return None
+
+
+def match_columns(cells, product):
+    """Attribute each trailing number cell of a product row to a Product field; None where nothing matches."""
+    columns = []
+    for cell in cells:
+        candidates = [name for name in COLUMN_PRIORITY if name not in columns and (
+            cell == str(product[name]) if name == "HSN" else abs(parse_number(cell) - product[name]) < 0.005)]
+        columns.append(candidates[0] if candidates else None)
+    return columns
+
+
+def trailing_numbers(cells):
+    count = 0
+    for cell in reversed(cells):
+        if not is_number_cell(cell):
+            break
+        count += 1
+    return cells[:len(cells) - count], cells[len(cells) - count:]
+
+
+class TemplateExtractor:
+    """
+    First extraction tier: local text (PDF text layer or tesseract OCR) plus per-vendor template
+    rules learned from documents the LLM has already parsed.
+
+    A template records, for one vendor and doctype, the seller address, the labels printed before
+    each identifier and bill total, the billing addresses seen, and the column layout of product
+    rows. Extraction fills a candidate Invoice/PO from those rules and scores it by field coverage
+    and arithmetic consistency (row totals, product sum vs TotalBill, final total).
+    """
+
+    def __init__(self, templates_path, ocr_dpi=300, ocr_lang='eng'):
+        """
+        :param templates_path: JSON file the learned templates are persisted to.
+        :param ocr_dpi: Render resolution for pages without a usable text layer.
+        :param ocr_lang: Tesseract language code.
+        """
+        self.templates_path = templates_path
+        self.ocr_dpi = ocr_dpi
+        self.ocr_lang = ocr_lang
+        self._lock = threading.Lock()
+        self.templates = {}
+        if os.path.exists(templates_path):
+            with open(templates_path, 'r') as f:
+                self.templates = json.load(f)
+
+    def document_text(self, input_file):
+        """
+        :return: (text, source) with source 'text_layer' or 'ocr', or (None, None) if neither is available.
+        """
+        if input_file.lower().endswith('.pdf'):
+            page_texts = text_layer.extract_page_texts(input_file)
+            if page_texts and all(text_layer.is_usable_page(text) for text in page_texts):
+                return '\n'.join(page_texts), 'text_layer'
+        if pytesseract is None:
+            return None, None
+        pages = []
+        for image in rasterizer.iter_page_images(input_file, dpi=self.ocr_dpi, grayscale=True):
+            try:
+                # psm 6 keeps each printed line on one output line, which the row rules rely on
+                pages.append(pytesseract.image_to_string(image, lang=self.ocr_lang, config='--psm 6 -c preserve_interword_spaces=1'))
+            finally:
+                image.close()
+        return '\n'.join(pages), 'ocr'
+
+    def match_template(self, doctype, text):
+        """The template of the vendor named in text, preferring the longest matching name."""
+        normalized = f" {normalize(text)} "
+        best = None
+        for template in self.templates.values():
+            if template["doctype"] != doctype or f" {template['vendor_key']} " not in normalized:
+                continue
+            if best is None or len(template["vendor_key"]) > len(best["vendor_key"]):
+                best = template
+        return best
+
+    def learn(self, doctype, text, data):
+        """
+        Update the vendor template for a document from its text and its parsed output.
+
+        :param data: Parsed document as a dict (response.model_dump()).
+        :return: True if the document could be anchored to a template.
+        """
+        vendor_key = normalize(data["shop_address"]["name"])
+        if not vendor_key or doctype not in SPLIT_MODELS or f" {vendor_key} " not in f" {normalize(text)} ":
+            return False
+        model, _, _ = SPLIT_MODELS[doctype]
+        lines = text.splitlines()
+        key = f"{doctype}|{vendor_key}"
+        with self._lock:
+            template = self.templates.get(key) or {
+                "doctype": doctype, "vendor_key": vendor_key, "labels": {}, "null_fields": [],
+                "total_labels": {}, "zero_totals": [], "billing_addresses": [], "columns": None, "samples": 0,
+            }
+            template["shop_address"] = data["shop_address"]
+            if data["billing_address"] not in template["billing_addresses"]:
+                template["billing_addresses"].append(data["billing_address"])
+
+            for name, field in model.model_fields.items():
+                if field.annotation is not str:
+                    continue
+                value = data[name]
+                if value in ("", "NULL", "Null"):
+                    template["null_fields"] = sorted(set(template["null_fields"]) | {name})
+                    continue
+                label = find_label(lines, value)
+                if label:
+                    template["labels"][name] = label
+
+            for name in TOTAL_FIELDS:
+                value = data["total_bill"][name]
+                if not value:
+                    template["zero_totals"] = sorted(set(template["zero_totals"]) | {name})
+                    continue
+                # Equal amounts (total == final_total without tax) must still map to different lines
+                used = {label for other, label in template["total_labels"].items() if other != name}
+                label = find_number_label(lines, value, used)
+                if label:
+                    template["total_labels"][name] = label
+
+            layouts = set()
+            for product in data["product"]:
+                prefix = normalize(product["PRODUCT_DESCRIPTION"])[:24]
+                line = next((line for line in lines if prefix and prefix in normalize(line)), None)
+                if line is None:
+                    continue
+                _, numbers = trailing_numbers(split_cells(line))
+                layouts.add(tuple(match_columns(numbers, product)))
+            if len(layouts) == 1:
+                template["columns"] = list(layouts.pop())
+            template["samples"] += 1
+            self.templates[key] = template
+            self._save()
+        return True
+
+    def learn_from_storage(self, store, download_dir):
+        """
+        Bootstrap templates from earlier LLM parses: every document in the parsed-document store
+        paired with its source in storage/download/<doctype>/<name>.<ext>.
+
+        :param store: document_store.DocumentStore holding storage/parsed.
+        :return: Number of documents learned from.
+        """
+        learned = 0
+        for doctype in SPLIT_MODELS:
+            for stem, data in store.iter_documents(doctype):
+                sources = [path for path in glob.glob(os.path.join(download_dir, doctype, glob.escape(stem) + '.*'))
+                           if os.path.splitext(path)[1].lower() in ('.pdf', '.jpg', '.jpeg', '.png')]
+                if not sources:
+                    continue
+                text, _ = self.document_text(sources[0])
+                if not text:
+                    continue
+                learned += self.learn(doctype, text, data)
+        return learned
+
+    def _save(self):
+        directory = os.path.dirname(self.templates_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.templates_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.templates, f, indent=2)
+        os.replace(temp_path, self.templates_path)
+
+    def _extract_products(self, lines, columns):
+        products = []
+        for line in lines:
+            text_cells, numbers = trailing_numbers(split_cells(line))
+            if not text_cells or len(numbers) != len(columns) or not re.search(r'[A-Za-z]', text_cells[-1]):
+                continue
+            if TOTAL_ROW_RE.match(text_cells[0]):
+                continue
+            values = {"PRODUCT_DESCRIPTION": ' '.join(cell for cell in text_cells if not is_number_cell(cell))}
+            for cell, name in zip(numbers, columns):
+                if name == "HSN":
+                    values[name] = cell
+                elif name == "COUNT":
+                    values[name] = int(round(parse_number(cell)))
+                elif name is not None:
+                    values[name] = parse_number(cell)
+            if "PRODUCT_TOTAL_PRICE" not in values and "COUNT" in values and "UNIT_ITEM_PRICE" in values:
+                values["PRODUCT_TOTAL_PRICE"] = round(values["COUNT"] * values["UNIT_ITEM_PRICE"], 2)
+            products.append(region_schemas.expand_product(values))
+        return products
+
+    def extract(self, input_file, doctype):
+        """
+        :return: dict with response (model instance or None), confidence (0-1), vendor, source,
+                 text (the document text, reused for learning) and checks (which rules passed).
+        """
+        result = {"response": None, "confidence": 0.0, "vendor": None, "source": None, "text": None, "checks": {}}
+        text, source = self.document_text(input_file)
+        result["text"], result["source"] = text, source
+        if not text or doctype not in SPLIT_MODELS:
+            return result
+        template = self.match_template(doctype, text)
+        if template is None or not template["columns"]:
+            return result
+        result["vendor"] = template["shop_address"]["name"]
+        model, _, _ = SPLIT_MODELS[doctype]
+        lines = text.splitlines()
+        expected = found = 0
+
+        data = {"shop_address": template["shop_address"]}
+        normalized = f" {normalize(text)} "
+        expected += 1
+        billing = next((address for address in template["billing_addresses"]
+                        if f" {normalize(address['name'])} " in normalized), None)
+        if billing is not None:
+            data["billing_address"] = billing
+            found += 1
+
+        for name, field in model.model_fields.items():
+            if field.annotation is not str:
+                continue
+            expected += 1
+            label = template["labels"].get(name)
+            match = re.search(re.escape(label) + r'\s*[:#.\-]*\s*(\S+(?: \S+)*)', text, re.IGNORECASE) if label else None
+            if match:
+                value = split_cells(match.group(1))[0]
+                data[name] = value.lower() if name == "milestone" else value
+                found += 1
+            elif name in template["null_fields"]:
+                data[name] = "NULL"
+                found += 1
+
+        total_bill = {}
+        for name in TOTAL_FIELDS:
+            expected += 1
+            label = template["total_labels"].get(name)
+            match = re.search(re.escape(label) + r'[^\n\d\-]*(-?[\d,]+(?:\.\d+)?)', text, re.IGNORECASE) if label else None
+            if match:
+                total_bill[name] = parse_number(match.group(1))
+                found += 1
+            elif name in template["zero_totals"]:
+                total_bill[name] = 0.0
+                found += 1
+        data["total_bill"] = total_bill
+
+        products = self._extract_products(lines, template["columns"])
+        data["product"] = products
+        expected += 1
+        found += bool(products)
+
+        checks = result["checks"]
+        checks["coverage"] = found / expected
+        checks["rows_ok"] = (sum(1 for p in products if abs(p["COUNT"] * p["UNIT_ITEM_PRICE"] - p["PRODUCT_TOTAL_PRICE"])
+                                 <= max(0.01, 0.005 * p["PRODUCT_TOTAL_PRICE"])) / len(products)) if products else 0.0
+        if len(total_bill) == len(TOTAL_FIELDS) and products:
+            checks["products_total_ok"], _ = check_products_total(products, total_bill)
+            expected_final = (total_bill["total"] - total_bill["discount_amount"] + total_bill["tax_amount"]
+                              + total_bill["delivery_charges"])
+            checks["final_total_ok"] = abs(expected_final - total_bill["final_total"]) <= max(1.0, 0.005 * expected_final)
+        else:
+            checks["products_total_ok"] = checks["final_total_ok"] = False
+
+        try:
+            result["response"] = model(**data)
+        except Exception as e:
+            checks["validation_error"] = str(e)
+            return result
+        confidence = checks["coverage"] * (0.5 + 0.25 * checks["rows_ok"] + 0.25 * checks["final_total_ok"])
+        if not checks["products_total_ok"]:
+            confidence *= 0.5
+        if source == 'ocr':
+            confidence *= 0.95
+        result["confidence"] = round(confidence, 3)
+        return result
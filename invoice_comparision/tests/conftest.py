@@ -0,0 +1,73 @@
+import os
+import sys
+import json
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(HERE)
+# Modules import each other flat (import tracing), as when run from invoice_comparision/
+sys.path.insert(0, PACKAGE_DIR)
+
+import logger  # noqa: E402
+import stub_server  # noqa: E402
+
+
+@pytest.fixture
+def activity_log(monkeypatch):
+    """ActivityLogger without the database: entries written with insert_log(s) are collected here."""
+    entries = []
+
+    def init(self, db_config=None, agent_name=None):
+        self.agent_name = agent_name
+        self.table_name = f"{agent_name}_log" if agent_name else "activity_log"
+
+    monkeypatch.setattr(logger.ActivityLogger, "__init__", init)
+    monkeypatch.setattr(logger.ActivityLogger, "insert_log", lambda self, log_data: entries.append(dict(log_data)))
+    monkeypatch.setattr(logger.ActivityLogger, "insert_logs", lambda self, batch: entries.extend(map(dict, batch)))
+    return entries
+
+
+@pytest.fixture
+def stub():
+    """A stub OpenAI server on a free port; yields its StubState, base_url is state.base_url."""
+    state = stub_server.StubState(latency='fixed:0', seed=1)
+    server = stub_server.serve(port=0, state=state)
+    state.base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def make_parser(tmp_path, activity_log, stub):
+    import parser as parser_module
+
+    def make(**kwargs):
+        kwargs.setdefault("output_folder", str(tmp_path / "parsed"))
+        return parser_module.DocumentParser(api_key="sk-test", base_url=stub.base_url, max_retries=0, **kwargs)
+    return make
+
+
+@pytest.fixture
+def make_image(tmp_path):
+    """Write a small page image and return its path."""
+    from PIL import Image, ImageDraw
+
+    def make(name="page.png", text="INVOICE INV/2024/0789", size=(400, 300)):
+        path = tmp_path / name
+        image = Image.new('RGB', size, 'white')
+        ImageDraw.Draw(image).text((20, 20), text, fill='black')
+        image.save(path)
+        return str(path)
+    return make
+
+
+@pytest.fixture
+def sample():
+    """Load a parsed sample document shipped next to the modules, e.g. sample('Sample_Purchase_Order.json')."""
+    def load(name):
+        with open(os.path.join(PACKAGE_DIR, name), 'r') as f:
+            return json.load(f)
+    return load
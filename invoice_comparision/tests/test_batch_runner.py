@@ -0,0 +1,124 @@
+import os
+import json
+import pytest
+from batch_runner import BatchRunner
+
+
+@pytest.fixture
+def runner(make_parser, tmp_path, stub):
+    stub.batch_seconds = 0.1
+
+    def make(parser=None, job="job", **kwargs):
+        return BatchRunner(parser or make_parser(), str(tmp_path / job), poll_interval=0.05, **kwargs)
+    return make
+
+
+def test_run_parses_every_document(runner, make_image, tmp_path, activity_log):
+    paths = [make_image(f"invoice_{index}.png") for index in range(2)]
+    summary = runner().run(paths + [str(tmp_path / "missing.png")], "Invoice")
+    assert summary["status"] == "completed"
+    assert (summary["requests"], summary["succeeded"], summary["failed"]) == (2, 2, 0)
+    for index in range(2):
+        with open(tmp_path / "parsed" / "Invoice" / f"invoice_{index}.json") as f:
+            assert json.load(f)["invoice_number"] == "INV/2024/0789"
+    statuses = [entry["status"] for entry in activity_log]
+    assert statuses.count("Success") == 2 and statuses.count("Error") >= 1
+    assert all("via batch/vision path" in entry["comments"] for entry in activity_log if entry["status"] == "Success")
+
+
+def test_request_lines_use_the_prepared_tool_schema(runner, make_image):
+    job = runner()
+    job.build([make_image("invoice.png")], "Invoice")
+    with open(job.requests_path(0)) as f:
+        line = json.loads(f.readline())
+    assert line["url"] == "/v1/chat/completions"
+    assert line["body"]["tools"][0]["function"]["name"] == "Invoice"
+    assert line["body"]["messages"][0]["role"] == "system"
+    assert job.state["stage"] == "built" and list(job.state["requests"]) == ["doc-000000"]
+    assert job.state["batches"][0]["requests"] == ["doc-000000"]
+
+
+def test_requests_are_split_at_the_file_limits(runner, make_image, stub, activity_log):
+    paths = [make_image(f"invoice_{index}.png") for index in range(5)]
+    job = runner(max_requests=2)
+    job.build(paths, "Invoice")
+    assert [batch["requests"] for batch in job.state["batches"]] == [
+        ["doc-000000", "doc-000001"], ["doc-000002", "doc-000003"], ["doc-000004"]]
+    line_bytes = job.state["batches"][0]["bytes"] // 2
+    for batch in job.state["batches"]:
+        assert os.path.getsize(os.path.join(job.job_dir, batch["requests_path"])) == batch["bytes"]
+
+    job = runner(job="small_files", max_bytes=2 * line_bytes - 1)
+    summary = job.run(paths, "Invoice")
+    assert [len(batch["requests"]) for batch in job.state["batches"]] == [1] * 5
+    assert len(stub.batches) == 5 and len(set(summary["batch_ids"])) == 5
+    assert (summary["status"], summary["succeeded"], summary["failed"]) == ("completed", 5, 0)
+
+
+def test_request_larger_than_a_batch_file_is_logged(runner, make_image, activity_log):
+    job = runner(max_bytes=1000)
+    job.build([make_image("invoice.png")], "Invoice")
+    assert job.state["requests"] == {} and job.state["batches"] == []
+    assert "exceeds the 1000 byte file limit" in activity_log[-1]["comments"]
+
+
+def test_resume_after_submit_does_not_resubmit(runner, make_image, stub, activity_log):
+    paths = [make_image(f"invoice_{index}.png") for index in range(2)]
+    job = runner(max_requests=1)
+    job.build(paths, "Invoice")
+    job.submit()
+    batch_ids = [batch["batch_id"] for batch in job.state["batches"]]
+    uploads, batches = sum(file["purpose"] == "batch" for file in stub.files.values()), len(stub.batches)
+
+    resumed = runner(max_requests=1)
+    assert resumed.state["stage"] == "submitted"
+    summary = resumed.run(paths, "Invoice")
+    assert summary["batch_ids"] == batch_ids and summary["succeeded"] == 2
+    assert len(stub.batches) == batches
+    assert sum(file["purpose"] == "batch" for file in stub.files.values()) == uploads
+    assert runner().run(paths, "Invoice") == {"batch_ids": batch_ids, "status": "completed", "requests": 2,
+                                               "succeeded": 0, "failed": 0}
+    assert [entry["status"] for entry in activity_log] == ["Success", "Success"]
+
+
+def test_resume_submits_only_the_batches_not_submitted_yet(runner, make_image, stub):
+    paths = [make_image(f"invoice_{index}.png") for index in range(2)]
+    job = runner(max_requests=1)
+    job.build(paths, "Invoice")
+    job.submit()
+    # Crash after the first part was submitted
+    first = job.state["batches"][0]
+    del job.state["batches"][1]["input_file_id"], job.state["batches"][1]["batch_id"]
+    job.state["stage"] = "built"
+    job.save_state()
+    batches = len(stub.batches)
+    summary = runner().run(paths, "Invoice")
+    assert summary["batch_ids"][0] == first["batch_id"] and summary["succeeded"] == 2
+    assert len(stub.batches) == batches + 1
+
+
+def test_collect_skips_documents_already_done(runner, make_image, activity_log):
+    paths = [make_image(f"invoice_{index}.png") for index in range(2)]
+    job = runner()
+    job.build(paths, "Invoice")
+    job.submit()
+    job.wait()
+    job.state["done"] = ["doc-000000"]
+    job.save_state()
+    assert runner().collect() == (1, 0)
+    assert [entry["input_filename"] for entry in activity_log] == [paths[1]]
+
+
+def test_failed_batch_lines_are_logged(runner, make_image, stub, activity_log):
+    stub.rate_500 = 1.0
+    summary = runner().run([make_image("invoice.png")], "Invoice")
+    assert (summary["succeeded"], summary["failed"]) == (0, 1)
+    assert activity_log[-1]["status"] == "Error"
+    assert "batch request failed" in activity_log[-1]["comments"]
+
+
+def test_no_requests_collects_immediately(runner, tmp_path):
+    job = runner()
+    assert job.run([str(tmp_path / "missing.pdf")], "Invoice")["requests"] == 0
+    assert job.state["stage"] == "collected"
+    assert os.path.exists(job.state_path)
@@ -0,0 +1,98 @@
+import copy
+import pytest
+import batch_validation
+from logger import ActivityLogger
+
+
+class References:
+    """reference_source backed by a dict; counts lookups."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.lookups = []
+
+    def get_document(self, doctype, number, vendor=None):
+        self.lookups.append((doctype, number))
+        return self.documents.get((doctype, number))
+
+
+@pytest.fixture
+def corpus(sample):
+    invoice = sample('Sample_Invoice (1).json')
+    po = sample('Sample_Purchase_Order.json')
+    matching = copy.deepcopy(invoice)
+    matching["product"][2]["UNIT_ITEM_PRICE"] = 120.0
+    other_po = dict(copy.deepcopy(invoice), invoice_number="INV-X", po_number="PO/2024/9999")
+    no_reference = dict(copy.deepcopy(invoice), invoice_number="INV-N", po_number="NULL")
+    invoices = [("inv-1", invoice), ("inv-2", matching), ("inv-3", other_po), ("inv-4", no_reference)]
+    return invoices, References({("PO", "PO/2024/0456"): po})
+
+
+def test_reference_of_prefers_the_contract():
+    assert batch_validation.reference_of({"contract_number": "C-1", "po_number": "PO-1"}) == ("Contract", "C-1")
+    assert batch_validation.reference_of({"contract_number": "NULL", "po_number": " PO-1 "}) == ("PO", "PO-1")
+    assert batch_validation.reference_of({"po_number": "null"}) == (None, None)
+
+
+def test_group_by_reference_normalizes_numbers_and_vendors():
+    invoices = [("a", {"po_number": "PO-1", "shop_address": {"name": "Acme Ltd"}}),
+                ("b", {"po_number": "po 1", "shop_address": {"name": "ACME"}}),
+                ("c", {"po_number": "PO-1", "shop_address": {"name": "Globex"}})]
+    groups = batch_validation.group_by_reference(invoices)
+    assert sorted(len(group["invoices"]) for group in groups.values()) == [1, 2]
+
+
+def test_group_by_reference_accepts_a_null_shop_address():
+    groups = batch_validation.group_by_reference([("a", {"po_number": "PO-1", "shop_address": None})])
+    assert [group["vendor"] for group in groups.values()] == [None]
+
+
+def test_logs_are_written_in_batches_while_results_stream(corpus, activity_log):
+    invoices, references = corpus
+    results = batch_validation.validate_many(invoices, references, workers=0, window=1, log_batch_size=2)
+    next(results), next(results)
+    assert len(activity_log) == 2
+    # A caller that stops early still gets the remaining logs written
+    next(results)
+    results.close()
+    assert len(activity_log) == 3
+
+
+def test_validate_many_in_process(corpus, activity_log):
+    invoices, references = corpus
+    results = {result["invoice"]: result for result in
+               batch_validation.validate_many(invoices, references, workers=0, window=3, chunk_size=1,
+                                              logger=ActivityLogger())}
+    assert set(results) == {"inv-1", "inv-2", "inv-3", "inv-4"}
+    assert all(result["status"] == "Success" for result in results.values())
+    assert results["inv-1"]["is_mismatch"] and not results["inv-2"]["is_mismatch"]
+    assert results["inv-1"]["mismatches"][0]["Issue"] == "Mismatch in quantity or rate"
+    assert results["inv-3"]["mismatches"] == [{"Issue": "PO file not provided for po_number: PO/2024/9999"}]
+    assert results["inv-4"]["compared_document_type"] is None
+    # Window 1 holds inv-1..3 (two references), window 2 inv-4 (none)
+    assert sorted(references.lookups) == [("PO", "PO/2024/0456"), ("PO", "PO/2024/9999")]
+    assert len(activity_log) == 4
+    assert sorted(entry["log"]["invoice_filename"] for entry in activity_log) == [
+        "INV-N", "INV-X", "INV/2024/0789", "INV/2024/0789"]
+
+
+def test_dry_run_writes_no_logs(corpus, activity_log):
+    invoices, references = corpus
+    results = list(batch_validation.validate_many(invoices, references, workers=0, write_logs=False))
+    assert len(results) == 4 and activity_log == []
+
+
+def test_validation_errors_are_reported_per_invoice(corpus):
+    invoices, references = corpus
+    broken = dict(copy.deepcopy(invoices[0][1]), product=None)
+    results = list(batch_validation.validate_many([("broken", broken)], references, workers=0, write_logs=False))
+    assert results[0]["status"] == "Error" and results[0]["error"]
+
+
+def test_validate_many_across_worker_processes(corpus):
+    invoices, references = corpus
+    in_process = {result["invoice"]: result for result in
+                  batch_validation.validate_many(invoices, references, workers=0, write_logs=False)}
+    pooled = {result["invoice"]: result for result in
+              batch_validation.validate_many(invoices, references, workers=2, chunk_size=1, write_logs=False)}
+    assert pooled == in_process
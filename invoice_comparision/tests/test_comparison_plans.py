@@ -0,0 +1,181 @@
+import copy
+import pytest
+import comparison_plans
+from validator import InvoicePOValidator
+
+ROUTE_KEY = {"PO": "PO_value", "Contract": "Contract"}
+
+
+# The comparisons of the validator before it ran PLANS, kept here as the reference output
+def baseline_address_compare(doc_type, category, reference, invoice):
+    detail = {key: {ROUTE_KEY[doc_type]: reference.get(key), 'Invoice': invoice.get(key)}
+              for key in set(reference) | set(invoice) if reference.get(key) != invoice.get(key)}
+    return {"Issue_category": category, category: detail} if detail else None
+
+
+def baseline_po(po_data, invoice_data):
+    fields = []
+    invoice_products = {p["PRODUCT_DESCRIPTION"]: p for p in invoice_data["product"]}
+    po_products = {p["PRODUCT_DESCRIPTION"]: p for p in po_data["product"]}
+    for desc in invoice_products.keys() & po_products.keys():
+        field_diffs = {key: {"Invoice": value, "PO_value": po_products[desc][key]}
+                       for key, value in invoice_products[desc].items()
+                       if key in po_products[desc] and value != po_products[desc][key]}
+        if field_diffs:
+            fields.append({"Issue_category": desc, desc: field_diffs})
+    for category, reference, invoice in [("seller_address", "shop_address", "shop_address"),
+                                         ("buyer_address", "billing_address", "billing_address")]:
+        missing = baseline_address_compare("PO", category, po_data[reference], invoice_data[invoice])
+        if missing is not None:
+            fields.append(missing)
+
+    issues = []
+    po_items = {item['PRODUCT_DESCRIPTION'].upper(): item for item in po_data['product']}
+    for inv in invoice_data['product']:
+        po_item = po_items.get(inv['PRODUCT_DESCRIPTION'].upper())
+        if po_item is None:
+            issues.append({"Issue": "Item not found in PO", "Item": inv['PRODUCT_DESCRIPTION']})
+            continue
+        quantity_po, quantity_invoice = float(po_item['COUNT']), float(inv['COUNT'])
+        rate_po, rate_invoice = float(po_item['UNIT_ITEM_PRICE']), float(inv['UNIT_ITEM_PRICE'])
+        if quantity_po != quantity_invoice or rate_po != rate_invoice:
+            issues.append({"Issue": "Mismatch in quantity or rate", "Item": inv['PRODUCT_DESCRIPTION'],
+                           "Quantity PO": quantity_po, "Quantity Invoice": quantity_invoice,
+                           "Rate PO": rate_po, "Rate Invoice": rate_invoice,
+                           "Total Amount PO": quantity_po * rate_po,
+                           "Total Amount Invoice": quantity_invoice * rate_invoice})
+    return fields, issues
+
+
+def baseline_contract(contract_data, invoice_data):
+    mismatches = []
+    contract_id = str(contract_data.get("contract_number", "")).strip()
+    invoice_contract_id = str(invoice_data.get("contract_number", "")).strip()
+    if contract_id != invoice_contract_id:
+        return [{"Issue_category": "Contract Number",
+                 "Contract Number": [{"Contract": contract_id, "Invoice": invoice_contract_id}]}]
+    milestone = invoice_data.get("milestone", "").strip().lower()
+    schedule = contract_data.get("payment_terms", {}).get("payment_schedule", [])
+    milestone_match = next((s for s in schedule if s["milestone"].strip().lower() == milestone), None)
+    if not milestone_match:
+        mismatches.append({"Issue_category": "Milestone", "Milestone": {"Contract": milestone_match,
+                                                                        "Invoice": milestone}})
+    else:
+        expected = round((float(milestone_match["percentage"]) / 100) * float(contract_data["total_contract_value"]), 2)
+        invoice_total = round(float(invoice_data["total_bill"]["final_total"]), 2)
+        if invoice_total != expected:
+            mismatches.append({"Issue_category": "Billing",
+                               "Billing": {str(milestone): {"Contract": expected, "Invoice": invoice_total}}})
+    for category, reference, invoice in [("seller_address", "seller_address", "shop_address"),
+                                         ("buyer_address", "buyer_address", "billing_address")]:
+        missing = baseline_address_compare("Contract", category, contract_data.get(reference, {}),
+                                           invoice_data.get(invoice, {}))
+        if missing:
+            mismatches.append(missing)
+    return mismatches
+
+
+@pytest.fixture
+def validator():
+    return InvoicePOValidator(defer_logs=True)
+
+
+def by_category(mismatches):
+    return sorted(mismatches, key=lambda mismatch: mismatch["Issue_category"])
+
+
+def po_variants(invoice, po):
+    yield invoice, po
+    same = copy.deepcopy(invoice)
+    same["product"] = copy.deepcopy(po["product"])
+    same["shop_address"], same["billing_address"] = po["shop_address"], po["billing_address"]
+    yield same, po
+    changed = copy.deepcopy(invoice)
+    changed["product"][0]["COUNT"] = 90
+    changed["product"][1]["HSN"] = "9999"
+    changed["product"][2]["PRODUCT_DESCRIPTION"] = "Dragon Fruit"
+    changed["billing_address"]["postal_code"] = 110001
+    yield changed, po
+
+
+def test_po_plan_matches_the_baseline_field_for_field(validator, sample):
+    invoice, po = sample('Sample_Invoice (1).json'), sample('Sample_Purchase_Order.json')
+    for invoice_data, po_data in po_variants(invoice, po):
+        fields, issues = baseline_po(po_data, invoice_data)
+        is_mismatch, mismatch_data, _ = validator.validate_po(po_data, invoice_data)
+        assert mismatch_data == issues
+        assert is_mismatch == bool(issues)
+        logged = validator.pending_logs[-1]["fields"]
+        assert logged["mismatch_len"] == 0
+        assert by_category(logged["mismatches"]) == by_category(fields)
+
+
+def contract_variants(invoice, contract):
+    yield invoice
+    yield dict(copy.deepcopy(invoice), total_bill=dict(invoice["total_bill"], final_total=15000.0))
+    yield dict(copy.deepcopy(invoice), milestone=" Completion ")
+    yield dict(copy.deepcopy(invoice), milestone="delivery")
+    yield dict(copy.deepcopy(invoice), contract_number=" CTR/2024/0088")
+    moved = copy.deepcopy(invoice)
+    moved["shop_address"] = copy.deepcopy(contract["seller_address"])
+    moved["billing_address"] = dict(copy.deepcopy(contract["buyer_address"]), city="Elsewhere")
+    yield moved
+
+
+def test_contract_plan_matches_the_baseline_field_for_field(validator, sample):
+    invoice, contract = sample('US_Sample_Invoice.json'), sample('US_Sample_Contract.json')
+    for invoice_data in contract_variants(invoice, contract):
+        is_mismatch, mismatch_data, _ = validator.validate_contract(contract, invoice_data)
+        assert mismatch_data == {"mismatch_len": 0, "mismatches": baseline_contract(contract, invoice_data)}
+        assert is_mismatch
+
+
+def test_blocking_rule_stops_the_plan_and_is_not_logged(validator, sample):
+    invoice, contract = sample('US_Sample_Invoice.json'), sample('US_Sample_Contract.json')
+    _, mismatch_data, _ = validator.validate_contract(contract, dict(invoice, contract_number="OTHER"))
+    assert [m["Issue_category"] for m in mismatch_data["mismatches"]] == ["Contract Number"]
+    assert validator.pending_logs == []
+    stats = validator.rule_stats()["Contract"]
+    assert (stats["contract_number"]["runs"], stats["contract_number"]["hits"]) == (1, 1)
+    assert stats["milestone"]["runs"] == 0
+
+
+def test_billing_tolerance(validator, sample):
+    invoice, contract = sample('US_Sample_Invoice.json'), sample('US_Sample_Contract.json')
+    invoice = dict(invoice, total_bill=dict(invoice["total_bill"], final_total=15000.004))
+    categories = [m["Issue_category"] for m in validator.validate_contract(contract, invoice)[1]["mismatches"]]
+    assert "Billing" not in categories
+
+
+def test_stats_reset_and_merge():
+    plan = comparison_plans.compile_plan("Test", [
+        {"name": "number", "kind": "value", "reference": "number", "invoice": "number", "category": "Number",
+         "reference_label": "Ref", "severity": "warning"},
+    ])
+    assert plan.run({"number": 1}, {"number": 2}, {}) != []
+    assert plan.run({"number": 2}, {"number": 2}, {}) == []
+    stats = plan.stats()["number"]
+    assert (stats["runs"], stats["hits"], stats["findings"]) == (2, 1, 1)
+
+    total = comparison_plans.merge_stats({}, {"Test": plan.stats()})
+    total = comparison_plans.merge_stats(total, {"Test": plan.stats()})
+    assert (total["Test"]["number"]["runs"], total["Test"]["number"]["findings"]) == (4, 2)
+    plan.reset()
+    assert plan.stats()["number"] == {"runs": 0, "hits": 0, "findings": 0, "total_ms": 0.0, "mean_us": 0.0}
+
+
+def test_value_comparator_normalizes_and_applies_tolerance():
+    rule = {"kind": "value", "reference": "a.b", "invoice": "a.b", "category": "C", "reference_label": "Ref"}
+    check = comparison_plans.value_comparator(dict(rule, normalize="casefold"))
+    assert check({"a": {"b": " ABC "}}, {"a": {"b": "abc"}}, {}) == []
+    check = comparison_plans.value_comparator(dict(rule, tolerance=0.5, as_list=True))
+    assert check({"a": {"b": 10.4}}, {"a": {"b": 10}}, {}) == []
+    assert check({"a": {"b": "n/a"}}, {"a": None}, {}) == [("C", [{"Ref": None, "Invoice": "n/a"}])]
+
+
+def test_compile_rejects_bad_rules():
+    with pytest.raises(ValueError, match="unknown comparator kind"):
+        comparison_plans.compile_plan("Test", [{"name": "x", "kind": "regex"}])
+    with pytest.raises(ValueError, match="severity"):
+        comparison_plans.compile_plan("Test", [{"name": "x", "kind": "milestone", "invoice": "m", "category": "M",
+                                                "reference_label": "C", "severity": "fatal"}])
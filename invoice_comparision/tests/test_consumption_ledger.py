@@ -0,0 +1,159 @@
+import os
+import threading
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from DB.models import Base, PoConsumption, PoConsumptionInvoice
+from consumption_ledger import ConsumptionLedger
+
+
+@pytest.fixture(scope="module")
+def postgres_url(tmp_path_factory):
+    """LEDGER_TEST_DATABASE_URL, else a throwaway server from pgserver; skipped when neither is available."""
+    url = os.environ.get("LEDGER_TEST_DATABASE_URL")
+    if url:
+        yield url
+        return
+    pgserver = pytest.importorskip("pgserver")
+    server = pgserver.get_server(str(tmp_path_factory.mktemp("pg")), cleanup_mode="stop")
+    yield server.get_uri()
+    server.cleanup()
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def engine(request, tmp_path):
+    if request.param == "sqlite":
+        engine = create_engine(f"sqlite:///{tmp_path / 'ledger.sqlite'}")
+    else:
+        engine = create_engine(request.getfixturevalue("postgres_url"))
+    Base.metadata.create_all(engine)
+    yield engine
+    ConsumptionLedger(sessionmaker(bind=engine)).clear()
+    engine.dispose()
+
+
+@pytest.fixture
+def statements(engine):
+    """SQL statements and savepoint events seen by the engine."""
+    seen = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, sql, *args: seen.append(sql))
+    for name in ("savepoint", "rollback_savepoint", "release_savepoint"):
+        event.listen(engine, name, lambda *args, name=name: seen.append(name))
+    return seen
+
+
+@pytest.fixture
+def ledger(engine):
+    return ConsumptionLedger(sessionmaker(bind=engine))
+
+
+PO = {"po_number": "PO/2024/0456", "shop_address": {"name": "FreshFarms Produce Ltd"},
+      "product": [{"PRODUCT_DESCRIPTION": "Organic Apples", "COUNT": 100, "UNIT_ITEM_PRICE": 150.0},
+                  {"PRODUCT_DESCRIPTION": "Organic Bananas", "COUNT": 200, "UNIT_ITEM_PRICE": 60.0}]}
+
+
+def invoice(number, apples, bananas=0):
+    products = [{"PRODUCT_DESCRIPTION": "Organic Apples", "COUNT": apples, "UNIT_ITEM_PRICE": 150.0}]
+    if bananas:
+        products.append({"PRODUCT_DESCRIPTION": "Organic Bananas", "COUNT": bananas, "UNIT_ITEM_PRICE": 60.0})
+    return {"invoice_number": number, "product": products}
+
+
+def consume(ledger, invoice_data):
+    return ledger.consume(PO, invoice_data, PO["product"][:len(invoice_data["product"])])
+
+
+def billed(ledger):
+    return {key: line["billed_quantity"] for key, line in ledger.consumption("PO/2024/0456").items()}
+
+
+def test_partial_billing_accumulates_until_the_order_is_exceeded(ledger):
+    assert consume(ledger, invoice("INV-1", 60, 150)) == []
+    issues = consume(ledger, invoice("INV-2", 50))
+    assert issues == [{"Issue": "PO quantity exceeded", "Item": "Organic Apples", "Quantity PO": 100.0,
+                       "Quantity Billed Before": 60.0, "Quantity Invoice": 50.0, "Amount PO": 15000.0,
+                       "Amount Billed Before": 9000.0, "Amount Invoice": 7500.0}]
+    assert billed(ledger) == {"ORGANIC APPLES": 110.0, "ORGANIC BANANAS": 150.0}
+
+
+def test_replaying_an_invoice_replaces_its_contribution(ledger, engine):
+    consume(ledger, invoice("INV-1", 60, 150))
+    consume(ledger, invoice("INV-2", 30))
+    assert consume(ledger, invoice("INV-1", 60, 150)) == []
+    assert billed(ledger) == {"ORGANIC APPLES": 90.0, "ORGANIC BANANAS": 150.0}
+    # A corrected re-parse of the invoice moves the totals by the difference only
+    assert consume(ledger, invoice("INV-1", 80))[0]["Quantity Billed Before"] == 30.0
+    assert billed(ledger) == {"ORGANIC APPLES": 110.0, "ORGANIC BANANAS": 0.0}
+    with sessionmaker(bind=engine)() as session:
+        assert session.query(PoConsumptionInvoice).count() == 2
+        assert session.query(PoConsumption).one().invoice_count == 2
+
+
+def test_check_only_and_unnumbered_invoices_write_nothing(ledger, engine):
+    assert ledger.consume(PO, invoice("INV-1", 120), PO["product"][:1], record=False)
+    assert consume(ledger, invoice("", 120))
+    assert billed(ledger) == {}
+    with sessionmaker(bind=engine)() as session:
+        # The header is created in a savepoint of the same transaction and rolled back with it
+        assert session.query(PoConsumption).count() == 0
+
+
+def test_header_is_locked_for_update(ledger, engine, statements):
+    consume(ledger, invoice("INV-1", 10))
+    selects = [sql for sql in statements if "FROM po_consumption " in sql and "po_consumption_line" not in sql]
+    if engine.dialect.name == "postgresql":
+        assert any(sql.rstrip().endswith("FOR UPDATE") for sql in selects)
+    assert "savepoint" in statements and "release_savepoint" in statements
+
+    holder = sessionmaker(bind=engine)()
+    ledger._lock_po(holder, "PO20240456", "freshfarms produce")
+    worker = threading.Thread(target=consume, args=(ledger, invoice("INV-2", 10)))
+    worker.start()
+    worker.join(0.5)
+    # The second writer waits for the lock holder's transaction
+    assert worker.is_alive()
+    holder.commit()
+    holder.close()
+    worker.join(10)
+    assert not worker.is_alive()
+    assert billed(ledger) == {"ORGANIC APPLES": 20.0, "ORGANIC BANANAS": 0.0}
+
+
+def test_concurrent_header_creation(ledger, engine, statements):
+    if engine.dialect.name != "postgresql":
+        pytest.skip("SQLite serializes the whole transaction; there is no insert race")
+    creator = sessionmaker(bind=engine)()
+    creator.add(PoConsumption(po_number="PO20240456", vendor="freshfarms produce", invoice_count=0))
+    creator.flush()
+    worker = threading.Thread(target=consume, args=(ledger, invoice("INV-1", 10)))
+    worker.start()
+    worker.join(0.5)
+    # The worker found no committed header and its insert waits on the unique constraint
+    assert worker.is_alive()
+    creator.commit()
+    creator.close()
+    worker.join(10)
+    assert "rollback_savepoint" in statements
+    assert billed(ledger)["ORGANIC APPLES"] == 10.0
+    with sessionmaker(bind=engine)() as session:
+        assert session.query(PoConsumption).one().invoice_count == 1
+
+
+def test_concurrent_invoices_against_one_po_line(ledger):
+    results = {}
+    start = threading.Barrier(8)
+
+    def run(number):
+        start.wait()
+        results[number] = consume(ledger, invoice(f"INV-{number}", 15))
+
+    workers = [threading.Thread(target=run, args=(number,)) for number in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+    assert len(results) == 8
+    # No update is lost: 8 x 15 billed, and exactly the invoices past 100 are flagged
+    assert billed(ledger)["ORGANIC APPLES"] == 120.0
+    flagged = sorted(issues[0]["Quantity Billed Before"] for issues in results.values() if issues)
+    assert flagged == [90.0, 105.0]
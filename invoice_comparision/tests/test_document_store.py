@@ -0,0 +1,110 @@
+import os
+import json
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+import document_class
+import document_store
+
+
+@pytest.fixture(params=sorted(document_store.STORES))
+def store(request, tmp_path):
+    return document_store.open_store(request.param, str(tmp_path / request.param))
+
+
+def test_put_get_load_round_trip(store, sample):
+    data = sample('Sample_Invoice (1).json')
+    location, size = store.put("Invoice", "invoice", data)
+    assert size > 0 and location
+    assert store.get("Invoice", "invoice") == data
+    assert store.load("Invoice", "invoice", document_class.Invoice).invoice_number == "INV/2024/0789"
+    assert store.get("Invoice", "missing") is None
+    assert store.load("PO", "invoice", document_class.PO) is None
+
+
+def test_rewrites_and_listing(store, sample):
+    data = sample('Sample_Invoice (1).json')
+    store.put("Invoice", "b", data)
+    store.put("Invoice", "a", data)
+    store.put("Invoice", "b", dict(data, invoice_number="INV-B2"))
+    assert store.names("Invoice") == ["a", "b"]
+    assert store.names("PO") == []
+    documents = dict(store.iter_documents("Invoice"))
+    assert documents["b"]["invoice_number"] == "INV-B2"
+    assert len(documents) == 2
+
+
+def test_export_json(store, sample, tmp_path):
+    store.put("PO", "po", sample('Sample_Purchase_Order.json'))
+    path = store.export_json("PO", "po", str(tmp_path / "po.json"))
+    with open(path) as f:
+        assert json.load(f)["po_number"] == "PO/2024/0456"
+
+
+def test_json_store_keeps_the_original_layout(tmp_path, sample):
+    store = document_store.JsonStore(str(tmp_path))
+    path, _ = store.put("Invoice", "invoice", sample('Sample_Invoice (1).json'))
+    assert path == os.path.join(str(tmp_path), "Invoice", "invoice.json")
+    with open(path) as f:
+        assert f.read().startswith('{\n  "invoice_number"')
+
+
+def test_segment_store_reloads_ignores_torn_writes_and_compacts(tmp_path, sample):
+    data = sample('Sample_Invoice (1).json')
+    store = document_store.SegmentStore(str(tmp_path))
+    store.put("Invoice", "a", data)
+    store.put("Invoice", "a", dict(data, invoice_number="INV-A2"))
+    store.put("Invoice", "b", data)
+    # Index line written for a record whose bytes never reached the segment
+    with open(store.index_path("Invoice"), 'ab') as f:
+        f.write(b'{"name": "c", "offset": 999999, "length": 10}\n{"torn')
+
+    reloaded = document_store.SegmentStore(str(tmp_path))
+    assert reloaded.names("Invoice") == ["a", "b"]
+    assert reloaded.get("Invoice", "a")["invoice_number"] == "INV-A2"
+    size = os.path.getsize(reloaded.segment_path("Invoice"))
+    reloaded.compact("Invoice")
+    assert os.path.getsize(reloaded.segment_path("Invoice")) < size
+    assert dict(document_store.SegmentStore(str(tmp_path)).iter_documents("Invoice"))["a"]["invoice_number"] == "INV-A2"
+
+
+def test_concurrent_writers_use_their_own_temp_files(tmp_path, sample, monkeypatch):
+    data = sample('Sample_Invoice (1).json')
+    store = document_store.OrjsonStore(str(tmp_path))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda n: store.put("Invoice", "same", dict(data, invoice_number=f"INV-{n}")), range(32)))
+    assert store.get("Invoice", "same")["invoice_number"].startswith("INV-")
+    segments = document_store.SegmentStore(str(tmp_path / "segments"))
+    segments.put("Invoice", "a", data)
+    segments.compact("Invoice")
+    monkeypatch.setattr(store, "encode", lambda data: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        with document_store._atomic_file(store.path("Invoice", "same")) as f:
+            f.write(store.encode(data))
+    leftovers = [name for _, _, files in os.walk(tmp_path) for name in files if name.endswith('.tmp')]
+    assert leftovers == []
+    assert store.get("Invoice", "same")["invoice_number"].startswith("INV-")
+
+
+def test_migrate_and_open_store(tmp_path, sample):
+    source = document_store.JsonStore(str(tmp_path / "json"))
+    source.put("Invoice", "invoice", sample('Sample_Invoice (1).json'))
+    source.put("PO", "po", sample('Sample_Purchase_Order.json'))
+    target = document_store.open_store("segment", str(tmp_path / "segment"))
+    assert document_store.migrate(source, target) == 2
+    assert target.get("PO", "po") == source.get("PO", "po")
+    with pytest.raises(ValueError):
+        document_store.open_store("parquet", str(tmp_path))
+
+
+def test_missing_optional_dependency(monkeypatch, tmp_path):
+    monkeypatch.setattr(document_store, "msgpack", None)
+    with pytest.raises(ImportError, match="pip install msgpack"):
+        document_store.MsgpackStore(str(tmp_path))
+
+
+def test_parser_saves_through_its_store(make_parser, make_image, tmp_path):
+    store = document_store.SegmentStore(str(tmp_path / "segment"))
+    parser = make_parser(document_store=store)
+    parser.process_document(make_image("invoice.png"), "Invoice")
+    assert store.names("Invoice") == ["invoice"]
+    assert store.get("Invoice", "invoice")["invoice_number"] == "INV/2024/0789"
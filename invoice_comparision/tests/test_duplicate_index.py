@@ -0,0 +1,166 @@
+import json
+import pytest
+from PIL import Image, ImageDraw
+import duplicate_index
+import parser as parser_module
+from duplicate_index import DuplicateIndex, HASH_BITS, dhash, hamming, confirm_match, confirm_header
+
+
+def template_page(lines):
+    """A page of a shared vendor template with different line items."""
+    image = Image.new('L', (1240, 1754), 255)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((60, 60, 1180, 260), outline=0, width=6)
+    draw.text((80, 80), "ACME SUPPLIES PVT LTD - TAX INVOICE", fill=0)
+    for row, text in enumerate(lines):
+        top = 320 + row * 60
+        draw.rectangle((60, top, 1180, top + 50), outline=0, width=2)
+        draw.rectangle((80, top + 10, 80 + 20 * len(text), top + 40), fill=0)
+    return image
+
+
+def test_dhash_has_hash_bits():
+    assert dhash(template_page(["a"])) < 1 << HASH_BITS
+
+
+def test_finer_hash_separates_template_pages_the_64_bit_hash_matched():
+    first = template_page(["bolts", "washers", "nuts"])
+    other_items = template_page(["gaskets and seals", "pipe", "flanges 20mm", "valves", "clamps"])
+    assert hamming(dhash(first, 8), dhash(other_items, 8)) <= 6
+    assert hamming(dhash(first), dhash(other_items)) > 12
+    assert hamming(dhash(first), dhash(first.resize((1000, 1414)))) <= 12
+    # One extra row is still within distance: a hash match is only a candidate
+    assert hamming(dhash(first), dhash(template_page(["bolts", "washers", "nuts", "gaskets"]))) <= 12
+
+
+def test_hash_document_reads_a_small_render(tmp_path):
+    page = template_page(["bolts", "washers", "nuts"])
+    path = str(tmp_path / "page.png")
+    page.save(path)
+    hashes = duplicate_index.hash_document(path)
+    assert len(hashes) == 1 and hamming(hashes[0], dhash(page)) <= 4
+
+
+def test_find_matches_within_distance_only(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "index.jsonl"))
+    page = dhash(template_page(["bolts", "washers"]))
+    index.add("Invoice", [page], "parsed/a.json", "INV-1", "a.pdf", "digest-a")
+    near = page ^ 0b1011
+    far = page ^ ((1 << 40) - 1)
+    entry, distance = index.find("Invoice", [near])
+    assert entry["input_file"] == "a.pdf" and distance == 3
+    assert index.find("Invoice", [far]) is None
+    assert index.find("PO", [page]) is None
+    assert index.find("Invoice", [page, page]) is None
+
+
+def test_index_reloads_and_skips_old_hash_size(tmp_path):
+    path = tmp_path / "index.jsonl"
+    with open(path, 'w') as f:
+        f.write(json.dumps({"doctype": "Invoice", "page_hashes": ["00ff00ff00ff00ff"], "parsed_path": "old.json",
+                            "file_num": "INV-0", "input_file": "old.pdf"}) + '\n')
+    page = dhash(template_page(["bolts"]))
+    DuplicateIndex(str(path)).add("Invoice", [page], "parsed/a.json", "INV-1", "a.pdf", "digest-a")
+    reloaded = DuplicateIndex(str(path))
+    assert [entry["input_file"] for entry in reloaded.entries] == ["a.pdf"]
+    assert reloaded.find("Invoice", [page])[0]["content_digest"] == "digest-a"
+
+
+def test_bands_must_exceed_max_distance(tmp_path):
+    with pytest.raises(ValueError):
+        DuplicateIndex(str(tmp_path / "index.jsonl"), max_distance=16, bands=16)
+
+
+def test_confirm_match():
+    assert confirm_match({"content_digest": "a"}, "a") is True
+    assert confirm_match({"content_digest": "a"}, "b") is False
+    assert confirm_match({"content_digest": None}, "a") is None
+    assert confirm_match({"content_digest": "a"}, None) is None
+
+
+def test_content_digest_normalizes_whitespace(monkeypatch):
+    texts = {"a.pdf": ["INVOICE  INV-1\n Total 100 "], "b.pdf": ["INVOICE INV-1 Total  100"],
+             "c.pdf": ["INVOICE INV-2 Total 100"], "scan.pdf": ["", " \n"]}
+    monkeypatch.setattr(duplicate_index.text_layer, "extract_page_texts", lambda path: texts[path])
+    assert duplicate_index.content_digest("a.pdf") == duplicate_index.content_digest("b.pdf")
+    assert duplicate_index.content_digest("a.pdf") != duplicate_index.content_digest("c.pdf")
+    assert duplicate_index.content_digest("scan.pdf") is None
+    assert duplicate_index.content_digest("page.png") is None
+
+
+def test_confirm_header_tolerates_ocr_spacing_and_punctuation():
+    data = {"invoice_number": "INV/2024/0789", "shop_address": {"name": "FreshFarms Produce Ltd."},
+            "total_bill": {"final_total": 47250.0}}
+    scan = "FRESHFARMS PRODUCE LTD\nTax Invoice No: INV / 2024 / 0789\nGrand Total  47,250.00"
+    assert confirm_header(data, "invoice_number", scan) is True
+    assert confirm_header(data, "invoice_number", scan.replace("47,250", "12,300")) is None
+    assert confirm_header(data, "invoice_number", "FreshFarms Produce Ltd INV/2024/0790 Total 9,999.00") is False
+    assert confirm_header(data, "invoice_number", "") is None
+    assert confirm_header(dict(data, invoice_number="NULL"), "invoice_number", scan) is None
+
+
+@pytest.fixture
+def dedup_parser(make_parser, tmp_path, monkeypatch):
+    digests = {}
+    monkeypatch.setattr(parser_module, "hash_document", lambda path: [12345])
+    monkeypatch.setattr(parser_module, "content_digest", lambda path: digests.get(path))
+    texts = {}
+    monkeypatch.setattr(parser_module, "document_text", lambda path: texts.get(path))
+    parser = make_parser(duplicate_index=DuplicateIndex(str(tmp_path / "index.jsonl")))
+    parser.digests, parser.texts = digests, texts
+    return parser
+
+
+def test_confirmed_duplicate_reuses_earlier_parse(dedup_parser, make_image, stub, activity_log):
+    first, second = make_image("first.png"), make_image("second.png")
+    dedup_parser.digests.update({first: "same", second: "same"})
+    assert dedup_parser.process_document(first, "Invoice") == ("first.json", "INV/2024/0789")
+    requests = stub.stats()["requests"]
+    assert dedup_parser.process_document(second, "Invoice") == ("second.json", "INV/2024/0789")
+    assert stub.stats()["requests"] == requests
+    assert activity_log[-1]["comments"].startswith("Duplicate: document")
+
+
+def test_different_text_layer_is_parsed_fresh(dedup_parser, make_image, stub, activity_log):
+    first, second = make_image("first.png"), make_image("second.png")
+    dedup_parser.digests.update({first: "one", second: "two"})
+    dedup_parser.process_document(first, "Invoice")
+    requests = stub.stats()["requests"]
+    dedup_parser.process_document(second, "Invoice")
+    assert stub.stats()["requests"] > requests
+    assert "NEEDS REVIEW" not in activity_log[-1]["comments"]
+    assert len(dedup_parser.duplicate_index.entries) == 2
+
+
+def test_unconfirmed_match_is_parsed_fresh_and_flagged(dedup_parser, make_image, stub, activity_log):
+    first, second = make_image("first.png"), make_image("second.png")
+    dedup_parser.process_document(first, "Invoice")
+    requests = stub.stats()["requests"]
+    dedup_parser.process_document(second, "Invoice")
+    assert stub.stats()["requests"] > requests
+    comments = activity_log[-1]["comments"]
+    assert "processed successfully" in comments
+    assert f"NEEDS REVIEW: page hashes match {first}" in comments
+    assert "document number matches" in comments
+
+
+def test_rescanned_document_is_confirmed_by_its_header(dedup_parser, make_image, stub, activity_log):
+    first, rescan = make_image("first.png"), make_image("rescan.png")
+    dedup_parser.process_document(first, "Invoice")
+    requests = stub.stats()["requests"]
+    dedup_parser.texts[rescan] = "FreshFarms Produce Ltd\nInvoice INV/2024/0789\nFinal total 47,250.00"
+    assert dedup_parser.process_document(rescan, "Invoice") == ("rescan.json", "INV/2024/0789")
+    assert stub.stats()["requests"] == requests
+    comments = activity_log[-1]["comments"]
+    assert comments.startswith(f"Duplicate: document {rescan} matches {first}")
+    assert "document number, vendor and total found in its text" in comments
+
+
+def test_scan_with_a_different_header_is_parsed_fresh(dedup_parser, make_image, stub, activity_log):
+    first, other = make_image("first.png"), make_image("other.png")
+    dedup_parser.process_document(first, "Invoice")
+    requests = stub.stats()["requests"]
+    dedup_parser.texts[other] = "FreshFarms Produce Ltd\nInvoice INV/2024/0999\nFinal total 1,150.00"
+    dedup_parser.process_document(other, "Invoice")
+    assert stub.stats()["requests"] > requests
+    assert "NEEDS REVIEW" not in activity_log[-1]["comments"]
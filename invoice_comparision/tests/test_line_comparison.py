@@ -0,0 +1,69 @@
+import pytest
+from line_comparison import LineComparator, NUMERIC_FIELDS
+from validator import InvoicePOValidator
+
+
+def row(**values):
+    return {field: values.get(field, 0.0) for field in NUMERIC_FIELDS}
+
+
+@pytest.fixture
+def comparator():
+    return LineComparator()
+
+
+def test_identical_rows_and_empty_input(comparator):
+    assert comparator.numeric_mismatches([row(COUNT=5)], [row(COUNT=5)]) == [set()]
+    assert comparator.numeric_mismatches([], []) == []
+
+
+def test_absolute_tolerance_is_inclusive(comparator):
+    assert comparator.numeric_mismatches([row(UNIT_ITEM_PRICE=10.01)], [row(UNIT_ITEM_PRICE=10.0)]) == [set()]
+    assert comparator.numeric_mismatches([row(UNIT_ITEM_PRICE=10.02)], [row(UNIT_ITEM_PRICE=10.0)]) == [
+        {"UNIT_ITEM_PRICE"}]
+    # Fields without their own entry use DEFAULT_TOLERANCE
+    assert comparator.numeric_mismatches([row(MRP=99.995)], [row(MRP=100.0)]) == [set()]
+
+
+def test_relative_tolerance_scales_with_the_amount(comparator):
+    # 0.01 + 0.0005 * 100000 = 50.01 allowed on a large amount
+    assert comparator.numeric_mismatches([row(NET_AMOUNT=100050.0)], [row(NET_AMOUNT=100000.0)]) == [set()]
+    assert comparator.numeric_mismatches([row(NET_AMOUNT=100051.0)], [row(NET_AMOUNT=100000.0)]) == [{"NET_AMOUNT"}]
+    assert comparator.numeric_mismatches([row(NET_AMOUNT=10.1)], [row(NET_AMOUNT=10.0)]) == [{"NET_AMOUNT"}]
+
+
+def test_count_is_compared_exactly(comparator):
+    assert comparator.numeric_mismatches([row(COUNT=101)], [row(COUNT=100)]) == [{"COUNT"}]
+    assert comparator.numeric_mismatches([row(COUNT="100")], [row(COUNT=100)]) == [set()]
+
+
+def test_unparsed_values_fall_back_to_exact_comparison(comparator):
+    invoice = [row(MRP="n/a", GST_RATE=None), row(MRP="n/a")]
+    po = [row(MRP="n/a", GST_RATE=None), row(MRP=12.0)]
+    assert comparator.numeric_mismatches(invoice, po) == [set(), {"MRP"}]
+    missing = row()
+    del missing["CGST_AMOUNT"]
+    assert comparator.numeric_mismatches([missing], [row()]) == [{"CGST_AMOUNT"}]
+
+
+def test_rows_are_compared_pairwise(comparator):
+    invoice = [row(COUNT=1), row(COUNT=2, UNIT_ITEM_PRICE=5.0), row(GST_AMOUNT=3.0)]
+    po = [row(COUNT=1), row(COUNT=3, UNIT_ITEM_PRICE=5.5), row(GST_AMOUNT=3.0)]
+    assert comparator.numeric_mismatches(invoice, po) == [set(), {"COUNT", "UNIT_ITEM_PRICE"}, set()]
+
+
+def test_tolerance_overrides():
+    comparator = LineComparator({"COUNT": (1.0, 0.0), "UNIT_ITEM_PRICE": (0.0, 0.1)})
+    assert comparator.tolerances["NET_AMOUNT"] == (0.01, 0.0005)
+    assert comparator.numeric_mismatches([row(COUNT=101, UNIT_ITEM_PRICE=109.0)],
+                                         [row(COUNT=100, UNIT_ITEM_PRICE=100.0)]) == [set()]
+    assert comparator.numeric_mismatches([row(COUNT=102, UNIT_ITEM_PRICE=112.0)],
+                                         [row(COUNT=100, UNIT_ITEM_PRICE=100.0)]) == [{"COUNT", "UNIT_ITEM_PRICE"}]
+
+
+def test_validator_compare_numeric_skips_unmatched_items():
+    validator = InvoicePOValidator(defer_logs=True, tolerances={"UNIT_ITEM_PRICE": (0.5, 0.0)})
+    po_line = row(COUNT=10, UNIT_ITEM_PRICE=100.0)
+    invoice = [row(COUNT=10, UNIT_ITEM_PRICE=100.4), row(COUNT=1), row(COUNT=11, UNIT_ITEM_PRICE=100.0)]
+    assert validator.compare_numeric(invoice[:2], [po_line, None]) == [set(), None]
+    assert validator.compare_numeric([invoice[2]], [po_line]) == [{"COUNT"}]
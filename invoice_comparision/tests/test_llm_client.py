@@ -0,0 +1,108 @@
+import gc
+import asyncio
+import httpx
+import openai
+import pytest
+import llm_client
+
+
+def api_error(status, headers=None):
+    response = httpx.Response(status, headers=headers or {},
+                              request=httpx.Request("POST", "http://test/v1/chat/completions"))
+    return openai.APIStatusError("failed", response=response, body=None)
+
+
+def test_sync_client_is_shared_per_key():
+    assert llm_client.get_client("sk-a", "http://a/v1") is llm_client.get_client("sk-a", "http://a/v1")
+    assert llm_client.get_client("sk-a", "http://a/v1") is not llm_client.get_client("sk-a", "http://b/v1")
+
+
+def test_clients_are_plain_openai_clients():
+    assert isinstance(llm_client.get_client("sk-a", "http://a/v1"), openai.OpenAI)
+
+    async def fetch():
+        return llm_client.get_async_client("sk-a", "http://a/v1")
+    assert isinstance(asyncio.run(fetch()), openai.AsyncOpenAI)
+
+
+def test_async_clients_are_per_loop_and_closed_when_the_loop_ends():
+    async def fetch():
+        first = llm_client.get_async_client("sk-a", "http://a/v1")
+        assert llm_client.get_async_client("sk-a", "http://a/v1") is first
+        return first
+
+    first, second = asyncio.run(fetch()), asyncio.run(fetch())
+    assert first is not second
+    assert first.is_closed() and second.is_closed()
+    gc.collect()
+    assert len(llm_client._async_clients) == 0
+
+
+def test_aclose_async_clients_closes_and_reopens():
+    async def run():
+        client = llm_client.get_async_client("sk-a", "http://a/v1")
+        await llm_client.aclose_async_clients()
+        assert client.is_closed()
+        reopened = llm_client.get_async_client("sk-a", "http://a/v1")
+        assert reopened is not client and not reopened.is_closed()
+    asyncio.run(run())
+
+
+def test_retry_honours_retry_after_and_counts_attempts(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(llm_client.time, "sleep", sleeps.append)
+    failures = [api_error(429, {"retry-after-ms": "250"}), api_error(503, {"retry-after": "2"})]
+
+    def call():
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+    assert llm_client.call_with_retry(call, max_retries=3) == ("ok", 2)
+    assert sleeps == [0.25, 2.0]
+
+
+def test_retry_after_dates_and_unreadable_headers(monkeypatch):
+    monkeypatch.setattr(llm_client.time, "time", lambda: 1_700_000_000.0)
+    # 2023-11-14 22:13:30 GMT is 10 s after the patched clock
+    assert llm_client.retry_after_seconds(api_error(429, {"retry-after": "Tue, 14 Nov 2023 22:13:30 GMT"})) == 10.0
+    assert llm_client.retry_after_seconds(api_error(429, {"retry-after": "Tue, 14 Nov 2023 22:13:30 -0000"})) == 10.0
+    assert llm_client.retry_after_seconds(api_error(429, {"retry-after": "Tue, 14 Nov 2023 22:00:00 GMT"})) == 0.0
+    assert llm_client.retry_after_seconds(api_error(429, {"retry-after": "soon"})) is None
+    assert 0 <= llm_client.backoff_delay(1, api_error(429, {"retry-after": "soon"})) <= 2.0
+
+
+def test_non_retryable_errors_and_exhausted_retries_raise(monkeypatch):
+    monkeypatch.setattr(llm_client.time, "sleep", lambda seconds: None)
+    with pytest.raises(openai.APIStatusError):
+        llm_client.call_with_retry(lambda: (_ for _ in ()).throw(api_error(400)), max_retries=3)
+    calls = []
+
+    def always_busy():
+        calls.append(1)
+        raise api_error(500)
+    with pytest.raises(openai.APIStatusError):
+        llm_client.call_with_retry(always_busy, max_retries=2)
+    assert len(calls) == 3
+
+
+def test_async_retry(monkeypatch):
+    async def no_sleep(seconds):
+        pass
+    monkeypatch.setattr(llm_client.asyncio, "sleep", no_sleep)
+    failures = [api_error(502)]
+
+    async def call():
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+    assert asyncio.run(llm_client.acall_with_retry(call)) == ("ok", 1)
+
+
+def test_wrapped_errors_are_classified_by_their_cause():
+    try:
+        try:
+            raise api_error(429)
+        except openai.APIStatusError as e:
+            raise RuntimeError("instructor wrapper") from e
+    except RuntimeError as wrapped:
+        assert llm_client.status_code(wrapped) == 429 and llm_client.is_retryable(wrapped)
@@ -0,0 +1,85 @@
+import os
+import datetime
+from typing import Optional
+from pydantic import BaseModel
+from parse_cache import ParseCache
+
+
+class Dated(BaseModel):
+    number: str
+    issued: Optional[datetime.date] = None
+
+
+class Other(BaseModel):
+    number: str
+    total: float = 0.0
+
+
+def make_input(tmp_path, content=b"%PDF-1.4 invoice"):
+    path = tmp_path / "invoice.pdf"
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_round_trip_with_dates(tmp_path):
+    cache = ParseCache(str(tmp_path / "cache"))
+    key = cache.make_key(make_input(tmp_path), "Invoice", Dated, "gpt-4o")
+    assert cache.get(key, Dated) is None
+    cache.put(key, Dated(number="INV-1", issued=datetime.date(2024, 3, 1)), "INV-1", "Invoice", "gpt-4o")
+    response, file_num = cache.get(key, Dated)
+    assert response == Dated(number="INV-1", issued=datetime.date(2024, 3, 1))
+    assert file_num == "INV-1"
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_key_changes_with_content_schema_and_model(tmp_path):
+    cache = ParseCache(str(tmp_path / "cache"))
+    input_file = make_input(tmp_path)
+    key = cache.make_key(input_file, "Invoice", Dated, "gpt-4o")
+    assert key == cache.make_key(input_file, "Invoice", Dated, "gpt-4o")
+    assert key != cache.make_key(input_file, "Invoice", Other, "gpt-4o")
+    assert key != cache.make_key(input_file, "PO", Dated, "gpt-4o")
+    assert key != cache.make_key(input_file, "Invoice", Dated, "gpt-4o-mini")
+    assert key != cache.make_key(make_input(tmp_path, b"%PDF-1.4 other"), "Invoice", Dated, "gpt-4o")
+
+
+def test_expired_entry_is_a_miss(tmp_path):
+    cache = ParseCache(str(tmp_path / "cache"), max_age_seconds=60)
+    cache.put("k", Dated(number="1"), "1", "Invoice", "m")
+    old = os.path.getmtime(cache._entry_path("k")) - 120
+    os.utime(cache._entry_path("k"), (old, old))
+    assert cache.get("k", Dated) is None
+    assert not os.path.exists(cache._entry_path("k"))
+
+
+def test_invalid_entry_is_a_miss(tmp_path):
+    cache = ParseCache(str(tmp_path / "cache"))
+    cache.put("k", Dated(number="1"), "1", "Invoice", "m")
+    assert cache.get("k", Other) is not None
+    with open(cache._entry_path("k"), 'w') as f:
+        f.write("{not json")
+    assert cache.get("k", Dated) is None
+
+
+def test_entry_evicted_before_touch_is_a_miss(tmp_path, monkeypatch):
+    cache = ParseCache(str(tmp_path / "cache"))
+    cache.put("k", Dated(number="1"), "1", "Invoice", "m")
+
+    def evicted(path, times):
+        os.remove(path)
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(os, "utime", evicted)
+    assert cache.get("k", Dated) is None
+    assert cache.stats()["misses"] == 1 and cache.stats()["hits"] == 0
+
+
+def test_evict_drops_least_recently_used(tmp_path):
+    cache = ParseCache(str(tmp_path / "cache"), max_bytes=10 ** 9, max_age_seconds=None)
+    for index, key in enumerate(["a", "b", "c"]):
+        cache.put(key, Dated(number=key), key, "Invoice", "m")
+        os.utime(cache._entry_path(key), (1000 + index, 1000 + index))
+    cache.get("a", Dated)
+    cache.max_bytes = os.path.getsize(cache._entry_path("a")) * 2
+    cache.evict()
+    assert cache.get("b", Dated) is None
+    assert cache.get("a", Dated) is not None and cache.get("c", Dated) is not None
@@ -0,0 +1,57 @@
+import asyncio
+
+
+async def collect(parser, paths, **kwargs):
+    return [result async for result in parser.process_batch(paths, "Invoice", **kwargs)]
+
+
+def test_process_batch_parses_every_document(make_parser, make_image, activity_log):
+    parser = make_parser()
+    paths = [make_image(f"invoice_{index}.png") for index in range(3)]
+    results = asyncio.run(collect(parser, paths + ["missing.png"], concurrency=2))
+    by_input = {result["input_file"]: result for result in results}
+    assert len(results) == 4
+    for path in paths:
+        assert by_input[path]["status"] == "Success"
+        assert by_input[path]["file_num"] == "INV/2024/0789"
+    assert by_input["missing.png"]["status"] == "Error"
+    assert [entry["status"] for entry in activity_log].count("Success") == 3
+    assert [entry["status"] for entry in activity_log].count("Error") >= 1
+
+
+def test_process_batch_bounds_concurrency(make_parser, make_image, monkeypatch):
+    parser = make_parser()
+    active, peak = 0, 0
+    original = parser._aprocess
+
+    async def tracked(*args, **kwargs):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        try:
+            await asyncio.sleep(0.05)
+            return await original(*args, **kwargs)
+        finally:
+            active -= 1
+    monkeypatch.setattr(parser, "_aprocess", tracked)
+    paths = [make_image(f"invoice_{index}.png") for index in range(6)]
+    results = asyncio.run(collect(parser, paths, concurrency=2))
+    assert all(result["status"] == "Success" for result in results)
+    assert peak == 2
+
+
+def test_process_batch_times_out_slow_documents(make_parser, make_image, stub, activity_log):
+    stub.latency = lambda rng: 2.0
+    parser = make_parser()
+    results = asyncio.run(collect(parser, [make_image("invoice.png")], timeout=0.3))
+    assert results[0]["status"] == "Error"
+    assert "timed out" in results[0]["error"]
+    assert activity_log[-1]["status"] == "Error"
+
+
+def test_aprocess_document_matches_process_document(make_parser, make_image):
+    parser = make_parser()
+    path = make_image("invoice.png")
+    sync_result = parser.process_document(path, "Invoice")
+    async_result = asyncio.run(parser.aprocess_document(path, "Invoice"))
+    assert sync_result == async_result == ("invoice.json", "INV/2024/0789")
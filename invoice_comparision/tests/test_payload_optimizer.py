@@ -0,0 +1,91 @@
+import base64
+import io
+from PIL import Image, ImageDraw
+import tracing
+from payload_optimizer import PayloadOptimizer, estimate_image_tokens, high_detail_size, crop_blank_margins
+
+
+def text_page(size=(1654, 2339)):
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    for row in range(40):
+        draw.text((150, 200 + row * 45), f"{row + 1:>3}  BOLT SS304 M{row + 6} X 40MM   {row * 7 + 3:>4}  1,234.50",
+                  fill='black')
+    return image
+
+
+def blank_page(size=(1654, 2339)):
+    return Image.new('RGB', size, 'white')
+
+
+def test_high_detail_token_estimate_matches_provider_scaling():
+    assert high_detail_size(1654, 2339) == (768, 1086)
+    assert estimate_image_tokens(1654, 2339) == 85 + 170 * 6
+    assert estimate_image_tokens(1654, 2339, 'low') == 85
+
+
+def test_crop_blank_margins_keeps_padding():
+    image = Image.new('L', (400, 400), 255)
+    ImageDraw.Draw(image).rectangle((100, 150, 200, 250), fill=0)
+    assert crop_blank_margins(image, padding=10).size == (121, 121)
+
+
+def test_pages_with_text_stay_at_high_detail_under_a_tight_token_budget():
+    optimizer = PayloadOptimizer(max_request_tokens=300, crop_margins=False)
+    payloads = list(optimizer.optimize([text_page(), text_page()], 2))
+    assert [payload["detail"] for payload in payloads] == ['high', 'high']
+    assert all(min(payload["width"], payload["height"]) >= optimizer.min_text_short_side for payload in payloads)
+    assert all(payload["over_budget"] for payload in payloads)
+    assert optimizer.stats()["over_budget"] == 2
+
+
+def test_token_budget_scales_text_pages_down_to_the_legibility_floor():
+    optimizer = PayloadOptimizer(max_request_tokens=2 * 800, min_text_short_side=512, crop_margins=False)
+    payload = next(optimizer.optimize([text_page()], 2))
+    assert payload["detail"] == 'high' and not payload["over_budget"]
+    assert payload["tokens"] <= 800
+    assert min(payload["width"], payload["height"]) >= 512
+
+
+def test_default_floor_lets_the_token_budget_save_tiles():
+    optimizer = PayloadOptimizer(max_request_tokens=800, crop_margins=False)
+    payload = next(optimizer.optimize([text_page()], 1))
+    assert not payload["over_budget"]
+    assert payload["tokens"] == 85 + 170 * 4 < estimate_image_tokens(1654, 2339)
+    assert min(payload["width"], payload["height"]) == optimizer.min_text_short_side
+
+
+def test_exhausted_byte_budget_keeps_text_pages_legible():
+    optimizer = PayloadOptimizer(max_request_bytes=1000, crop_margins=False)
+    payload = next(optimizer.optimize([text_page()], 1))
+    assert payload["over_budget"] and payload["bytes"] > 1000
+    assert min(payload["width"], payload["height"]) >= optimizer.min_text_short_side
+
+
+def test_only_blank_pages_go_out_at_low_detail():
+    optimizer = PayloadOptimizer()
+    payloads = list(optimizer.optimize([text_page(), blank_page()], 2))
+    assert [payload["detail"] for payload in payloads] == ['high', 'low']
+    assert max(payloads[1]["width"], payloads[1]["height"]) <= 512
+    assert optimizer.stats()["blank_pages"] == 1
+
+
+def test_byte_budget_lowers_quality_then_scale():
+    optimizer = PayloadOptimizer(max_request_bytes=20_000, crop_margins=False)
+    payload = next(optimizer.optimize([text_page()], 1))
+    assert payload["bytes"] <= 20_000 and not payload["over_budget"]
+    assert optimizer.min_text_short_side <= payload["width"] < 768
+    with Image.open(io.BytesIO(base64.b64decode(payload["data"]))) as image:
+        assert image.size == (payload["width"], payload["height"])
+
+
+def test_totals_are_recorded_when_the_consumer_stops_early():
+    optimizer = PayloadOptimizer()
+    with tracing.span("prepare_messages") as span:
+        pages = optimizer.optimize([text_page(), text_page(), text_page()], 3)
+        first = next(pages)
+        pages.close()
+    assert optimizer.stats()["pages"] == 1
+    assert optimizer.stats()["bytes"] == first["bytes"]
+    assert span.attributes["image_pages"] == 1
+    assert span.attributes["image_tokens"] == first["tokens"]
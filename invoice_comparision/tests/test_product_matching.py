@@ -0,0 +1,121 @@
+import copy
+import itertools
+import random
+import pytest
+import product_matching
+from product_matching import ProductMatcher, hungarian, normalize_description, repeat_groups
+from validator import InvoicePOValidator
+
+
+def product(description, count=1, price=10.0, hsn=None):
+    return {"PRODUCT_DESCRIPTION": description, "COUNT": count, "UNIT_ITEM_PRICE": price, "HSN": hsn}
+
+
+def brute_force(cost):
+    columns = range(len(cost[0]))
+    return min(sum(cost[r][c] for r, c in enumerate(perm)) for perm in itertools.permutations(columns, len(cost)))
+
+
+def test_normalize_description():
+    assert normalize_description("Bolt,  m8 x 40mm ") == "BOLT M8 X 40MM"
+    assert normalize_description(None) == ""
+
+
+def test_exact_and_drifted_descriptions():
+    matcher = ProductMatcher([product("Hex Bolt M8 x 40mm"), product("Flat Washer M8"), product("Spring Washer M8")])
+    result = matcher.match([product("Flat  Washer, M8"), product("Hex Bo1t M8x40 mm"), product("Copper Pipe 15mm")])
+    assert result[0] == (1, 1.0)
+    assert result[1][0] == 0 and 0.6 <= result[1][1] < 1.0
+    assert result[2] == (None, 0.0)
+
+
+def test_hsn_and_price_break_ties():
+    matcher = ProductMatcher([product("Organic Apple Red", price=150.0, hsn="0810"),
+                              product("Organic Apple Rex", price=90.0, hsn="0808")])
+    assert matcher.match([product("Organic Apple Re", price=90.0, hsn="0808")])[0][0] == 1
+    assert matcher.match([product("Organic Apple Re", price=150.0, hsn="08.10")])[0][0] == 0
+
+
+def test_each_po_line_is_used_once():
+    # Both invoice lines prefer PO line 0; the assignment gives the weaker one line 1
+    matcher = ProductMatcher([product("Steel Rod 10mm"), product("Steel Rod 12mm")])
+    result = matcher.match([product("Steel Rod 10 mm"), product("Steel Rod 1Omm")])
+    assert sorted(index for index, _ in result) == [0, 1]
+
+
+def test_more_items_than_po_lines_transposes_the_assignment():
+    matcher = ProductMatcher([product("Copper Cable 2.5 sqmm"), product("Copper Cable 4 sqmm")])
+    items = [product("Copper Cable 2.5 sq mm"), product("Copper Cab1e 4 sqmm"), product("Copper Cable 2.5sqm")]
+    result = matcher.match(items)
+    assert result[1][0] == 1
+    assert [index for index, _ in result].count(0) == 1
+    assert [index for index, _ in result].count(None) == 1
+
+
+@pytest.mark.parametrize("scipy", [True, False])
+def test_assignment_with_and_without_scipy(monkeypatch, scipy):
+    if not scipy:
+        monkeypatch.setattr(product_matching, "linear_sum_assignment", None)
+    po = [product(f"Bearing 62{n:02d} ZZ") for n in range(8)]
+    items = [product(f"Bearing 62{n:02d}ZZ") for n in reversed(range(8))] + [product("Bearing 6299 ZZ")]
+    result = ProductMatcher(po).match(items)
+    assert [index for index, _ in result[:8]] == list(reversed(range(8)))
+
+
+def test_hungarian_matches_brute_force():
+    rng = random.Random(7)
+    for rows, columns in [(1, 1), (2, 3), (3, 3), (4, 6), (5, 5)]:
+        cost = [[rng.random() for _ in range(columns)] for _ in range(rows)]
+        assignment = hungarian(cost)
+        assert len(set(assignment)) == rows
+        assert sum(cost[r][c] for r, c in enumerate(assignment)) == pytest.approx(brute_force(cost))
+
+
+@pytest.mark.parametrize("scipy", [True, False])
+def test_large_components_fall_back_to_greedy(monkeypatch, scipy):
+    def never_called(cost):
+        raise AssertionError("component above exact_solve_limit was solved exactly")
+    monkeypatch.setattr(product_matching, "linear_sum_assignment", never_called if scipy else None)
+    monkeypatch.setattr(product_matching, "hungarian", never_called)
+    matcher = ProductMatcher([product("Gasket Ring 40"), product("Gasket Ring 50"), product("Gasket Ring 60")],
+                             exact_solve_limit=2)
+    result = matcher.match([product("Gasket Ring 4O"), product("Gasket Ring 5O"), product("Gasket Ring 6O")])
+    assert [index for index, _ in result] == [0, 1, 2]
+
+
+def test_exact_repeats_share_the_po_line():
+    matcher = ProductMatcher([product("Cement Bag 50kg", count=100), product("Sand Bag 25kg")])
+    result = matcher.match([product("Cement Bag 50kg", 60), product("Sand Bag 25kg"), product("CEMENT BAG, 50KG", 60)])
+    assert [index for index, _ in result] == [0, 1, 0]
+    assert repeat_groups([index for index, _ in result]) == [[0, 2]]
+    po_line = {"COUNT": 1}
+    assert repeat_groups([po_line, None, po_line, {"COUNT": 1}]) == [[0, 2]]
+
+
+@pytest.fixture
+def validator():
+    return InvoicePOValidator(defer_logs=True)
+
+
+def split_invoice(invoice, counts):
+    """Bill the invoice's first product in several rows with the given quantities."""
+    first = invoice["product"][0]
+    rows = [dict(first, COUNT=count, PRODUCT_TOTAL_PRICE=count * first["UNIT_ITEM_PRICE"]) for count in counts]
+    invoice = copy.deepcopy(invoice)
+    invoice["product"] = rows + invoice["product"][1:]
+    return invoice
+
+
+def test_repeated_rows_within_po_quantity_pass(validator, sample):
+    invoice, po = sample('Sample_Invoice (1).json'), sample('Sample_Purchase_Order.json')
+    is_mismatch, mismatches, _ = validator.validate_po(po, split_invoice(invoice, [60, 40]))
+    assert [m["Item"] for m in mismatches] == ["Organic Oranges"]
+
+
+def test_repeated_rows_over_billing_is_reported(validator, sample):
+    invoice, po = sample('Sample_Invoice (1).json'), sample('Sample_Purchase_Order.json')
+    is_mismatch, mismatches, _ = validator.validate_po(po, split_invoice(invoice, [60, 60]))
+    assert is_mismatch
+    assert mismatches[-1] == {"Issue": "Repeated rows exceed PO quantity", "Item": "Organic Apples", "Rows": 2,
+                              "Quantity PO": 100.0, "Quantity Invoice": 120.0}
+    assert all(m["Item"] != "Organic Apples" for m in mismatches[:-1])
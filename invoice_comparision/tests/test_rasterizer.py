@@ -0,0 +1,67 @@
+import io
+import base64
+import pytest
+from PIL import Image
+import rasterizer
+
+
+def decode(encoded):
+    return Image.open(io.BytesIO(base64.b64decode(encoded)))
+
+
+def test_fit_image_applies_grayscale_and_max_dimension():
+    image = Image.new('RGBA', (2000, 1000), 'white')
+    fitted = rasterizer.fit_image(image, grayscale=False, max_dimension=500)
+    assert fitted.mode == 'RGB' and fitted.size == (500, 250)
+    assert rasterizer.fit_image(Image.new('RGB', (300, 200)), grayscale=True).mode == 'L'
+    assert rasterizer.fit_image(Image.new('RGB', (300, 200)), max_dimension=500).size == (300, 200)
+
+
+def test_encode_image_is_base64_jpeg():
+    encoded = rasterizer.encode_image(Image.new('RGB', (120, 80), 'red'), quality=60)
+    with decode(encoded) as image:
+        assert image.format == 'JPEG' and image.size == (120, 80)
+
+
+def test_iter_encoded_pages_streams_an_image_file(make_image):
+    path = make_image("scan.png", size=(1600, 1200))
+    pages = list(rasterizer.iter_encoded_pages(path, grayscale=True, max_dimension=800, quality=70))
+    assert len(pages) == 1
+    with decode(pages[0]) as image:
+        assert image.mode == 'L' and image.size == (800, 600)
+
+
+def test_unsupported_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        list(rasterizer.iter_page_images(str(tmp_path / "document.tiff")))
+
+
+def test_resolve_workers_caps_by_chunks_and_max_workers(monkeypatch):
+    monkeypatch.setattr(rasterizer, "available_cores", lambda: 8)
+    assert rasterizer.resolve_workers(None, 10, 4) == 3
+    assert rasterizer.resolve_workers(2, 100, 4) == 2
+    assert rasterizer.resolve_workers(None, 1, 4) == 1
+
+
+def test_sharded_pages_come_back_in_order_with_bounded_shards(monkeypatch):
+    monkeypatch.setattr(rasterizer, "available_cores", lambda: 4)
+    monkeypatch.setattr(rasterizer, "pdf_page_count", lambda input_file: 11)
+    rendered = []
+
+    def render(input_file, first, last, *args):
+        rendered.append((first, last))
+        return list(range(first, last + 1))
+    monkeypatch.setattr(rasterizer, "render_page_range", render)
+
+    pages = list(rasterizer.iter_pdf_pages("doc.pdf", max_workers=None, pages_per_chunk=4))
+    assert pages == list(range(1, 12))
+    assert sorted(rendered) == [(1, 4), (5, 8), (9, 11)]
+
+
+def test_single_worker_renders_page_by_page(monkeypatch):
+    monkeypatch.setattr(rasterizer, "pdf_page_count", lambda input_file: 3)
+    calls = []
+    monkeypatch.setattr(rasterizer, "render_page_range",
+                        lambda input_file, first, last, *args: calls.append((first, last)) or [first])
+    assert list(rasterizer.iter_pdf_pages("doc.pdf", max_workers=1)) == [1, 2, 3]
+    assert calls == [(1, 1), (2, 2), (3, 3)]
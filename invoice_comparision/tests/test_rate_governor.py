@@ -0,0 +1,116 @@
+import time
+import base64
+import asyncio
+import threading
+from PIL import Image
+import rasterizer
+import rate_governor
+from payload_optimizer import estimate_image_tokens
+from rate_governor import RateLimitGovernor, LocalBucketStore, SQLiteBucketStore, estimate_request_tokens
+
+
+def image_message(size, detail="high"):
+    image = Image.effect_noise(size, 64).convert('RGB')
+    encoded = rasterizer.encode_image(image, quality=90)
+    return {"role": "user", "content": [{"type": "image_url",
+                                         "image_url": {"url": f"data:image/jpeg;base64,{encoded}", "detail": detail}}]}
+
+
+def test_image_tokens_come_from_the_header_without_decoding_the_payload(monkeypatch):
+    message = image_message((1654, 2339))
+    assert len(message["content"][0]["image_url"]["url"]) > 10 * rate_governor.HEADER_CHARS
+    decoded = []
+    original = base64.b64decode
+    monkeypatch.setattr(rate_governor.base64, "b64decode", lambda data: decoded.append(len(data)) or original(data))
+    assert estimate_request_tokens([message], max_output_tokens=0) == estimate_image_tokens(1654, 2339)
+    assert max(decoded) <= rate_governor.HEADER_CHARS
+
+
+def test_request_token_estimate_counts_text_low_detail_and_output():
+    messages = [{"role": "user", "content": "x" * 400}, image_message((800, 600), detail="low"),
+                {"role": "user", "content": [{"type": "image_url", "image_url": {"url": "data:image/jpeg;base64,!!"}}]}]
+    assert estimate_request_tokens(messages, max_output_tokens=100) == (
+        100 + 104 + 85 + estimate_image_tokens(1536, 2048))
+
+
+def test_local_bucket_reports_wait_until_refilled():
+    store = LocalBucketStore()
+    assert store.take("tokens", 60, 100, 10) == 0.0
+    wait = store.take("tokens", 60, 100, 10)
+    assert 1.9 < wait <= 2.0
+    store.observe("tokens", 5, 100)
+    assert store.take("tokens", 50, 100, 10) > 4
+
+
+def test_sqlite_buckets_are_shared_between_governors(tmp_path):
+    path = str(tmp_path / "buckets.sqlite")
+    first, second = SQLiteBucketStore(path), SQLiteBucketStore(path)
+    assert first.take("requests", 3, 4, 0.001) == 0.0
+    assert second.take("requests", 3, 4, 0.001) > 0
+
+
+def test_a_burst_of_429s_halves_the_limit_once():
+    governor = RateLimitGovernor(max_concurrency=16)
+    governor.concurrency_limit = 8.0
+    admitted = [governor.acquire(10) for _ in range(6)]
+    for started in admitted:
+        governor.release(rate_limited=True, started=started)
+    assert governor.concurrency_limit == 4.0
+    assert governor.stats()["rate_limited"] == 6 and governor.decreases == 1
+    # A request admitted after the cut that is still rejected is a new overload signal
+    governor.release(rate_limited=True, started=governor.acquire(10))
+    assert governor.concurrency_limit == 2.0
+
+
+def test_successes_grow_the_limit_additively():
+    governor = RateLimitGovernor(max_concurrency=5)
+    for _ in range(4):
+        governor.release(started=governor.acquire(10))
+    assert 4.9 < governor.concurrency_limit <= 5
+
+
+class SlowStore(LocalBucketStore):
+    def take(self, name, amount, capacity, refill_per_second):
+        time.sleep(0.2)
+        return super().take(name, amount, capacity, refill_per_second)
+
+
+def test_bucket_transactions_run_outside_the_governor_lock():
+    governor = RateLimitGovernor()
+    governor.store = SlowStore()
+    thread = threading.Thread(target=governor.acquire, args=(10,))
+    thread.start()
+    time.sleep(0.05)
+    start = time.perf_counter()
+    governor.stats()
+    assert time.perf_counter() - start < 0.1
+    thread.join()
+
+
+def test_aacquire_keeps_the_event_loop_running():
+    governor = RateLimitGovernor()
+    governor.store = SlowStore()
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    async def run():
+        task = asyncio.create_task(ticker())
+        await governor.aacquire(10)
+        task.cancel()
+    asyncio.run(run())
+    assert ticks >= 20
+    assert governor.in_flight == 1
+
+
+def test_headers_resync_limits_and_budget():
+    governor = RateLimitGovernor(tokens_per_minute=1000)
+    governor.observe_headers({"x-ratelimit-limit-tokens": "10000", "x-ratelimit-remaining-tokens": "1500"})
+    assert governor.tokens_per_minute == 10000
+    # 1500 left minus the 1000 tokens of headroom below the limit
+    assert governor.store.take("tokens", 400, 9000, 150) == 0.0
+    assert governor.store.take("tokens", 400, 9000, 150) > 0
@@ -0,0 +1,70 @@
+import json
+import document_class
+import reextraction
+
+
+def test_paths_get_and_set(sample):
+    data = sample('Sample_Invoice (1).json')
+    assert reextraction.parse_path("product[2].UNIT_ITEM_PRICE") == ["product", 2, "UNIT_ITEM_PRICE"]
+    assert reextraction.get_value(data, "product[2].UNIT_ITEM_PRICE") == 12.0
+    reextraction.set_value(data, "product[2].UNIT_ITEM_PRICE", 120.0)
+    assert data["product"][2]["UNIT_ITEM_PRICE"] == 120.0
+    assert reextraction.has_path(data, "billing_address.postal_code")
+    assert not reextraction.has_path(data, "product[9].COUNT")
+    assert not reextraction.has_path(data, "billing_address.country")
+
+
+def test_paths_from_mismatches(sample):
+    data = sample('Sample_Invoice (1).json')
+    mismatches = {"mismatch_len": 0, "mismatches": [
+        {"Issue_category": "buyer_address", "buyer_address": {"postal_code": ["400001", "400002"]}},
+        {"Issue_category": "Billing", "Billing": {}},
+        {"Issue_category": "organic  ORANGES", "organic  ORANGES": {"UNIT_ITEM_PRICE": [12.0, 120.0]}},
+        {"Issue_category": "Unknown item", "Unknown item": {"COUNT": [1, 2]}},
+    ]}
+    assert reextraction.paths_from_mismatches(mismatches, data, "Invoice") == [
+        "billing_address.postal_code", "total_bill.final_total", "product[2].UNIT_ITEM_PRICE"]
+    quantity_issue = [{"Issue": "Mismatch in quantity or rate", "Item": "Organic Bananas", "Quantity PO": 200.0,
+                       "Quantity Invoice": 210.0, "Rate PO": 60.0, "Rate Invoice": 60.0},
+                      {"Issue": "Item not found in PO", "Item": "Organic Apples"}]
+    assert reextraction.paths_from_mismatches(quantity_issue, data, "Invoice") == ["product[1].COUNT"]
+
+
+def test_correction_model_keeps_field_types_and_descriptions():
+    paths = ["billing_address.postal_code", "product[1].COUNT", "milestone"]
+    model = reextraction.correction_model(document_class.Invoice, paths)
+    assert model.__name__ == "InvoiceCorrection"
+    assert list(model.model_fields) == ["billing_address_postal_code", "product_1_COUNT", "milestone"]
+    assert model.model_fields["product_1_COUNT"].annotation is int
+    assert model.model_fields["billing_address_postal_code"].description.startswith("billing_address.postal_code: ")
+
+
+def test_locate_pages(sample):
+    data = sample('Sample_Invoice (1).json')
+    page_texts = ["FreshFarms Produce Ltd  GreenLeaf Retail Pvt Ltd 400001", "Organic Apples 100 150",
+                  "Organic Oranges 150 12"]
+    assert reextraction.locate_pages(page_texts, data, ["product[2].UNIT_ITEM_PRICE"], 3) == [3]
+    assert reextraction.locate_pages(page_texts, data, ["billing_address.postal_code"], 3) == [1]
+    assert reextraction.locate_pages(page_texts, data, ["product[1].COUNT"], 3) == [1, 2, 3]
+    assert reextraction.locate_pages([], data, ["milestone"], 3) == [1]
+
+
+def test_reextract_fields_patches_the_stored_parse(make_parser, make_image, stub, tmp_path, activity_log):
+    parser = make_parser()
+    path = make_image("invoice.png")
+    parser.process_document(path, "Invoice")
+    stub.fixtures["InvoiceCorrection"] = {"billing_address_postal_code": 400099, "product_2_UNIT_ITEM_PRICE": 12.0}
+
+    changes = parser.reextract_fields(path, "Invoice",
+                                      paths=["billing_address.postal_code", "product[2].UNIT_ITEM_PRICE"])
+    assert changes == {"billing_address.postal_code": (400001, 400099)}
+    with open(tmp_path / "parsed" / "Invoice" / "invoice.json") as f:
+        assert json.load(f)["billing_address"]["postal_code"] == 400099
+    assert activity_log[-1]["status"] == "Success"
+    assert "1 changed" in activity_log[-1]["comments"]
+
+
+def test_reextract_fields_without_stored_parse_is_logged(make_parser, make_image, activity_log):
+    assert make_parser().reextract_fields(make_image("invoice.png"), "Invoice", paths=["milestone"]) is None
+    assert activity_log[-1]["status"] == "Error"
+    assert "No stored parse" in activity_log[-1]["comments"]
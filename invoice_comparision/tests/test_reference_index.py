@@ -0,0 +1,79 @@
+import pytest
+import document_store
+from reference_index import ReferenceIndex, normalize_reference, normalize_vendor
+
+
+def po(number, vendor):
+    return {"po_number": number, "shop_address": {"name": vendor}, "product": []}
+
+
+@pytest.fixture
+def index(tmp_path):
+    store = document_store.JsonStore(str(tmp_path / "parsed"))
+    index = ReferenceIndex(str(tmp_path / "index.sqlite"), store)
+    index.documents = store
+    yield index
+    index.close()
+
+
+def put(index, name, data, doctype="PO"):
+    index.documents.put(doctype, name, data)
+    return index.add(doctype, name, data)
+
+
+def test_normalization():
+    assert normalize_reference(" po-0042 ") == normalize_reference("PO 0042") == "PO0042"
+    assert normalize_reference("NULL") is None and normalize_reference(None) is None
+    assert normalize_vendor("Acme Supplies Pvt. Ltd.") == "acme supplies"
+
+
+def test_resolve_by_number_and_vendor(index):
+    assert put(index, "acme_po", po("PO-1", "Acme Supplies Ltd"))
+    assert index.resolve("PO", "po 1") == "acme_po"
+    assert index.resolve("PO", "PO-1", "ACME Supplies") == "acme_po"
+    assert index.resolve("PO", "PO-2") is None
+    assert index.resolve("PO", "NULL") is None
+
+
+def test_resolve_rejects_a_different_vendor(index):
+    put(index, "acme_po", po("PO-1", "Acme Supplies Ltd"))
+    assert index.resolve("PO", "PO-1", "Globex Corp") is None
+    put(index, "globex_po", po("PO-1", "Globex Corp"))
+    assert index.resolve("PO", "PO-1", "Globex") == "globex_po"
+    assert index.resolve("PO", "PO-1", "Initech") is None
+    # Several vendors share the number: without a vendor there is no way to choose
+    assert index.resolve("PO", "PO-1") is None
+
+
+def test_resolve_accepts_a_document_without_vendor(index):
+    put(index, "unnamed_po", po("PO-7", ""))
+    assert index.resolve("PO", "PO-7", "Acme") == "unnamed_po"
+
+
+def test_resave_moves_the_document_to_its_corrected_number(index):
+    put(index, "acme_po", po("PO-1", "Acme"))
+    put(index, "acme_po", po("PO-11", "Acme"))
+    assert index.resolve("PO", "PO-1") is None
+    assert index.resolve("PO", "PO-11") == "acme_po"
+    assert not put(index, "acme_po", po("NULL", "Acme"))
+    assert index.stats()["indexed"] == 0
+
+
+def test_rebuild_counts_only_indexed_documents(index):
+    put(index, "acme_po", po("PO-1", "Acme"))
+    put(index, "blank_po", po("", "Acme"))
+    put(index, "contract", {"contract_number": "C-9", "seller_address": {"name": "Acme"}}, doctype="Contract")
+    index.documents.put("Invoice", "invoice", {"invoice_number": "INV-1"})
+    assert index.rebuild() == 2
+    assert index.stats()["indexed"] == 2
+
+
+def test_get_document_caches_recent_documents(index):
+    put(index, "acme_po", po("PO-1", "Acme"))
+    assert index.get_document("PO", "PO-1", "Acme")["po_number"] == "PO-1"
+    assert index.get_document("PO", "PO-1", "Acme")["po_number"] == "PO-1"
+    assert index.get_document("PO", "PO-1", "Globex") is None
+    stats = index.stats()
+    assert (stats["hits"], stats["misses"], stats["cached"]) == (1, 1, 1)
+    put(index, "acme_po", po("PO-1", "Acme Two"))
+    assert index.stats()["cached"] == 0
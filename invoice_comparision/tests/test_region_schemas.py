@@ -0,0 +1,65 @@
+import document_class
+import region_schemas
+
+GST_TEXT = ("GSTIN 29ABCDE1234F1Z5\nDescription  HSN  Qty  Rate  Taxable  CGST  SGST  Net\n"
+            "Steel bolts  7318  10  ₹12.50  125.00  11.25  11.25  147.50")
+US_TEXT = "Acme Corp, Springfield IL 62704\nItem  Qty  Unit price  Amount\nWidget  2  $5.00  $10.00\nSales tax $0.80"
+
+
+def test_detect_regime():
+    assert region_schemas.detect_regime(GST_TEXT) == 'IN_GST'
+    assert region_schemas.detect_regime(US_TEXT) == 'US'
+    assert region_schemas.detect_regime("Item Qty Amount") is None
+    assert region_schemas.detect_regime("   ") is None
+
+
+def test_detect_columns():
+    gst_columns = region_schemas.detect_columns(GST_TEXT, 'IN_GST')
+    assert {"HSN", "CGST_RATE", "SGST_AMOUNT", "TAXABLE_AMOUNT", "NET_AMOUNT"} <= gst_columns
+    assert "MRP" not in gst_columns and "DISCOUNT_RATE" not in gst_columns
+    us_columns = region_schemas.detect_columns(US_TEXT + " GST", 'US')
+    assert not us_columns & region_schemas.GST_COLUMNS
+    assert {"PRODUCT_DESCRIPTION", "COUNT", "UNIT_ITEM_PRICE", "PRODUCT_TOTAL_PRICE"} <= us_columns
+
+
+def test_select_model_slims_products_only_when_it_helps():
+    model, regime, columns = region_schemas.select_model(document_class.Invoice, US_TEXT)
+    assert regime == 'US' and model is not document_class.Invoice
+    assert model.__name__ == "Invoice"
+    product = model.model_fields["product"].annotation.__args__[0]
+    assert set(product.model_fields) == columns
+    assert region_schemas.select_model(document_class.Invoice, US_TEXT)[0] is model
+    assert region_schemas.select_model(document_class.Invoice, "scanned")[0] is document_class.Invoice
+    assert region_schemas.select_model(document_class.Contract, US_TEXT)[0] is document_class.Contract
+    everything = GST_TEXT + " MRP gross discount IGST"
+    assert region_schemas.select_model(document_class.Invoice, everything) == (document_class.Invoice, 'IN_GST', None)
+
+
+def test_message_text_reads_text_parts_only():
+    messages = [{"role": "user", "content": "page one"},
+                {"role": "user", "content": [{"type": "text", "text": "page two"},
+                                             {"type": "image_url", "image_url": {"url": "data:"}}]}]
+    assert region_schemas.message_text(messages) == "page one\npage two"
+
+
+def test_expand_product_derives_missing_amounts():
+    product = region_schemas.expand_product({"PRODUCT_DESCRIPTION": "Widget", "COUNT": 2, "UNIT_ITEM_PRICE": 5.0,
+                                             "PRODUCT_TOTAL_PRICE": 10.0, "DISCOUNT_RATE": 10.0,
+                                             "CGST_AMOUNT": 0.45, "SGST_AMOUNT": 0.45})
+    assert set(product) == set(document_class.Product.model_fields)
+    assert product["HSN"] == "Null" and product["MRP"] == 0.0
+    assert product["GROSS_AMOUNT"] == 10.0
+    assert product["TAXABLE_AMOUNT"] == 9.0
+    assert product["NET_AMOUNT"] == 9.9
+    kept = region_schemas.expand_product({"PRODUCT_TOTAL_PRICE": 10.0, "NET_AMOUNT": 12.0})
+    assert kept["NET_AMOUNT"] == 12.0
+
+
+def test_expand_response_returns_the_canonical_model(sample):
+    data = sample('Sample_Invoice (1).json')
+    model, _, columns = region_schemas.select_model(document_class.Invoice, US_TEXT)
+    slim_rows = [{name: row[name] for name in columns} for row in data["product"]]
+    response = region_schemas.expand_response(model(**dict(data, product=slim_rows)), document_class.Invoice)
+    assert type(response) is document_class.Invoice
+    assert [row.PRODUCT_TOTAL_PRICE for row in response.product] == [row["PRODUCT_TOTAL_PRICE"]
+                                                                      for row in data["product"]]
@@ -0,0 +1,93 @@
+import json
+import asyncio
+from types import SimpleNamespace
+import pytest
+from pydantic import ValidationError
+import document_class
+import llm_client
+import response_schemas
+
+
+def completion(arguments=None):
+    tool_calls = None
+    if arguments is not None:
+        tool_calls = [SimpleNamespace(id="call_1", type="function",
+                                      function=SimpleNamespace(name="TotalBill", arguments=json.dumps(arguments)))]
+    message = SimpleNamespace(content=None, tool_calls=tool_calls)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=None)
+
+
+VALID = {"total": 100.0, "discount_amount": 0, "tax_amount": 18.0, "delivery_charges": 0, "final_total": 118.0}
+INVALID = dict(VALID, total="one hundred")
+
+
+class FakeClient:
+    """Answers chat.completions.create from a list of completions, recording each request."""
+
+    def __init__(self, *completions, is_async=False):
+        self.completions = list(completions)
+        self.requests = []
+        create = self.acreate if is_async else self.create
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=create))
+
+    def create(self, **kwargs):
+        self.requests.append(kwargs)
+        return self.completions.pop(0)
+
+    async def acreate(self, **kwargs):
+        return self.create(**kwargs)
+
+
+def test_request_kwargs_put_the_static_prefix_first():
+    prepared = response_schemas.prepare(document_class.Invoice)
+    assert response_schemas.prepare(document_class.Invoice) is prepared
+    kwargs = prepared.request_kwargs("gpt-4o", [{"role": "user", "content": "doc"}])
+    assert kwargs["messages"][0] == prepared.system_message
+    assert kwargs["tools"] == [prepared.tool]
+    assert kwargs["tool_choice"]["function"]["name"] == "Invoice"
+    assert kwargs["prompt_cache_key"].startswith("Invoice-")
+
+
+def test_valid_response_needs_one_request():
+    client = FakeClient(completion(VALID))
+    response, _ = response_schemas.create(client, "gpt-4o", document_class.TotalBill, [])
+    assert response.total == 100.0
+    assert len(client.requests) == 1
+
+
+def test_invalid_response_is_reasked_with_the_error():
+    client = FakeClient(completion(INVALID), completion(VALID))
+    messages = [{"role": "user", "content": "doc"}]
+    response, _ = response_schemas.create(client, "gpt-4o", document_class.TotalBill, messages)
+    assert response.total == 100.0
+    followup = client.requests[1]["messages"]
+    assert followup[-2]["role"] == "assistant" and followup[-2]["tool_calls"][0]["id"] == "call_1"
+    assert followup[-1]["role"] == "tool" and followup[-1]["tool_call_id"] == "call_1"
+    assert "total" in followup[-1]["content"]
+    assert messages == [{"role": "user", "content": "doc"}]
+
+
+def test_reasks_are_bounded():
+    client = FakeClient(completion(INVALID), completion(INVALID), completion(VALID))
+    with pytest.raises(ValidationError):
+        response_schemas.create(client, "gpt-4o", document_class.TotalBill, [], max_reasks=1)
+    assert len(client.requests) == 2
+    client = FakeClient(completion(INVALID))
+    with pytest.raises(ValidationError):
+        response_schemas.create(client, "gpt-4o", document_class.TotalBill, [], max_reasks=0)
+
+
+def test_missing_tool_call_is_reasked_async():
+    client = FakeClient(completion(), completion(VALID), is_async=True)
+    response, _ = asyncio.run(response_schemas.acreate(client, "gpt-4o", document_class.TotalBill, []))
+    assert response.final_total == 118.0
+    assert client.requests[1]["messages"][-1]["role"] == "user"
+    assert "TotalBill" in client.requests[1]["messages"][-1]["content"]
+
+
+def test_create_against_stub(stub):
+    client = llm_client.get_client("sk-test", stub.base_url)
+    response, completion = response_schemas.create(client, "gpt-4o", document_class.Invoice,
+                                                    [{"role": "user", "content": "invoice text"}])
+    assert response.invoice_number == "INV/2024/0789"
+    assert completion.usage.prompt_tokens > 0
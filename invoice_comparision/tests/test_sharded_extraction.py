@@ -0,0 +1,90 @@
+import document_class
+import rasterizer
+import text_layer
+from sharded_extraction import boundary_relation, merge_product_groups, check_products_total
+
+
+def row(description, count=10, price=5.0, **fields):
+    values = {name: 0.0 for name in document_class.Product.model_fields}
+    values.update(PRODUCT_DESCRIPTION=description, HSN="7318", COUNT=count, UNIT_ITEM_PRICE=price,
+                  PRODUCT_TOTAL_PRICE=count * price)
+    values.update(fields)
+    return values
+
+
+def test_truncated_description_is_a_split():
+    assert boundary_relation(row("BOLT SS304 M8 X 40MM ZINC PLATED"), row("BOLT SS304 M8 X 40")) == "split"
+
+
+def test_numbers_read_on_one_side_only_are_a_split():
+    cut = row("NUT M8", count=0, price=0.0)
+    assert boundary_relation(row("NUT M8"), cut) == "split"
+
+
+def test_complete_equal_rows_are_identical_and_different_rows_unrelated():
+    assert boundary_relation(row("NUT M8"), row("NUT M8")) == "identical"
+    assert boundary_relation(row("NUT M8"), row("NUT M10")) is None
+    assert boundary_relation(row("NUT M8", count=10), row("NUT M8", count=12)) is None
+
+
+def test_split_rows_are_merged_with_the_longer_description_and_both_sides_numbers():
+    first = [row("WASHER M6"), row("BOLT SS304 M8 X 40MM", count=0, price=0.0, PRODUCT_TOTAL_PRICE=50.0)]
+    second = [row("BOLT SS304 M8 X 40MM ZINC PLATED", PRODUCT_TOTAL_PRICE=0.0), row("NUT M8")]
+    products, removed, repeats = merge_product_groups([first, second])
+    assert (removed, repeats) == (1, 0)
+    assert [p["PRODUCT_DESCRIPTION"] for p in products] == ["WASHER M6", "BOLT SS304 M8 X 40MM ZINC PLATED", "NUT M8"]
+    assert products[1]["COUNT"] == 10 and products[1]["UNIT_ITEM_PRICE"] == 5.0
+    assert products[1]["PRODUCT_TOTAL_PRICE"] == 50.0
+
+
+def test_identical_rows_at_a_boundary_are_kept_by_default():
+    products, removed, repeats = merge_product_groups([[row("A"), row("NUT M8")], [row("NUT M8"), row("B")]])
+    assert len(products) == 4 and (removed, repeats) == (0, 1)
+
+
+def test_identical_rows_are_kept_when_the_unmerged_variant_reconciles():
+    groups = [[row("A"), row("NUT M8")], [row("NUT M8"), row("B")]]
+    products, removed, repeats = merge_product_groups(groups, {"total": 200.0})
+    assert len(products) == 4 and (removed, repeats) == (0, 1)
+
+
+def test_identical_rows_are_collapsed_when_only_that_reconciles():
+    groups = [[row("A"), row("NUT M8")], [row("NUT M8"), row("B")]]
+    products, removed, repeats = merge_product_groups(groups, {"total": 150.0})
+    assert [p["PRODUCT_DESCRIPTION"] for p in products] == ["A", "NUT M8", "B"]
+    assert (removed, repeats) == (1, 0)
+
+
+def test_products_total_check_uses_tolerance():
+    assert check_products_total([row("A"), row("B")], {"total": 100.4}) == (True, 100.0)
+    assert check_products_total([row("A"), row("B")], {"total": 150.0}) == (False, 100.0)
+
+
+def test_header_models_share_the_full_models_field_definitions():
+    for full, header in ((document_class.Invoice, document_class.InvoiceHeader),
+                         (document_class.PO, document_class.POHeader)):
+        assert list(header.model_fields) == [name for name in full.model_fields if name != "product"]
+        for name, field in header.model_fields.items():
+            assert field.annotation is full.model_fields[name].annotation
+            assert field.description == full.model_fields[name].description
+    product = document_class.ProductPage.model_fields["product"]
+    assert product.annotation == document_class.Invoice.model_fields["product"].annotation
+
+
+def test_sharded_extraction_reports_the_total_check_in_stats(make_parser, monkeypatch, sample):
+    pages = 9
+    parser = make_parser(shard_page_threshold=4, shard_group_size=4)
+    page_text = "TAX INVOICE INV/2024/0789 " + "Organic Apples 0810 100 150.00 15,000.00 " * 3
+    monkeypatch.setattr(rasterizer, "pdf_page_count", lambda input_file: pages)
+    monkeypatch.setattr(text_layer, "extract_page_texts", lambda input_file: [page_text] * pages)
+    stats = {}
+    response, file_num = parser.sharded_extractor.extract("long_invoice.pdf", "Invoice", stats)
+    invoice = sample("Sample_Invoice (1).json")
+    assert file_num == invoice["invoice_number"]
+    assert stats["page_groups"] == 3
+    # Every group answers with the same sample rows; the last and first rows at each boundary differ
+    assert len(response.product) == 3 * len(invoice["product"])
+    assert stats["duplicates_removed"] == 0 and stats["repeats_kept"] == 0
+    assert stats["products_total"] == round(3 * sum(p["PRODUCT_TOTAL_PRICE"] for p in invoice["product"]), 2)
+    assert stats["bill_total"] == invoice["total_bill"]["total"]
+    assert stats["products_total_ok"] is False
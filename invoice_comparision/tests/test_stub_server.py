@@ -0,0 +1,61 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import pytest
+import document_class
+import response_schemas
+import stub_server
+
+
+def test_parse_latency():
+    rng = random.Random(0)
+    assert stub_server.parse_latency('fixed:250')(rng) == 0.25
+    assert 0.1 <= stub_server.parse_latency('uniform:100,200')(rng) <= 0.2
+    assert stub_server.parse_latency('lognormal:1000,0.4')(rng) > 0
+    with pytest.raises(ValueError):
+        stub_server.parse_latency('normal:1')
+
+
+def test_request_random_is_per_request_and_seeded():
+    first, second = stub_server.StubState(seed=7), stub_server.StubState(seed=7)
+    draws = [first.request_random().random() for _ in range(5)]
+    assert draws == [second.request_random().random() for _ in range(5)]
+    assert len(set(draws)) == 5
+    assert first.request_random() is not first.request_random()
+
+
+def run_concurrent(requests, workers=8):
+    state = stub_server.StubState(seed=3, rate_429=0.2, rate_500=0.2)
+    server = stub_server.serve(port=0, state=state)
+    url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    body = response_schemas.prepare(document_class.Invoice).request_kwargs("gpt-4o", [
+        {"role": "user", "content": "invoice"}])
+    try:
+        with httpx.Client() as client, ThreadPoolExecutor(workers) as executor:
+            statuses = list(executor.map(lambda _: client.post(url, json=body).status_code, range(requests)))
+    finally:
+        server.shutdown()
+        server.server_close()
+    return statuses, state.stats()
+
+
+def test_injected_failures_are_reproducible_under_concurrency():
+    statuses, stats = run_concurrent(60)
+    again, stats_again = run_concurrent(60)
+    assert sorted(statuses) == sorted(again)
+    assert (stats["injected_429"], stats["injected_500"]) == (stats_again["injected_429"], stats_again["injected_500"])
+    assert stats["requests"] == 60
+    assert stats["ok"] + stats["injected_429"] + stats["injected_500"] == 60
+    assert 0 < stats["injected_429"] < 60 and 0 < stats["injected_500"] < 60
+
+
+def test_completion_projects_the_fixture_onto_the_requested_schema():
+    state = stub_server.StubState()
+    header = response_schemas.prepare(document_class.InvoiceHeader)
+    completion = state.completion(header.request_kwargs("gpt-4o", [{"role": "user", "content": "invoice"}]))
+    arguments = completion["choices"][0]["message"]["tool_calls"][0]["function"]["arguments"]
+    parsed = document_class.InvoiceHeader.model_validate_json(arguments)
+    assert parsed.invoice_number == "INV/2024/0789"
+    assert "product" not in arguments
+    assert completion["usage"]["total_tokens"] == (completion["usage"]["prompt_tokens"]
+                                                   + completion["usage"]["completion_tokens"])
@@ -0,0 +1,78 @@
+from docx import Document
+from openpyxl import Workbook
+import tabular_reader
+
+
+def write_xlsx(path):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = "Invoice"
+    sheet.append(["Invoice No", "INV/2024/0789"])
+    sheet.append([])
+    sheet.append(["S.No", "Item Description", "HSN/SAC", "Qty", "Rate", "Amount"])
+    sheet.append([1, "Organic Apples", "0810", 100, 150, 15000])
+    sheet.append([2, "Bananas", "0803", "12", "40.50", None])
+    sheet.append([None, "Sub Total", None, None, None, 15486])
+    sheet.append(["Payment due in 30 days"])
+    workbook.save(path)
+    return str(path)
+
+
+def write_docx(path):
+    document = Document()
+    document.add_paragraph("TAX INVOICE INV/2024/0789")
+    table = document.add_table(rows=3, cols=4)
+    for cells, values in zip((row.cells for row in table.rows),
+                             [["Particulars", "Quantity", "Unit Price", "Total"],
+                              ["Steel Bolts M8", "200", "2.50", "500.00"],
+                              ["Grand Total", "", "", "500.00"]]):
+        for cell, value in zip(cells, values):
+            cell.text = value
+    document.add_paragraph("Thank you for your business")
+    document.save(path)
+    return str(path)
+
+
+def test_header_mapping_needs_a_description_and_two_price_columns():
+    assert tabular_reader.map_header(["Description", "Qty", "Rate"]) == {
+        0: "PRODUCT_DESCRIPTION", 1: "COUNT", 2: "UNIT_ITEM_PRICE"}
+    assert tabular_reader.map_header(["Description", "Qty"]) is None
+    assert tabular_reader.map_header(["GST %", "CGST %"]) is None
+
+
+def test_row_to_product_derives_missing_amounts():
+    mapping = {0: "PRODUCT_DESCRIPTION", 1: "COUNT", 2: "UNIT_ITEM_PRICE", 3: "CGST_AMOUNT"}
+    product = tabular_reader.row_to_product(["Bananas", "12", "1,040.50", "9"], mapping)
+    assert product["COUNT"] == 12 and product["UNIT_ITEM_PRICE"] == 1040.5
+    assert product["PRODUCT_TOTAL_PRICE"] == product["TAXABLE_AMOUNT"] == product["GROSS_AMOUNT"] == 12486.0
+    assert product["NET_AMOUNT"] == 12495.0
+    assert product["HSN"] == "Null"
+
+
+def test_xlsx_line_items_and_metadata(tmp_path):
+    extraction = tabular_reader.read_tabular(write_xlsx(tmp_path / "invoice.xlsx"))
+    assert [(p["PRODUCT_DESCRIPTION"], p["COUNT"], p["PRODUCT_TOTAL_PRICE"]) for p in extraction.products] == [
+        ("Organic Apples", 100, 15000.0), ("Bananas", 12, 486.0)]
+    assert "Invoice No | INV/2024/0789" in extraction.metadata
+    assert "Sub Total | 15486" in extraction.metadata
+    assert "Organic Apples" not in extraction.metadata
+
+
+def test_docx_tables_are_read_in_body_order(tmp_path):
+    path = write_docx(tmp_path / "invoice.docx")
+    extraction = tabular_reader.read_tabular(path)
+    assert len(extraction.products) == 1 and extraction.products[0]["PRODUCT_TOTAL_PRICE"] == 500.0
+    assert extraction.metadata_lines == ["TAX INVOICE INV/2024/0789", "Grand Total | 500.00",
+                                         "Thank you for your business"]
+    text = tabular_reader.document_text(path)
+    assert "Steel Bolts M8 | 200 | 2.50 | 500.00" in text
+
+
+def test_parser_reads_line_items_locally_and_asks_the_model_for_the_header(make_parser, tmp_path, stub):
+    parser = make_parser()
+    stats = {}
+    response, file_num = parser.extract_tabular(write_xlsx(tmp_path / "invoice.xlsx"), "Invoice", stats)
+    assert stats["extraction_path"] == "tabular"
+    assert file_num == "INV/2024/0789"
+    assert [product.PRODUCT_DESCRIPTION for product in response.product] == ["Organic Apples", "Bananas"]
+    assert stub.stats()["ok"] == 1
@@ -0,0 +1,127 @@
+import copy
+import pytest
+import template_extractor
+from template_extractor import TemplateExtractor
+
+
+def invoice(number, rows):
+    products = [{"PRODUCT_DESCRIPTION": description, "HSN": hsn, "MRP": 0.0, "GROSS_AMOUNT": 0.0,
+                 "DISCOUNT_RATE": 0.0, "CGST_RATE": 0.0, "CGST_AMOUNT": 0.0, "SGST_RATE": 0.0, "SGST_AMOUNT": 0.0,
+                 "COUNT": count, "GST_RATE": 0.0, "GST_AMOUNT": 0.0, "UNIT_ITEM_PRICE": price,
+                 "PRODUCT_TOTAL_PRICE": count * price, "TAXABLE_AMOUNT": 0.0, "NET_AMOUNT": 0.0}
+                for description, hsn, count, price in rows]
+    total = sum(p["PRODUCT_TOTAL_PRICE"] for p in products)
+    return {
+        "invoice_number": number, "po_number": "PO/2024/0456", "contract_number": "NULL",
+        "shop_address": {"name": "FreshFarms Produce Ltd", "address_line": "88 Orchard Road", "city": "Nashik",
+                         "state_province_code": "MH", "postal_code": 422003},
+        "billing_address": {"name": "GreenLeaf Retail", "address_line": "12 Park Street", "city": "Mumbai",
+                            "state_province_code": "MH", "postal_code": 400001},
+        "product": products,
+        "milestone": "final",
+        "total_bill": {"total": total, "discount_amount": 0.0, "tax_amount": round(total * 0.05, 2),
+                       "delivery_charges": 0.0, "final_total": round(total * 1.05, 2)},
+    }
+
+
+def render(data):
+    """The text layer of an invoice printed on the vendor's template."""
+    lines = [data["shop_address"]["name"], "88 Orchard Road, Nashik",
+             f"Invoice No: {data['invoice_number']}", f"PO Ref: {data['po_number']}",
+             f"Milestone: {data['milestone'].upper()}", f"Bill To: {data['billing_address']['name']}", "",
+             "Description          HSN     Qty     Rate       Amount"]
+    for p in data["product"]:
+        lines.append(f"{p['PRODUCT_DESCRIPTION']:<20} {p['HSN']}    {p['COUNT']}     "
+                     f"{p['UNIT_ITEM_PRICE']:.2f}    {p['PRODUCT_TOTAL_PRICE']:.2f}")
+    bill = data["total_bill"]
+    lines += ["", f"Sub Total          {bill['total']:.2f}", f"GST 5%             {bill['tax_amount']:.2f}",
+              f"Grand Total        {bill['final_total']:.2f}"]
+    return '\n'.join(lines)
+
+
+FIRST = invoice("INV/2024/0789", [("Organic Apples", "0810", 100, 150.0), ("Organic Bananas", "0803", 200, 60.0)])
+SECOND = invoice("INV/2024/0790", [("Organic Oranges", "0805", 150, 120.0), ("Organic Apples", "0810", 10, 150.0),
+                                   ("Organic Pears", "0808", 40, 90.0)])
+
+
+@pytest.fixture
+def extractor(tmp_path, monkeypatch):
+    extractor = TemplateExtractor(str(tmp_path / "templates.json"))
+    texts = {}
+    monkeypatch.setattr(extractor, "document_text", lambda path: (texts.get(path), 'text_layer'))
+    extractor.texts = texts
+    return extractor
+
+
+def test_learn_records_labels_and_columns(extractor):
+    assert extractor.learn("Invoice", render(FIRST), FIRST)
+    template = extractor.templates["Invoice|freshfarms produce ltd"]
+    assert template["labels"]["invoice_number"] == "Invoice No"
+    assert template["labels"]["po_number"] == "PO Ref"
+    assert "contract_number" in template["null_fields"]
+    assert template["total_labels"]["total"] == "Sub Total"
+    assert template["total_labels"]["final_total"] == "Grand Total"
+    assert template["columns"] == ["HSN", "COUNT", "UNIT_ITEM_PRICE", "PRODUCT_TOTAL_PRICE"]
+    assert TemplateExtractor(extractor.templates_path).templates == extractor.templates
+
+
+def test_learn_skips_documents_without_the_vendor_name(extractor):
+    assert not extractor.learn("Invoice", render(FIRST).replace("FreshFarms", "Other"), FIRST)
+    assert not extractor.learn("Contract", render(FIRST), FIRST)
+
+
+def test_extract_a_new_document_of_a_learned_vendor(extractor):
+    extractor.learn("Invoice", render(FIRST), FIRST)
+    extractor.texts["second.pdf"] = render(SECOND)
+    result = extractor.extract("second.pdf", "Invoice")
+    response = result["response"].model_dump()
+    assert response["invoice_number"] == "INV/2024/0790"
+    assert response["contract_number"] == "NULL"
+    assert response["milestone"] == "final"
+    assert [p["PRODUCT_DESCRIPTION"] for p in response["product"]] == ["Organic Oranges", "Organic Apples",
+                                                                        "Organic Pears"]
+    assert response["product"][2]["HSN"] == "0808" and response["product"][2]["COUNT"] == 40
+    assert response["total_bill"] == SECOND["total_bill"]
+    assert result["checks"]["products_total_ok"] and result["checks"]["final_total_ok"]
+    assert result["confidence"] == 1.0
+
+
+def test_inconsistent_totals_lower_confidence(extractor):
+    extractor.learn("Invoice", render(FIRST), FIRST)
+    tampered = copy.deepcopy(SECOND)
+    tampered["total_bill"]["total"] += 500
+    extractor.texts["tampered.pdf"] = render(tampered)
+    result = extractor.extract("tampered.pdf", "Invoice")
+    assert not result["checks"]["products_total_ok"]
+    assert result["confidence"] < 0.9
+
+
+def test_unknown_vendor_or_missing_text_yields_no_response(extractor):
+    extractor.learn("Invoice", render(FIRST), FIRST)
+    extractor.texts["other.pdf"] = render(SECOND).replace("FreshFarms Produce Ltd", "Someone Else")
+    assert extractor.extract("other.pdf", "Invoice")["response"] is None
+    assert extractor.extract("scan.pdf", "Invoice") == {"response": None, "confidence": 0.0, "vendor": None,
+                                                        "source": 'text_layer', "text": None, "checks": {}}
+
+
+def test_document_text_without_text_layer_or_ocr(monkeypatch, tmp_path):
+    monkeypatch.setattr(template_extractor.text_layer, "extract_page_texts", lambda path: [])
+    monkeypatch.setattr(template_extractor, "pytesseract", None)
+    assert TemplateExtractor(str(tmp_path / "t.json")).document_text("scan.pdf") == (None, None)
+
+
+def test_parser_uses_local_tier_and_escalates(make_parser, make_image, extractor, monkeypatch, stub, activity_log):
+    parser = make_parser(local_extractor=extractor)
+    extractor.learn("Invoice", render(FIRST), FIRST)
+    confident, doubtful = make_image("second.png"), make_image("tampered.png")
+    extractor.texts[confident] = render(SECOND)
+    tampered = copy.deepcopy(SECOND)
+    tampered["total_bill"]["total"] += 500
+    extractor.texts[doubtful] = render(tampered)
+
+    assert parser.process_document(confident, "Invoice") == ("second.json", "INV/2024/0790")
+    assert stub.stats()["requests"] == 0
+    assert "via local path" in activity_log[-1]["comments"]
+    parser.process_document(doubtful, "Invoice")
+    assert stub.stats()["requests"] == 1
+    assert "escalated" in activity_log[-1]["comments"]
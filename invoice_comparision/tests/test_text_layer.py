@@ -0,0 +1,59 @@
+import shutil
+import text_layer
+
+GOOD_PAGE = ("TAX INVOICE  No: INV/2024/0789  Date: 12/03/2024\n"
+             "Organic Apples   0810   100   150.00   15,000.00\n"
+             "Total payable: 15,750.00")
+CID_PAGE = "(cid:12)(cid:44)(cid:55)(cid:3)(cid:81) " * 10
+
+
+def test_page_quality_separates_real_text_from_glyph_garbage():
+    assert text_layer.page_text_quality(GOOD_PAGE) > 0.85
+    assert text_layer.page_text_quality(CID_PAGE) < 0.5
+    assert text_layer.page_text_quality("   \n ") == 0.0
+
+
+def test_classify_pages_returns_one_based_page_numbers():
+    text_pages, vision_pages = text_layer.classify_pages([GOOD_PAGE, "", CID_PAGE, GOOD_PAGE])
+    assert text_pages == [1, 4]
+    assert vision_pages == [2, 3]
+
+
+def test_short_pages_need_vision():
+    assert not text_layer.is_usable_page("Page 2 of 3")
+
+
+def test_format_pages_labels_each_page():
+    formatted = text_layer.format_pages(["first  \n", "second"], [2, 1])
+    assert formatted == "--- Page 2 ---\nsecond\n\n--- Page 1 ---\nfirst"
+
+
+def test_missing_pdftotext_means_no_text_layer(monkeypatch, tmp_path):
+    monkeypatch.setattr(shutil, "which", lambda name: None)
+    assert text_layer.extract_page_texts(str(tmp_path / "scan.pdf")) == []
+
+
+def test_parser_sends_only_pages_without_text_as_images(make_parser, monkeypatch):
+    parser = make_parser()
+    monkeypatch.setattr(text_layer, "extract_page_texts", lambda input_file: [GOOD_PAGE, CID_PAGE, GOOD_PAGE])
+    rendered = []
+    monkeypatch.setattr(parser, "iter_encoded_pages",
+                        lambda input_file, pages=None: rendered.append(pages) or ["aGVsbG8=" for _ in pages])
+    messages, path = parser.build_pdf_messages("invoice.pdf")
+    assert path == "hybrid"
+    assert rendered == [[2]]
+    assert "--- Page 1 ---" in messages[0]["content"] and "--- Page 3 ---" in messages[0]["content"]
+    assert "Pages 2 have no usable text layer" in messages[0]["content"]
+    assert len(messages) == 2 and messages[1]["content"][0]["type"] == "image_url"
+
+
+def test_parser_sends_fully_digital_pdfs_as_text(make_parser, monkeypatch):
+    parser = make_parser()
+    monkeypatch.setattr(text_layer, "extract_page_texts", lambda input_file: [GOOD_PAGE, GOOD_PAGE])
+    monkeypatch.setattr(parser, "iter_encoded_pages", lambda *args, **kwargs: not_rasterized())
+    messages, path = parser.build_pdf_messages("invoice.pdf")
+    assert path == "text" and len(messages) == 1
+
+
+def not_rasterized():
+    raise AssertionError("a text-only PDF must not be rasterized")
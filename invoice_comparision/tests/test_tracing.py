@@ -0,0 +1,108 @@
+import json
+import time
+import asyncio
+import pytest
+import tracing
+
+
+@pytest.fixture
+def spans(monkeypatch):
+    """Finished span records, in the order they end."""
+    records = []
+    monkeypatch.setattr(tracing, "_tracer", tracing.Tracer([records.append]))
+    return records
+
+
+def by_name(records):
+    return {record["name"]: record for record in records}
+
+
+def test_spans_nest_and_record_errors(spans):
+    with tracing.span("outer", a=1) as outer:
+        with tracing.span("inner"):
+            assert tracing.current_span().name == "inner"
+        with pytest.raises(ValueError):
+            with tracing.span("failing"):
+                raise ValueError("bad")
+        outer.add("count", 2)
+        outer.add("count", 3)
+    assert tracing.current_span() is None
+    records = by_name(spans)
+    assert records["inner"]["parent_span_id"] == records["outer"]["span_id"]
+    assert records["inner"]["trace_id"] == records["outer"]["trace_id"]
+    assert records["failing"]["status"] == "ERROR" and "ValueError: bad" in records["failing"]["attributes"]["error"]
+    assert records["outer"]["attributes"] == {"a": 1, "count": 5}
+
+
+def test_json_lines_exporter(tmp_path, monkeypatch):
+    path = tmp_path / "traces" / "spans.jsonl"
+    monkeypatch.setattr(tracing, "_tracer", tracing.Tracer())
+    tracing.configure(trace_path=str(path))
+    try:
+        with tracing.span("root"):
+            pass
+    finally:
+        monkeypatch.setattr(tracing, "_tracer", tracing.Tracer())
+    record = json.loads(path.read_text().strip())
+    assert record["name"] == "root" and record["parent_span_id"] is None
+
+
+def test_span_iter_times_production_only(spans):
+    def slow_pages():
+        for page in range(3):
+            time.sleep(0.01)
+            assert tracing.current_span().name == "encode"
+            tracing.current_span().add("pages", 1)
+            yield page
+
+    with tracing.span("prepare"):
+        pages = tracing.span_iter(slow_pages(), "encode")
+        for page in pages:
+            assert tracing.current_span().name == "prepare"
+            time.sleep(0.05)
+    records = by_name(spans)
+    assert records["encode"]["parent_span_id"] == records["prepare"]["span_id"]
+    assert records["encode"]["attributes"]["pages"] == 3
+    assert 25 <= records["encode"]["duration_ms"] < 100
+    assert records["prepare"]["duration_ms"] >= 150
+
+
+def test_span_iter_records_errors_and_abandoned_iteration(spans):
+    def failing():
+        yield 1
+        raise RuntimeError("render failed")
+
+    with pytest.raises(RuntimeError):
+        list(tracing.span_iter(failing(), "encode"))
+    pages = tracing.span_iter(iter(range(5)), "partial")
+    next(pages)
+    pages.close()
+    records = by_name(spans)
+    assert records["encode"]["status"] == "ERROR"
+    assert records["partial"]["status"] == "OK"
+    assert tracing.current_span() is None
+
+
+def test_parser_records_encode_pages_span(make_parser, make_image, spans):
+    make_parser().process_document(make_image("invoice.png"), "Invoice")
+    records = by_name(spans)
+    encode = records["encode_pages"]
+    assert encode["parent_span_id"] == records["prepare_messages"]["span_id"]
+    assert encode["attributes"]["pages"] == 1 and encode["attributes"]["bytes"] > 0
+    assert "extract_images" not in records and "encode_images" not in records
+
+
+def test_async_generate_response_spans_match_sync(make_parser, make_image, spans):
+    parser = make_parser()
+    path = make_image("invoice.png")
+    parser.process_document(path, "Invoice")
+    sync_spans = by_name(spans)
+    spans.clear()
+    asyncio.run(parser.aprocess_document(path, "Invoice", bypass_cache=True))
+    async_spans = by_name(spans)
+    for spans_of_run in (sync_spans, async_spans):
+        assert spans_of_run["llm_call"]["parent_span_id"] == spans_of_run["generate_response"]["span_id"]
+    for name in ("generate_response", "llm_call"):
+        assert async_spans[name]["attributes"].keys() == sync_spans[name]["attributes"].keys()
+    assert async_spans["llm_call"]["attributes"]["response_model"] == sync_spans["llm_call"]["attributes"]["response_model"]
+    assert async_spans["generate_response"]["attributes"] == sync_spans["generate_response"]["attributes"]
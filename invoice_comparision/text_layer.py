@@ -0,0 +1,72 @@
+import re
+import shutil
+import subprocess
+
+PAGE_BREAK = '\f'
+TOKEN_RE = re.compile(r'\S+')
+WORD_RE = re.compile(r"^[\w$₹€£%.,:;/#&()'\"+-]+$")
+
+
+def extract_page_texts(input_file):
+    """
+    Extract the native text layer of a PDF, one string per page.
+
+    Uses poppler's pdftotext, which ships alongside the pdftoppm binary pdf2image already needs.
+    Returns an empty list if pdftotext is unavailable or the PDF cannot be read.
+    """
+    if shutil.which('pdftotext') is None:
+        return []
+    try:
+        result = subprocess.run(
+            ['pdftotext', '-layout', '-enc', 'UTF-8', input_file, '-'],
+            check=True, capture_output=True, timeout=120,
+        )
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return []
+    pages = result.stdout.decode('utf-8', errors='replace').split(PAGE_BREAK)
+    # pdftotext terminates the last page with a form feed as well
+    if pages and not pages[-1].strip():
+        pages.pop()
+    return pages
+
+
+def page_text_quality(text):
+    """
+    Score how trustworthy a page's text layer is, from 0 (unusable) to 1.
+
+    Scanned pages usually have no text, OCR-less image PDFs produce replacement characters or
+    '(cid:NN)' glyph references, and broken font encodings produce long runs of symbols.
+    """
+    stripped = text.strip()
+    if not stripped:
+        return 0.0
+    garbage = stripped.count('�') + 4 * stripped.count('(cid:')
+    printable = sum(1 for ch in stripped if ch.isprintable() or ch.isspace())
+    char_score = max(0.0, (printable - garbage) / len(stripped))
+
+    tokens = TOKEN_RE.findall(stripped)
+    word_score = sum(1 for token in tokens if WORD_RE.match(token)) / len(tokens)
+    return char_score * word_score
+
+
+def is_usable_page(text, min_chars=40, min_quality=0.85):
+    return len(''.join(text.split())) >= min_chars and page_text_quality(text) >= min_quality
+
+
+def classify_pages(page_texts, min_chars=40, min_quality=0.85):
+    """
+    Split pages into those whose text layer can be sent as text and those that need vision.
+
+    :return: (text_pages, vision_pages) as lists of 1-based page numbers.
+    """
+    text_pages, vision_pages = [], []
+    for number, text in enumerate(page_texts, start=1):
+        if is_usable_page(text, min_chars, min_quality):
+            text_pages.append(number)
+        else:
+            vision_pages.append(number)
+    return text_pages, vision_pages
+
+
+def format_pages(page_texts, pages):
+    return '\n\n'.join(f"--- Page {number} ---\n{page_texts[number - 1].rstrip()}" for number in pages)
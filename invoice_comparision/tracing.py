@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+        self.status = "OK"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, key, amount):
+        """Accumulate a counter attribute, e.g. bytes or milliseconds spent in a sub-step."""
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def to_dict(self):
+        # Field names follow the OpenTelemetry span data model so the file can be replayed into an OTLP collector
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.start_ns + int(self.duration_ms * 1e6),
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class JsonLinesExporter:
+    """Appends one JSON object per finished span to a trace file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+
+class OpenTelemetryExporter:
+    """Re-emits finished spans through the opentelemetry API (requires opentelemetry-api/sdk to be installed)."""
+
+    def __init__(self, tracer_name="invoice_comparision"):
+        from opentelemetry import trace
+        self.tracer = trace.get_tracer(tracer_name)
+
+    def __call__(self, record):
+        attributes = {key: value if isinstance(value, (str, bool, int, float)) else str(value)
+                      for key, value in record["attributes"].items()}
+        attributes["app.trace_id"] = record["trace_id"]
+        attributes["app.span_id"] = record["span_id"]
+        attributes["app.parent_span_id"] = record["parent_span_id"] or ""
+        span = self.tracer.start_span(record["name"], start_time=record["start_time_unix_nano"],
+                                      attributes=attributes)
+        span.end(end_time=record["end_time_unix_nano"])
+
+
+class Tracer:
+    """
+    Nested timing spans for the parse pipeline.
+
+    The active span is tracked in a context variable, so nesting follows asyncio tasks and
+    asyncio.to_thread calls. Without exporters spans are still timed but not recorded.
+    """
+
+    def __init__(self, exporters=None):
+        self.exporters = list(exporters or [])
+
+    def _export(self, span):
+        for exporter in self.exporters:
+            exporter(span.to_dict())
+
+    @contextmanager
+    def span(self, name, **attributes):
+        parent = _current_span.get()
+        trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        span = Span(name, trace_id, parent.span_id if parent else None, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "ERROR"
+            span.set(error=f"{e.__class__.__name__}: {e}")
+            raise
+        finally:
+            span.duration_ms = (time.perf_counter() - span._start) * 1000
+            _current_span.reset(token)
+            self._export(span)
+
+    def span_iter(self, iterable, name, **attributes):
+        """
+        Yield from a lazy iterable under a span that is current only while items are produced.
+
+        The span is parented where iteration starts and its duration is the time spent producing
+        items, not the time the consumer holds them; it is recorded when the iterable is exhausted
+        or closed.
+        """
+        parent = _current_span.get()
+        span = Span(name, parent.trace_id if parent else uuid.uuid4().hex,
+                    parent.span_id if parent else None, attributes)
+        busy = 0.0
+        try:
+            iterator = iter(iterable)
+            while True:
+                token = _current_span.set(span)
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                except BaseException as e:
+                    span.status = "ERROR"
+                    span.set(error=f"{e.__class__.__name__}: {e}")
+                    raise
+                finally:
+                    busy += time.perf_counter() - start
+                    _current_span.reset(token)
+                yield item
+        finally:
+            span.duration_ms = busy * 1000
+            self._export(span)
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    return _tracer
+
+
+def configure(trace_path=None, opentelemetry=False):
+    """
+    Install the process-wide tracer.
+
+    :param trace_path: JSON-lines file to write spans to.
+    :param opentelemetry: Also forward spans to the opentelemetry API.
+    """
+    global _tracer
+    exporters = []
+    if trace_path:
+        exporters.append(JsonLinesExporter(trace_path))
+    if opentelemetry:
+        exporters.append(OpenTelemetryExporter())
+    _tracer = Tracer(exporters)
+    return _tracer
+
+
+def span(name, **attributes):
+    return _tracer.span(name, **attributes)
+
+
+def span_iter(iterable, name, **attributes):
+    return _tracer.span_iter(iterable, name, **attributes)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def timed_iter(iterable, key):
+    """Yield from iterable, adding the milliseconds spent producing items to the current span under key."""
+    owner = _current_span.get()
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            if owner is not None:
+                owner.add(key, (time.perf_counter() - start) * 1000)
+        yield item
@@ -2,35 +2,74 @@ import json
 from datetime import datetime
 from typing import List, Dict, Tuple, Union
 from logger import ActivityLogger
+from reference_index import ReferenceIndex
+from product_matching import ProductMatcher, repeat_groups
+from line_comparison import LineComparator
+import comparison_plans
 import json
 
+# Product fields that scale with the billed quantity; rows sharing a PO line are checked on their sums
+QUANTITY_FIELDS = {"COUNT", "PRODUCT_TOTAL_PRICE", "GROSS_AMOUNT", "TAXABLE_AMOUNT", "NET_AMOUNT",
+                   "CGST_AMOUNT", "SGST_AMOUNT", "GST_AMOUNT"}
+
 
 class InvoicePOValidator:
-    def __init__(self, user: str = "system"):
-        self.logger = ActivityLogger(agent_name="invoice_mismatch")
+    def __init__(self, user: str = "system", reference_index: ReferenceIndex = None, defer_logs: bool = False,
+                 tolerances: Dict = None, plans: Dict = None, ledger=None):
+        """
+        :param reference_index: Resolves the PO/contract of an invoice when validate_invoice is not given one.
+        :param defer_logs: Collect log entries in pending_logs instead of writing them, for
+                           ActivityLogger.insert_logs to write in one batch (no database connection is opened).
+        :param tolerances: Per-field (absolute, relative) tolerances for numeric product fields,
+                           overriding line_comparison.DEFAULT_TOLERANCES.
+        :param plans: Comparison rules per reference doctype, replacing comparison_plans.PLANS.
+        :param ledger: consumption_ledger.ConsumptionLedger; validate_po then records each invoice against
+                       its PO and reports lines billed beyond what the PO ordered across all invoices.
+        """
+        self.ledger = ledger
+        self.line_comparator = LineComparator(tolerances)
+        self.plans = comparison_plans.compile_plans(plans)
+        self.logger = None if defer_logs else ActivityLogger(agent_name="invoice_mismatch")
+        self.pending_logs = [] if defer_logs else None
         self.user = user
         self.doc_type = ""
+        self.reference_index = reference_index
 
-    def address_compare(self, category: str, contract: Dict, invoice: Dict) -> Dict:
-        ROUTE_KEY = {
-            "PO": "PO_value",
-            "Contract": "Contract"
-        }
-
-        mismatches = {
-            "Issue_category": category,
-            f"{category}": {
-
-            }
-        }
-        flag: int = 0
-
-        for key in set(contract) | set(invoice):  # union of keys
-            if contract.get(key) != invoice.get(key):
-                flag = 1
-                mismatches[category][key] = {ROUTE_KEY[self.doc_type]: contract.get(key), 'Invoice': invoice.get(key)}
-
-        return mismatches if flag else None
+    def write_log(self, log_dict: Dict, mismatch_fields: Dict = None):
+        if self.pending_logs is not None:
+            self.pending_logs.append({"log": log_dict, "doc_type": self.doc_type, "fields": mismatch_fields})
+            return None
+        log_id = self.logger.insert_log(log_dict)
+        if mismatch_fields is not None:
+            self.logger.insert_fields(self.doc_type, log_id, mismatch_fields)
+        return log_id
+
+    @staticmethod
+    def prepare_reference(doctype: str, reference_data: Dict) -> Dict:
+        """
+        Lookup tables of a PO or contract, built once when it is compared against many invoices.
+
+        :return: dict passed as 'prepared' to validate_invoice/validate_po/validate_contract.
+        """
+        if doctype == "PO":
+            return {"matcher": ProductMatcher(reference_data["product"])}
+        schedule = reference_data.get("payment_terms", {}).get("payment_schedule", [])
+        milestones = {}
+        for s in schedule:
+            milestones.setdefault(s["milestone"].strip().lower(), s)
+        return {"milestones": milestones}
+
+    def rule_stats(self) -> Dict:
+        """:return: Per doctype and rule: runs, hits, findings and timings since this validator was created."""
+        return {doctype: plan.stats() for doctype, plan in self.plans.items()}
+
+    def resolve_reference(self, doctype: str, number: str, vendor_name: str) -> Union[Dict, None]:
+        if self.reference_index is None:
+            return None
+        document = self.reference_index.get_document(doctype, number, vendor_name)
+        if document is not None:
+            print(f"Resolved {doctype} {number} for {vendor_name} from the reference index")
+        return document
 
     def missing_len(self, mismatch_data: Dict) -> int:
         count = 0
@@ -40,36 +79,70 @@ class InvoicePOValidator:
             count = len(data) + count
         return count
 
-    def MismatchProduct_details(self, Invoice_data, PO_data):
+    def match_products(self, invoice_data: Dict, po_data: Dict, prepared: Dict = None) -> List:
+        """
+        Pair every invoice product with a PO product, tolerating OCR drift in descriptions.
+
+        :return: Per invoice product, the matched PO product dict or None.
+        """
+        matcher = prepared["matcher"] if prepared else ProductMatcher(po_data["product"])
+        return [None if index is None else po_data["product"][index]
+                for index, _ in matcher.match(invoice_data["product"])]
+
+    def compare_numeric(self, invoice_products: List, matches: List) -> List:
+        """
+        :return: Per invoice product, the numeric fields differing from its matched PO product
+                 beyond tolerance, or None when it has no match. Quantity fields of rows that share
+                 a PO line are left out; repeated_rows_mismatches checks their sums.
+        """
+        pairs = [(inv, po) for inv, po in zip(invoice_products, matches) if po is not None]
+        differing = iter(self.line_comparator.numeric_mismatches([inv for inv, _ in pairs], [po for _, po in pairs]))
+        numeric_diffs = [None if po is None else next(differing) for po in matches]
+        for group in repeat_groups(matches):
+            for position in group:
+                numeric_diffs[position] = numeric_diffs[position] - QUANTITY_FIELDS
+        return numeric_diffs
+
+    @staticmethod
+    def repeated_rows_mismatches(invoice_products: List, matches: List) -> List:
+        """
+        :return: One issue per PO line billed in several invoice rows whose summed COUNT exceeds
+                 the PO quantity.
+        """
+        issues = []
+        for group in repeat_groups(matches):
+            po_item = matches[group[0]]
+            quantity_po = float(po_item['COUNT'])
+            quantity_invoice = sum(float(invoice_products[position]['COUNT']) for position in group)
+            if quantity_invoice > quantity_po:
+                issues.append({
+                    "Issue": "Repeated rows exceed PO quantity",
+                    "Item": po_item['PRODUCT_DESCRIPTION'],
+                    "Rows": len(group),
+                    "Quantity PO": quantity_po,
+                    "Quantity Invoice": quantity_invoice,
+                })
+        return issues
+
+    def MismatchProduct_details(self, Invoice_data, PO_data, matches: List = None, numeric_diffs: List = None):
         mismatches = {
             "mismatch_len": 0,
             "mismatches": [],
         }
-
-        invoice_products = {p["PRODUCT_DESCRIPTION"]: p for p in Invoice_data["product"]}
-        po_products = {p["PRODUCT_DESCRIPTION"]: p for p in PO_data["product"]}
+        if matches is None:
+            matches = self.match_products(Invoice_data, PO_data)
+        if numeric_diffs is None:
+            numeric_diffs = self.compare_numeric(Invoice_data["product"], matches)
 
         # Compare only if product exists in both
-        for desc in invoice_products.keys() & po_products.keys():
-            inv_prod = invoice_products[desc]
-            po_prod = po_products[desc]
-            field_diffs = {}
-
-            for key in inv_prod.keys():
-                if key in po_prod and inv_prod[key] != po_prod[key]:
-                    field_diffs[key] = {
-                        "Invoice": inv_prod[key],
-                        "PO_value": po_prod[key]
-                    }
-
-            if field_diffs:
-                mismatches["mismatches"].append({
-                    "Issue_category": desc,
-                    desc: field_diffs,
-                })
+        for desc, field_diffs in comparison_plans.product_field_diffs(Invoice_data["product"], matches, numeric_diffs):
+            mismatches["mismatches"].append({
+                "Issue_category": desc,
+                desc: field_diffs,
+            })
         return mismatches
 
-    def validate_po(self, po_data, invoice_data) -> Tuple[bool, List[Dict]]:
+    def validate_po(self, po_data, invoice_data, prepared: Dict = None) -> Tuple[bool, List[Dict]]:
         self.doc_type = "PO"
         log_dict = {
             "user_id": self.user,
@@ -81,50 +154,35 @@ class InvoicePOValidator:
 
         mismatch_data = []
 
-        po_shop_address = po_data["shop_address"]
-        po_billing_address = po_data["billing_address"]
-
-        invoice_shop_address = invoice_data["shop_address"]
-        invoice_billing_address = invoice_data["billing_address"]
-
-        missing_shop_address = self.address_compare("seller_address", po_shop_address, invoice_shop_address)
-        missing_billing_address = self.address_compare("buyer_address", po_billing_address, invoice_billing_address)
-
-        product_mismatch_data = self.MismatchProduct_details(invoice_data, po_data)
-
-        if missing_shop_address is not None:
-            product_mismatch_data["mismatches"].append(missing_shop_address)
-
-        if missing_billing_address is not None:
-            product_mismatch_data["mismatches"].append(missing_billing_address)
+        matches = self.match_products(invoice_data, po_data, prepared)
+        numeric_diffs = self.compare_numeric(invoice_data["product"], matches)
+        findings = self.plans["PO"].run(invoice_data, po_data, {"matches": matches, "numeric_diffs": numeric_diffs})
+        product_mismatch_data = {
+            "mismatch_len": 0,
+            "mismatches": comparison_plans.as_mismatches(findings),
+        }
 
         print("----------------product mismatch_data")
         print(product_mismatch_data)
         print("-" * 90)
 
         vendor_name = invoice_data.get('shop_address', {}).get('name', 'Unknown Vendor')
-        po_items_map = {
-            item['PRODUCT_DESCRIPTION'].upper(): item for item in po_data['product']
-        }
         invoice_product_data = invoice_data['product']
 
-        for inv in invoice_product_data:
-            item_name = inv['PRODUCT_DESCRIPTION'].upper()
-            if item_name not in po_items_map:
+        for inv, po_item, differing in zip(invoice_product_data, matches, numeric_diffs):
+            if po_item is None:
                 mismatch_data.append({
                     "Issue": f"Item not found in PO",
                     "Item": inv['PRODUCT_DESCRIPTION'],
                 })
                 continue
 
-            po_item = po_items_map[item_name]
             quantity_po = float(po_item['COUNT'])
             quantity_invoice = float(inv['COUNT'])
             rate_po = float(po_item['UNIT_ITEM_PRICE'])
             rate_invoice = float(inv['UNIT_ITEM_PRICE'])
 
-            # print(quantity_po, quantity_invoice, rate_po, rate_invoice)
-            if quantity_po != quantity_invoice or rate_po != rate_invoice:
+            if "COUNT" in differing or "UNIT_ITEM_PRICE" in differing:
                 mismatch_data.append({
                     "Issue": "Mismatch in quantity or rate",
                     "Item": inv['PRODUCT_DESCRIPTION'],
@@ -135,6 +193,10 @@ class InvoicePOValidator:
                     "Total Amount PO": quantity_po * rate_po,
                     "Total Amount Invoice": quantity_invoice * rate_invoice
                 })
+        mismatch_data.extend(self.repeated_rows_mismatches(invoice_product_data, matches))
+
+        if self.ledger is not None:
+            mismatch_data.extend(self.ledger.consume(po_data, invoice_data, matches))
 
         mismatch_count = len(mismatch_data)
         log_dict["mismatch_count"] = mismatch_count
@@ -151,13 +213,11 @@ class InvoicePOValidator:
             log_dict["outcome"] = "No Mismatch"
             log_dict["comments"] = f"No mismatches found for {invoice_data.get('invoice_number')}."
 
-        log_id = self.logger.insert_log(log_dict)
-
-        self.logger.insert_fields(self.doc_type, log_id, product_mismatch_data)
+        self.write_log(log_dict, product_mismatch_data)
 
         return is_mismatch, mismatch_data, vendor_name
 
-    def validate_contract(self, contract_data, invoice_data) -> Tuple[bool, List[Dict]]:
+    def validate_contract(self, contract_data, invoice_data, prepared: Dict = None) -> Tuple[bool, List[Dict]]:
         self.doc_type = "Contract"
         log_dict = {
             "mismatch_count": 0,
@@ -174,85 +234,13 @@ class InvoicePOValidator:
         }
         vendor_name = invoice_data.get('shop_address', {}).get('name', 'Unknown Vendor')
 
-        contract_id = str(contract_data.get("contract_number", "")).strip()
-        invoice_contract_id = str(invoice_data.get("contract_number", "")).strip()
-
-        if contract_id != invoice_contract_id:
-            log_dict["mismatch_count"] = log_dict["mismatch_count"] + 1
-            log_dict["event_dts"] = datetime.now()
-            log_dict["status"] = "Success"
-            log_dict["outcome"] = "Mismatch"
-            log_dict[
-                "comments"] = f"The contract number, {contract_id}, in 'contract_doc' does not match the contract number, {invoice_contract_id}, in the invoice."
-            mismatch_data["mismatches"].append({
-                "Issue_category": f"Contract Number",
-                "Contract Number": [{
-                    f"Contract": contract_id,
-                    f"Invoice": invoice_contract_id,
-                }],
-            })
+        context = dict(prepared or self.prepare_reference(self.doc_type, contract_data))
+        findings = self.plans["Contract"].run(invoice_data, contract_data, context)
+        mismatch_data["mismatches"] = comparison_plans.as_mismatches(findings)
 
+        if findings and findings[-1][0].severity == "blocking":
             return True, mismatch_data, vendor_name
-
-        milestone = invoice_data.get("milestone", "").strip().lower()
-        schedule = contract_data.get("payment_terms", {}).get("payment_schedule", [])
-        milestone_match = next((s for s in schedule if s["milestone"].strip().lower() == milestone), None)
-
-        if not milestone_match:
-            log_dict["mismatch_count"] = log_dict["mismatch_count"] + 1
-            log_dict["event_dts"] = datetime.now()
-            log_dict["status"] = "Success"
-            log_dict["outcome"] = "Mismatch"
-            log_dict["comments"] = f"Milestone '{milestone}' not found in contract payment schedule."
-
-            mismatch_data["mismatches"].append({
-                "Issue_category": f"Milestone",
-                "Milestone": {
-                    f"Contract": milestone_match,
-                    f"Invoice": milestone,
-                },
-            })
-        else:
-            expected_percent = float(milestone_match["percentage"])
-            total_contract_value = float(contract_data["total_contract_value"])
-            expected_amount = round((expected_percent / 100) * total_contract_value, 2)
-            invoice_total = round(float(invoice_data["total_bill"]["final_total"]), 2)
-
-            if invoice_total != expected_amount:
-                log_dict["mismatch_count"] = log_dict["mismatch_count"] + 1
-                log_dict["event_dts"] = datetime.now()
-                log_dict["status"] = "Success"
-                log_dict["outcome"] = "Mismatch"
-                log_dict[
-                    "comments"] = f"Invoice total {invoice_total} does not match expected amount {expected_amount} for milestone '{milestone}'."
-
-                mismatch_data["mismatches"].append({
-                    "Issue_category": "Billing",
-                    "Billing": {
-                        str(milestone): {
-                            "Contract": expected_amount,
-                            "Invoice": invoice_total,
-                        },
-                    }
-                }
-                )
-
-        Contract_seller_address = contract_data.get("seller_address", {})
-        Contract_buyer_address = contract_data.get("buyer_address", {})
-
-        invoice_shop_address = invoice_data.get("shop_address", {})
-        invoice_billing_address = invoice_data.get("billing_address", {})
-
-        missing_shop_address = self.address_compare("seller_address", Contract_seller_address, invoice_shop_address)
-        missing_billing_address = self.address_compare("buyer_address", Contract_buyer_address, invoice_billing_address)
-
-        if missing_shop_address:
-            log_dict["mismatch_count"] = log_dict["mismatch_count"] + 1
-            mismatch_data["mismatches"].append(missing_shop_address)
-
-        if missing_billing_address:
-            log_dict["mismatch_count"] = log_dict["mismatch_count"] + 1
-            mismatch_data["mismatches"].append(missing_billing_address)
+        log_dict["mismatch_count"] = len(findings)
 
         mismatch_category = [mismatch["Issue_category"] for mismatch in mismatch_data["mismatches"]]
         # missing_len = self.missing_len(mismatch_data["mismatches"])
@@ -267,19 +255,22 @@ class InvoicePOValidator:
 
         is_mismatch = len(mismatch_data) > 0
 
-        log_id = self.logger.insert_log(log_dict)
-
-        self.logger.insert_fields(self.doc_type, log_id, mismatch_data)
+        self.write_log(log_dict, mismatch_data)
 
         return is_mismatch, mismatch_data, vendor_name
 
-    def validate_invoice(self, invoice_data: Dict, po_data: Dict = None, contract_data: Dict = None) -> Tuple[
-        bool, List[Dict]]:
+    def validate_invoice(self, invoice_data: Dict, po_data: Dict = None, contract_data: Dict = None,
+                         prepared: Dict = None) -> Tuple[bool, List[Dict]]:
+        """
+        :param prepared: prepare_reference() output for the po_data/contract_data passed in.
+        """
         vendor_name = invoice_data.get('shop_address', {}).get('name', 'Unknown Vendor')
         contract_id = invoice_data.get("contract_number", "").strip()
         po_number = invoice_data.get("po_number", "").strip()
 
         if contract_id and contract_id.upper() != "NULL":
+            if not contract_data:
+                contract_data = self.resolve_reference("Contract", contract_id, vendor_name)
             if not contract_data:
                 log_dict = {
                     "user_id": self.user,
@@ -290,11 +281,14 @@ class InvoicePOValidator:
                     "event_dts": datetime.now(),
                     "comments": f"Contract file not provided for contract_id: {contract_id}",
                 }
-                self.logger.insert_log(log_dict)
+                self.doc_type = log_dict["compared_document_type"]
+                self.write_log(log_dict)
                 return True, [{"Issue": f"Contract file not provided for contract_id: {contract_id}"}], vendor_name
-            return self.validate_contract(contract_data, invoice_data)
+            return self.validate_contract(contract_data, invoice_data, prepared)
 
         if po_number and po_number.upper() != "NULL":
+            if not po_data:
+                po_data = self.resolve_reference("PO", po_number, vendor_name)
             if not po_data:
                 log_dict = {
                     "user_id": self.user,
@@ -305,9 +299,10 @@ class InvoicePOValidator:
                     "event_dts": datetime.now(),
                     "comments": f"PO file not provided for po_number: {po_number}",
                 }
-                self.logger.insert_log(log_dict)
+                self.doc_type = log_dict["compared_document_type"]
+                self.write_log(log_dict)
                 return True, [{"Issue": f"PO file not provided for po_number: {po_number}"}], vendor_name
-            return self.validate_po(po_data, invoice_data)
+            return self.validate_po(po_data, invoice_data, prepared)
 
         log_dict = {
             "user_id": self.user,
@@ -316,7 +311,7 @@ class InvoicePOValidator:
             "event_dts": datetime.now(),
             "comments": "Neither valid contract_number nor po_number provided in invoice.",
         }
-        self.logger.insert_log(log_dict)
+        self.write_log(log_dict)
         return True, [{"Issue": "Neither valid contract_number nor po_number provided in invoice."}], vendor_name
 
 